@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+" This script writes the MTurk input csv of the next round of comparisons,
+" picking the image pairs where a comparison is expected to tell the most
+" about the scores, instead of a fixed number of random pairs per image.
+"
+" The scores and their uncertainty are computed from the comparisons of
+" `--source` in the database. Pairs of images with close scores and with few
+" comparisons so far are preferred, see `analysis/lib/active_pairs.py`. Images
+" of `--images-source` in the Images table that were never compared are
+" included as new images. The pairs are packed into HITs as in
+" `amazon_input_driver.py`.
+"
+" **Usage:**
+"
+" ```
+"   ./active_pairs_driver.py -k 2 --output-csv mturk-input-round2.csv
+"   ./active_pairs_driver.py --images-source "Luca Rossi - ECB" --n-pairs 5000
+" ```
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+from protestDB import cursor, models
+from analysis.lib import active_pairs, comparison_graph, hit_packer, mturk_batch
+
+SOURCE = "Luca Rossi - ECB, 1000"
+
+
+def main(**kwargs):
+    pc = cursor.ProtestCursor()
+    comparisons = comparison_graph.LoadComparisons(pc, kwargs['source'])
+    images, index1, index2 = comparison_graph.IndexComparisons(comparisons)
+
+    if kwargs['images_source']:
+        hashes = [h for (h,) in pc.query(models.Images.imageHASH).filter_by(
+            source=kwargs['images_source']
+        )]
+        new = np.setdiff1d(np.asarray(hashes, dtype=object), images)
+        images = np.concatenate([images, new])
+        print("Adding %s images of '%s' without comparisons" % (len(new), kwargs['images_source']))
+    n_items = len(images)
+    print("%s comparisons of %s images" % (len(comparisons), n_items))
+    if n_items < 2:
+        return
+
+    n_pairs = kwargs['n_pairs'] or n_items * kwargs['k_pairs'] // 2
+    pairs, sd_before, sd_after = active_pairs.NextPairs(
+        n_items,
+        index1,
+        index2,
+        comparisons['win1'].values,
+        comparisons['win2'].values,
+        comparisons['tie'].values,
+        n_pairs,
+        max_per_image  = kwargs['max_per_image'],
+        window         = kwargs['window'],
+        n_random       = kwargs['random'],
+        votes_per_pair = kwargs['votes_per_pair'],
+        seed           = kwargs['seed'],
+    )
+    print("Picked %s pairs, the median standard deviation of the scores goes from "
+          "%.3f to %.3f (expected, with %s votes per pair)" % (
+              len(pairs), np.median(sd_before), np.median(sd_after), kwargs['votes_per_pair']))
+
+    # image names in order by name, as in `amazon_input_driver.py`:
+    name_of = dict(pc.query(models.Images.imageHASH, models.Images.name))
+    names = np.array([name_of.get(h, h) for h in images], dtype=object)
+    names1, names2 = names[pairs['index1'].values], names[pairs['index2'].values]
+    first = names1 <= names2
+    names1, names2 = np.where(first, names1, names2), np.where(first, names2, names1)
+
+    hits, leftovers = hit_packer.PackHITs(
+        pairs['index1'].values,
+        pairs['index2'].values,
+        max_per_hit = kwargs['max_per_hit'],
+        seed        = kwargs['seed'],
+    )
+    n_rows = hit_packer.WriteHITs(kwargs['output_csv'], hits, names1, names2, prefix=mturk_batch.BASE_URL)
+    print("Wrote %s HITs to %s" % (n_rows, kwargs['output_csv']))
+    if len(leftovers):
+        leftovers_csv = kwargs['leftovers_csv'] or (
+            os.path.splitext(kwargs['output_csv'])[0] + "-leftovers.csv"
+        )
+        hit_packer.WritePairs(leftovers_csv, leftovers, names1, names2, prefix=mturk_batch.BASE_URL)
+        print("%s pairs did not fit into a HIT, written to %s" % (len(leftovers), leftovers_csv))
+
+    if kwargs['report']:
+        pd.DataFrame({
+            "image1":    names1,
+            "image2":    names2,
+            "gain":      pairs['gain'].values,
+        }, columns=["image1", "image2", "gain"]).to_csv(kwargs['report'], index=False)
+
+
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description= "Builds the MTurk input csv of the next round of comparisons, "
+                     "with the pairs of the largest expected information gain."
+    )
+    parser.add_argument(
+        "--source",
+        default = SOURCE,
+        help    = " The source of the comparisons so far, '%s' by default." % SOURCE
+    )
+    parser.add_argument(
+        "--images-source",
+        help    = " If set, the images of this source in the Images table that were "
+                  " never compared are included, e.g. 'Luca Rossi - ECB'."
+    )
+    parser.add_argument(
+        "-k",
+        "--k-pairs",
+        default = 2,
+        type    = int,
+        help    = " The average number of new pairs per image (default: 2)."
+    )
+    parser.add_argument(
+        "--n-pairs",
+        type    = int,
+        help    = " The number of new pairs, instead of --k-pairs."
+    )
+    parser.add_argument(
+        "--max-per-image",
+        default = 4,
+        type    = int,
+        help    = " The most new pairs of any one image (default: 4)."
+    )
+    parser.add_argument(
+        "--window",
+        default = 5,
+        type    = int,
+        help    = " The number of neighbours by score on either side of an image that "
+                  " are considered as its pairs (default: 5)."
+    )
+    parser.add_argument(
+        "--random",
+        default = 5,
+        type    = int,
+        help    = " The number of random images considered as pairs of an image (default: 5)."
+    )
+    parser.add_argument(
+        "--votes-per-pair",
+        default = 5,
+        type    = int,
+        help    = " The number of votes each pair will get, the number of assignments "
+                  " per HIT (default: 5)."
+    )
+    parser.add_argument(
+        "--output-csv",
+        default = "mturk-input.csv",
+        help    = " The name of the output csv file (default: 'mturk-input.csv')."
+    )
+    parser.add_argument(
+        "--max-per-hit",
+        default = hit_packer.MAX_PER_HIT,
+        type    = int,
+        help    = " See `amazon_input_driver.py --help`."
+    )
+    parser.add_argument(
+        "--leftovers-csv",
+        help    = " See `amazon_input_driver.py --help`."
+    )
+    parser.add_argument(
+        "--report",
+        metavar = "file",
+        help    = " A csv file with the picked pairs and their expected information gain."
+    )
+    parser.add_argument(
+        "--seed",
+        type    = int,
+        help    = " The seed of the random candidates and of the packing."
+    )
+
+    main(**vars(parser.parse_args()))
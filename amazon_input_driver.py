@@ -11,62 +11,33 @@
 
 import sys
 import os
-import random
 import argparse
-import csv
+import multiprocessing
 import imagehash
+import numpy as np
+import pandas as pd
 from PIL import Image
 
+from protestDB import models
 from protestDB.cursor import ProtestCursor
+from analysis.lib import hit_packer, pairing, phash_index
 pc = ProtestCursor()
 
 url = "https://s3.eu-central-1.amazonaws.com/ecb-protest/"
 
-def checkValid(pairs, value1, value2, threshold):
-    if (len(pairs[value1]) >= threshold or len(pairs[value2]) >= threshold):
-        return False
-    if (value1 in pairs[value2] or value2 in pairs[value1]):
-        return False
-
-    return True
-
-def create_random_pairs(files, n_pairs):
+def create_random_pairs(files, n_pairs, seed=None, exclude=None):
     """
         Returns a dictionary where each key is a file
         the value is a list of other files to pair with
         so that each file is paired with n_pairs other
         files.
         Pairs are created randomly between all files in
-        `files`.
+        `files`, see `analysis/lib/pairing.py`, except
+        the pairs of names in `exclude`.
     """
-    pool = files * n_pairs
-    random.shuffle(pool)
-
-    pairs = {}
-    print("_" * 80)
-    print("Starting")
-
-    # Initialize pairs
-    for i in files:
-        pairs[i] = []
-
-    for i in files:
-        while len(pairs[i]) < n_pairs:
-            j = pool.pop()
-            if j == i:
-                pool = [j] + pool
-                continue
+    return pairing.PairNames(files, n_pairs, seed=seed, exclude=exclude)
 
-            if checkValid(pairs, i, j, n_pairs):
-                pairs[i].append(j)
-                pairs[j].append(i)
-            else:
-                pool = [j] + pool
-                continue
-
-    return pairs
-
-def create_from(A, B, n_pairs):
+def create_from(A, B, n_pairs, seed=None, exclude=None):
     """
     Creates pairs such that for all
     pairs (a, b) a is in A and b is in B
@@ -74,37 +45,74 @@ def create_from(A, B, n_pairs):
     Requires that A and B are of equal lengths
     """
     assert len(A) == len(B), "A and B must be of equal lenghts"
+    return pairing.PairNamesFrom(A, B, n_pairs, seed=seed, exclude=exclude)
 
-    pairs = {}
-    # initialize pairs:
-    for i in A + B:
-        pairs[i] = []
-    A = A * n_pairs
-    B = B * n_pairs
-    random.shuffle(A)
-    random.shuffle(B)
-
-    for a in A:
-        while len(pairs[a]) < n_pairs:
-            b = B.pop()
+def near_duplicates(names, hashes=None, radius=phash_index.RADIUS):
+    """
+        Returns the pairs of names of the images whose
+        dhash differs in at most `radius` bits, as two
+        arrays, see `analysis/lib/phash_index.py`.
+        `hashes` maps the names to the image hashes,
+        by default they are looked up in the database.
+    """
+    if hashes is None:
+        hashes = dict(pc.query(models.Images.name, models.Images.imageHASH))
+    names = np.array([n for n in pd.unique(np.asarray(names, dtype=object)) if n in hashes],
+                     dtype=object)
+    i, j = phash_index.NearPairs([hashes[n] for n in names], radius)
+    return names[i], names[j]
 
-            assert a != b, "Found a violation {} and {} are equal".format(a, b)
 
-            if checkValid(pairs, a, b, n_pairs):
-                # create the pair:
-                pairs[a].append(b)
-                pairs[b].append(a)
-            else:
-                # Put back b into B:
-                B = [b] + B
+def image_hash(path):
+    """
+        Returns the dhash of the image at `path`, as the
+        images are identified in the database.
+    """
+    return str(imagehash.dhash(Image.open(path)))
 
-    return pairs
+def resolve_names(lines, images_dir="images/", processes=None, chunk_size=500, debug=False):
+    """
+        Returns the names of the images given by `lines`,
+        each a hash or the file name of an image in
+        `images_dir`, and a dict from the names to the
+        hashes. The files are hashed on a pool of
+        `processes` processes (default: the number of
+        cores), and the hashes are looked up `chunk_size`
+        at a time. Lines with a hash that is not in the
+        database are skipped.
+    """
+    lines = [line.strip() for line in lines if line.strip()]
+    paths = [os.path.join(images_dir, line) for line in lines if len(line.split(".")) > 1]
+    if len(paths) > 1 and processes != 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            hashed = pool.map(image_hash, paths, chunksize=max(1, len(paths) // 64))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        hashed = [image_hash(path) for path in paths]
+    hashed = iter(hashed)
+    line_hashes = [line if len(line.split(".")) == 1 else next(hashed) for line in lines]
+
+    names = pc.getImageNames(line_hashes, chunk_size=chunk_size)
+    files, hashes = [], {}
+    for line, hash_name in zip(lines, line_hashes):
+        if debug:
+            print("hash_name: %s" % hash_name)
+        if hash_name in names:
+            files.append(names[hash_name])
+            hashes[names[hash_name]] = hash_name
+        else:
+            print("Skipping %s with hash: %s" % (line, hash_name))
+    return files, hashes
 
 
-def main(files=None, A=None, B=None, **kwargs):
+def main(files=None, A=None, B=None, hashes=None, **kwargs):
     """ A and B is not command line supported, import this driver
         as a module, and call its main function directly to use
-        this feature.
+        this feature. `hashes` optionally maps the names to the
+        image hashes, for `near_duplicates`.
     """
 
     if files is None and A is None and B is None:
@@ -114,52 +122,51 @@ def main(files=None, A=None, B=None, **kwargs):
         )
 
     n_pairs = kwargs['k_pairs']
+    seed = kwargs.get('seed')
 
+    radius = kwargs.get('hamming_radius', phash_index.RADIUS)
+
+    print("_" * 80)
+    print("Starting")
+    exclude = None
+    if radius is not None and radius >= 0:
+        exclude = near_duplicates(
+            files if files is not None else list(A) + list(B), hashes, radius
+        )
+        print("Not pairing %s pairs of near-duplicate images" % len(exclude[0]))
     if files is None:
-        pairs = create_from(A, B, n_pairs)
+        assert len(A) == len(B), "A and B must be of equal lenghts"
+        names1, names2 = pairing.NamePairsFrom(A, B, n_pairs, seed=seed, exclude=exclude)
     else:
-        pairs = create_random_pairs(files, n_pairs)
-
-
-    header = []
-    for i in range(10):
-        for j in range(1, 3):
-            header.append("image_%s-%s" % (i, j))
-    rows = []
-    rows.append(header)
-
-    build_url = lambda name: url + name
-
-    pairwise = set()
-    for k, v in pairs.items():
-        for j in v:
-            pair = sorted([k, j])
-            pairwise.update([":".join(pair)])
-
-    pairwise = list(pairwise)
-
-    random.shuffle(pairwise)
-    row = []
-    for pair in pairwise:
-        pair = pair.split(":")
-        img_a = pair[0]
-        img_b = pair[1]
-        row.append(build_url(img_a))
-        row.append(build_url(img_b))
-        if len(row) == 20:
-            rows.append(row)
-            row = []
-
-    with open(kwargs['output_csv'], "w") as f:
-        csvwriter = csv.writer(f, delimiter=",")
-        csvwriter.writerows(rows)
+        names1, names2 = pairing.NamePairs(files, n_pairs, seed=seed, exclude=exclude)
+
+    # The images of a pair in order by name, as `analysis/lib/mturk_batch.py`
+    # expects them:
+    first = names1 <= names2
+    names1, names2 = np.where(first, names1, names2), np.where(first, names2, names1)
+    codes, images = pd.factorize(np.concatenate([names1, names2]))
+
+    hits, leftovers = hit_packer.PackHITs(
+        codes[:len(names1)],
+        codes[len(names1):],
+        max_per_hit = kwargs.get('max_per_hit') or hit_packer.MAX_PER_HIT,
+        seed        = seed,
+    )
+    n_rows = hit_packer.WriteHITs(kwargs['output_csv'], hits, names1, names2, prefix=url)
 
+    if len(leftovers):
+        leftovers_csv = kwargs.get('leftovers_csv') or (
+            os.path.splitext(kwargs['output_csv'])[0] + "-leftovers.csv"
+        )
+        hit_packer.WritePairs(leftovers_csv, leftovers, names1, names2, prefix=url)
+        print("%s pairs did not fit into a HIT, written to %s" % (len(leftovers), leftovers_csv))
 
     if kwargs['debug']:
-        for k, v in pairs.items():
-            print("%35s: %-15s" % (k, len(v)))
+        counts = np.bincount(codes, minlength=len(images))
+        for name, count in zip(images, counts):
+            print("%35s: %-15s" % (name, count))
     print("\nAll done!")
-    print("Number of rows: %s" % len(rows))
+    print("Number of rows: %s" % (n_rows + 1))
     print("_" * 80)
 
 
@@ -193,6 +200,36 @@ if __name__ == "__main__":
         type=int,
         help="The number of pairs to generate for each observation"
     )
+    parser.add_argument(
+        "--max-per-hit",
+        default=hit_packer.MAX_PER_HIT,
+        type=int,
+        help="The number of times an image may occur in one HIT (default: %s)" % hit_packer.MAX_PER_HIT
+    )
+    parser.add_argument(
+        "--leftovers-csv",
+        type=str,
+        help="The csv file for the pairs that do not fit into a HIT "
+             "(default: the output csv name + '-leftovers.csv')"
+    )
+    parser.add_argument(
+        "--hamming-radius",
+        default=phash_index.RADIUS,
+        type=int,
+        help="Images whose dhash differs in at most this many bits are near-duplicates "
+             "and never paired, -1 to pair them anyway (default: %s)" % phash_index.RADIUS
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="The seed of the random pairs, the same seed and files give the same output"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="The number of processes hashing the image files, "
+             "defaults to the number of cores"
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -202,37 +239,15 @@ if __name__ == "__main__":
     args = vars(parser.parse_args())
 
     if args['files'] is None:
-
-        files = []
-        for line in sys.stdin:
-            if len(line.split(".")) == 1:
-                hash_name = line.strip()
-            else:
-                hash_name = str(
-                    imagehash.dhash(
-                        Image.open(
-                            os.path.join(args['images_dir'], line.strip())
-                        )
-                    )
-                )
-            print("hash_name: %s" % hash_name)
-            try:
-                fname = pc.getImage(hash_name).name
-                files.append(fname)
-            except AttributeError:
-                print("Skipping %s with hash: %s" % (line.strip(),hash_name))
-
-        args["files"] = files
-
+        lines = sys.stdin.readlines()
     else:
-
-        files = []
         with open(args["files"], "r") as f:
-            for line in f:
-                fname = pc.getImage(line.strip()).name
-                files.append(fname)
-        args["files"] = files
-
-
+            lines = f.readlines()
+    args["files"], args["hashes"] = resolve_names(
+        lines,
+        images_dir = args['images_dir'],
+        processes  = args['processes'],
+        debug      = args['debug'],
+    )
 
     main(**args)
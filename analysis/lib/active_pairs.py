@@ -0,0 +1,114 @@
+""" This library picks the next image pairs to send to MTurk, where a
+comparison is expected to tell the most about the scores.
+
+Under the Bradley-Terry model an image with score s_i beats an image with
+score s_j with probability p = 1 / (1 + exp(s_j - s_i)), and each comparison
+of the two adds p (1 - p) to the Fisher information of both scores. The
+information of an image, plus the virtual comparisons of the `alpha`
+regularization of `pairwise_solver.OptPairwise`, gives the variance of its
+score, sigma^2 = 1 / information.
+
+A new comparison of (i, j) is worth the expected information gain
+    0.5 * log(1 + p (1 - p) (sigma_i^2 + sigma_j^2))
+which is largest for images with close scores (p near 0.5) and uncertain
+scores (few comparisons). Images of different components of the comparison
+graph have scores that are not comparable, and count as p = 0.5, so that
+pairs linking the components are preferred.
+
+Scoring all n^2 pairs is not needed: the candidates of an image are its
+`window` neighbours in score order, where p is close to 0.5, and `n_random`
+random images, which link the components and the new images."""
+
+
+import numpy as np
+import pandas as pd
+
+from . import pairwise_solver
+
+
+def WinProbability(params, labels, index1, index2):
+    """ The probability that image1 beats image2, 0.5 across components """
+    p = 1 / (1 + np.exp(params[index2] - params[index1]))
+    return np.where(labels[index1] == labels[index2], p, 0.5)
+
+def Information(params, labels, index1, index2, n_votes, alpha=0.1):
+    """ Returns the Fisher information of the score of each image, from
+    the number of votes of each pair. `alpha` counts as a win and a loss
+    against an image of score 0 """
+    n_items = len(params)
+    p = WinProbability(params, labels, index1, index2)
+    w = n_votes * p * (1 - p)
+    p0 = 1 / (1 + np.exp(-params))
+    return (np.bincount(index1, w, n_items) + np.bincount(index2, w, n_items) +
+            2 * alpha * p0 * (1 - p0))
+
+def InformationGain(params, labels, variance, index1, index2, n_votes=1):
+    """ The expected information gain of `n_votes` new votes on each pair """
+    p = WinProbability(params, labels, index1, index2)
+    return 0.5 * np.log1p(n_votes * p * (1 - p) * (variance[index1] + variance[index2]))
+
+def Candidates(params, labels, window=5, n_random=5, rng=None):
+    """ Returns the candidate pairs (index1, index2), index1 < index2: the
+    `window` nearest images by score on either side of each image, and
+    `n_random` random images per image, without repeats """
+    rng = rng if isinstance(rng, np.random.RandomState) else np.random.RandomState(rng)
+    n_items = len(params)
+    order = np.argsort(params, kind="mergesort")
+    near = [
+        (order[:-offset], order[offset:])
+        for offset in range(1, min(window, n_items - 1) + 1)
+    ]
+    items = np.repeat(np.arange(n_items), n_random)
+    rand = [(items, rng.randint(n_items, size=len(items)))] if n_items > 1 else []
+    i = np.concatenate([a for a, _ in near + rand] or [np.zeros(0, dtype=np.int64)])
+    j = np.concatenate([b for _, b in near + rand] or [np.zeros(0, dtype=np.int64)])
+    keep = i != j
+    lo, hi = np.minimum(i[keep], j[keep]), np.maximum(i[keep], j[keep])
+    keys = pd.unique(lo * n_items + hi)
+    return keys // n_items, keys % n_items
+
+def SelectPairs(index1, index2, gain, n_pairs, max_per_image):
+    """ Greedily takes the candidate pairs with the largest gain, with at
+    most `max_per_image` pairs per image. Returns the positions of the pairs
+    taken """
+    order = np.argsort(-gain, kind="mergesort")
+    n_items = int(max(index1.max(), index2.max())) + 1 if len(order) else 0
+    used = [0] * n_items
+    taken = []
+    for k, a, b in zip(order.tolist(), index1[order].tolist(), index2[order].tolist()):
+        if len(taken) >= n_pairs:
+            break
+        if used[a] < max_per_image and used[b] < max_per_image:
+            used[a] += 1
+            used[b] += 1
+            taken.append(k)
+    return np.array(taken, dtype=np.int64)
+
+def NextPairs(n_items, index1, index2, win1, win2, tie, n_pairs, max_per_image=4,
+              window=5, n_random=5, votes_per_pair=5, seed=None, alpha=0.1):
+    """ Picks the next `n_pairs` pairs of images, given the counts of the
+    comparisons so far, of images 0 .. n_items - 1 where the images without
+    comparisons are new ones. Returns a data frame with the columns index1,
+    index2 and gain, and the standard deviation of each score before and, as
+    expected, after `votes_per_pair` votes on each of the new pairs """
+    index1 = np.asarray(index1, dtype=np.int64)
+    index2 = np.asarray(index2, dtype=np.int64)
+    n_votes = np.asarray(win1) + np.asarray(win2) + np.asarray(tie)
+    params = pairwise_solver.OptChoixPairwise(n_items, index1, index2, win1, win2, tie, alpha=alpha)
+    _, labels = pairwise_solver.Components(n_items, index1, index2)
+
+    # the scores are on the scale of the doubled counts of OptChoixPairwise:
+    variance = 1 / Information(params, labels, index1, index2, 2 * n_votes, alpha)
+    c1, c2 = Candidates(params, labels, window, n_random, seed)
+    gain = InformationGain(params, labels, variance, c1, c2, 2 * votes_per_pair)
+    taken = SelectPairs(c1, c2, gain, n_pairs, max_per_image)
+
+    new1, new2 = c1[taken], c2[taken]
+    after = 1 / (1 / variance + Information(
+        params, labels, new1, new2, np.full(len(taken), 2.0 * votes_per_pair), 0
+    ))
+    return pd.DataFrame({
+        "index1": new1,
+        "index2": new2,
+        "gain":   gain[taken],
+    }, columns=["index1", "index2", "gain"]), np.sqrt(variance), np.sqrt(after)
@@ -0,0 +1,127 @@
+""" This library computes bootstrap confidence intervals for the scores.
+
+The data is a set of records, each one being a vote or an aggregated image
+pair, that belong to resampling units: the assignments (HITs) of an MTurk
+batch, or the image pairs themselves. A bootstrap replicate draws the units
+with replacement, which amounts to giving each record the number of times
+its unit was drawn as a weight. The weighted counts are summed up per pair
+and the scores are re-fitted, warm-started from the point estimate.
+
+The replicates run on a process pool. The record arrays are handed to the
+workers once, when the pool starts, and are only read from there on, so a
+task is just the number of the replicate and the result is one score per
+image. Replicate `b` always uses the seed `seed + b`, so the result does not
+depend on the number of processes."""
+
+
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+from . import mturk_batch
+from . import pairwise_solver
+
+
+# the read-only data of the replicates, set in each worker process:
+_DATA = None
+
+def _init(data):
+    global _DATA
+    _DATA = data
+
+def _replicate(b):
+    """ Fits the scores of replicate `b` on the data in `_DATA` """
+    d = _DATA
+    rng = np.random.RandomState(d["seed"] + b)
+    n_units = d["n_units"]
+    drawn = np.bincount(rng.randint(n_units, size=n_units), minlength=n_units)
+    weight = drawn[d["unit"]]
+    n_pairs = len(d["index1"])
+    return pairwise_solver.OptChoixPairwise(
+        d["n_items"],
+        d["index1"],
+        d["index2"],
+        np.bincount(d["pair"], d["win1"] * weight, n_pairs),
+        np.bincount(d["pair"], d["win2"] * weight, n_pairs),
+        np.bincount(d["pair"], d["tie"] * weight, n_pairs),
+        initial_params = d["params"],
+        **d["solver_kwargs"]
+    )
+
+def Bootstrap(n_items, index1, index2, pair, unit, win1, win2, tie, B=200,
+              params=None, processes=None, seed=0, **solver_kwargs):
+    """ Returns a B x n_items array with the scores of each replicate.
+        index1, index2          the images of each pair
+        pair, unit              the pair and the resampling unit of each record
+        win1, win2, tie         the counts of each record
+        params                  the point estimate, used as starting point
+        processes               the size of the pool, defaults to the number of cores
+    Keyword arguments are passed on to `pairwise_solver.OptPairwise` """
+    unit = np.asarray(unit, dtype=np.int64)
+    data = {
+        "n_items":       n_items,
+        "index1":        np.asarray(index1, dtype=np.int64),
+        "index2":        np.asarray(index2, dtype=np.int64),
+        "pair":          np.asarray(pair, dtype=np.int64),
+        "unit":          unit,
+        "n_units":       int(unit.max()) + 1 if len(unit) else 0,
+        "win1":          np.asarray(win1, dtype=np.float64),
+        "win2":          np.asarray(win2, dtype=np.float64),
+        "tie":           np.asarray(tie, dtype=np.float64),
+        "params":        params,
+        "seed":          seed,
+        "solver_kwargs": solver_kwargs,
+    }
+    if processes == 1 or B < 2:
+        _init(data)
+        return np.array([_replicate(b) for b in range(B)]).reshape(B, n_items)
+
+    pool = multiprocessing.Pool(processes, initializer=_init, initargs=(data,))
+    try:
+        samples = pool.map(_replicate, range(B), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return np.array(samples)
+
+def BootstrapComparisons(n_items, index1, index2, win1, win2, tie, B=200, **kwargs):
+    """ Bootstrap resampling the image pairs, e.g. for the UCLA comparisons
+    where the single votes are not known. See `Bootstrap` """
+    pairs = np.arange(len(index1))
+    return Bootstrap(n_items, index1, index2, pairs, pairs, win1, win2, tie, B=B, **kwargs)
+
+def BootstrapVotes(votes, comparisons, n_items, B=200, weights=None, **kwargs):
+    """ Bootstrap resampling the assignments of an MTurk batch, given the
+    votes of `mturk_batch.MeltVotes` and the comparisons that
+    `mturk_batch.AggregateVotes` made out of them, and optionally a weight
+    per vote. See `Bootstrap` """
+    keys = votes["index1"].values.astype(np.int64) * n_items + votes["index2"].values
+    pair, _ = pd.factorize(keys)   # same order as the comparisons
+    choice = votes["choice"].values
+    w = np.ones(len(votes)) if weights is None else np.asarray(weights, dtype=np.float64)
+    return Bootstrap(
+        n_items,
+        comparisons["index1"].values,
+        comparisons["index2"].values,
+        pair,
+        votes["assignment"].values,
+        (choice == mturk_batch.WIN1) * w,
+        (choice == mturk_batch.WIN2) * w,
+        (choice == mturk_batch.TIE) * w,
+        B=B,
+        **kwargs
+    )
+
+def ConfidenceIntervals(samples, level=0.95):
+    """ Returns the percentile intervals (low, high) of each image """
+    tail = 100 * (1 - level) / 2
+    low, high = np.percentile(samples, [tail, 100 - tail], axis=0)
+    return low, high
+
+def ScaleLike(values, reference):
+    """ Min-max scales `values` with the min and max of `reference`, so that
+    intervals are on the same scale as the min-max scaled scores, and clips
+    them to [0, 1] """
+    lo, hi = np.min(reference), np.max(reference)
+    span = hi - lo if hi > lo else 1.0
+    return np.clip((np.asarray(values) - lo) / span, 0, 1)
@@ -0,0 +1,217 @@
+""" This library analyses the graph of pairwise comparisons, where images
+are nodes and compared pairs are edges, and scores it component by component.
+
+Scores are only comparable within a connected component of the graph, and
+within a component the Bradley-Terry scores are only finite if every image
+both won and lost somewhere, i.e. if the graph of wins is strongly
+connected. The report points out where this is not the case, and
+`ScoreComponents` solves every component independently on a process pool,
+normalizing each component explicitly."""
+
+
+import multiprocessing
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from . import pairwise_solver
+
+
+def LoadComparisons(pc, source=None):
+    """ Returns the Comparisons table as a data frame with the columns
+    image1, image2 (the image hashes), win1, win2, tie, source and timestamp.
+    If `source` is set, only comparisons from that source are returned """
+    from protestDB import models
+    C = models.Comparisons
+    q = pc.query(
+        C.imageID_1.label("image1"),
+        C.imageID_2.label("image2"),
+        C.win1, C.win2, C.tie, C.source, C.timestamp,
+    )
+    if source is not None:
+        q = q.filter(C.source == source)
+    return pd.DataFrame(
+        q.all(),
+        columns=["image1", "image2", "win1", "win2", "tie", "source", "timestamp"]
+    )
+
+def IndexComparisons(comparisons):
+    """ Returns the image names in order of first appearance, and the
+    arrays index1 and index2 into them """
+    codes, images = pd.factorize(
+        np.concatenate([comparisons["image1"].values, comparisons["image2"].values])
+    )
+    n_pairs = len(comparisons)
+    return np.asarray(images, dtype=object), codes[:n_pairs], codes[n_pairs:]
+
+def GraphReport(comparisons, min_degree=3):
+    """ Analyses the comparison graph. Returns a dict with the summary and a
+    data frame with one row per image with the columns:
+        image           the image name
+        component       the connected component of the image
+        degree          the number of other images it is compared with
+        votes           the number of votes on its pairs
+        wins, losses    the votes won and lost, ties count as both
+        strong_size     the size of its strongly connected component in the
+                        graph of wins, smaller than the component when it
+                        never wins or never loses against part of it
+        weak            true if degree < `min_degree` or the image is outside
+                        the largest strongly connected component of its
+                        component """
+    images, index1, index2 = IndexComparisons(comparisons)
+    n = len(images)
+    win1 = comparisons["win1"].values.astype(np.float64)
+    win2 = comparisons["win2"].values.astype(np.float64)
+    tie = comparisons["tie"].values.astype(np.float64)
+
+    n_comp, labels = pairwise_solver.Components(n, index1, index2)
+    comp_sizes = np.bincount(labels, minlength=n_comp)
+
+    degree = np.bincount(index1, minlength=n) + np.bincount(index2, minlength=n)
+    votes = np.bincount(index1, win1 + win2 + tie, n) + np.bincount(index2, win1 + win2 + tie, n)
+    wins = np.bincount(index1, win1 + tie, n) + np.bincount(index2, win2 + tie, n)
+    losses = np.bincount(index1, win2 + tie, n) + np.bincount(index2, win1 + tie, n)
+
+    # edge from winner to loser, for every pair where it happened at least once:
+    w12 = (win1 + tie) > 0
+    w21 = (win2 + tie) > 0
+    won = sparse.coo_matrix(
+        (np.ones(w12.sum() + w21.sum()),
+         (np.concatenate([index1[w12], index2[w21]]),
+          np.concatenate([index2[w12], index1[w21]]))),
+        shape=(n, n)
+    )
+    _, strong = connected_components(won, directed=True, connection="strong")
+    strong_size = np.bincount(strong)[strong]
+    largest_strong = np.zeros(n_comp, dtype=strong_size.dtype)
+    np.maximum.at(largest_strong, labels, strong_size)
+
+    weak = (degree < min_degree) | (strong_size < largest_strong[labels])
+    per_image = pd.DataFrame({
+        "image":       images,
+        "component":   labels,
+        "degree":      degree,
+        "votes":       votes,
+        "wins":        wins,
+        "losses":      losses,
+        "strong_size": strong_size,
+        "weak":        weak,
+    }, columns=["image", "component", "degree", "votes", "wins", "losses", "strong_size", "weak"])
+
+    degree_values, degree_counts = np.unique(degree, return_counts=True)
+    summary = {
+        "images":            int(n),
+        "pairs":             int(len(comparisons)),
+        "components":        int(n_comp),
+        "largest_component": int(comp_sizes.max()) if n_comp else 0,
+        "component_sizes":   { int(k): int(v) for k, v in zip(*np.unique(comp_sizes, return_counts=True)) },
+        "degree":            { int(k): int(v) for k, v in zip(degree_values, degree_counts) },
+        "degree_mean":       float(degree.mean()) if n else 0.0,
+        "weak_images":       int(weak.sum()),
+        "never_won":         int(((wins == 0) & (degree > 0)).sum()),
+        "never_lost":        int(((losses == 0) & (degree > 0)).sum()),
+    }
+    return summary, per_image
+
+def _solveTask(task):
+    """ Solves one task of `ScoreComponents`, in a worker process """
+    items, index1, index2, win1, win2, tie, solver_kwargs = task
+    params = pairwise_solver.OptChoixPairwise(
+        len(items), index1, index2, win1, win2, tie, **solver_kwargs
+    )
+    return items, params
+
+def NormalizeComponents(params, labels, method="center"):
+    """ Normalizes the scores within each component:
+        center  mean 0 within each component
+        zscore  mean 0 and standard deviation 1 within each component
+        minmax  scaled to [0, 1] within each component """
+    counts = np.maximum(np.bincount(labels), 1)
+    mean = np.bincount(labels, params) / counts
+    centered = params - mean[labels]
+    if method == "center":
+        return centered
+    if method == "zscore":
+        std = np.sqrt(np.bincount(labels, centered ** 2) / counts)
+        std[std == 0] = 1.0
+        return centered / std[labels]
+    if method == "minmax":
+        lo = pd.Series(params).groupby(labels).transform("min").values
+        hi = pd.Series(params).groupby(labels).transform("max").values
+        span = np.where(hi > lo, hi - lo, 1.0)
+        return (params - lo) / span
+    raise ValueError("Unknown normalization: %s" % method)
+
+def ScoreComponents(comparisons, processes=None, min_size=2, normalize="center",
+                    task_pairs=20000, **solver_kwargs):
+    """ Scores every connected component with at least `min_size` images
+    independently, spreading them over a pool of `processes` (default: the
+    number of cores). Small components are grouped into tasks of about
+    `task_pairs` pairs. Returns a data frame with the columns image,
+    component, size, score (centered log-strength) and normalized, see
+    `NormalizeComponents` """
+    images, index1, index2 = IndexComparisons(comparisons)
+    n = len(images)
+    win1 = comparisons["win1"].values.astype(np.float64)
+    win2 = comparisons["win2"].values.astype(np.float64)
+    tie = comparisons["tie"].values.astype(np.float64)
+
+    n_comp, labels = pairwise_solver.Components(n, index1, index2)
+    sizes = np.bincount(labels, minlength=n_comp)
+    pair_comp = labels[index1]
+    pair_counts = np.bincount(pair_comp, minlength=n_comp)
+
+    # group the components into tasks, largest first:
+    tasks, group, group_pairs = [], [], 0
+    for c in np.argsort(-pair_counts, kind="mergesort"):
+        if sizes[c] < min_size:
+            continue
+        group.append(c)
+        group_pairs += pair_counts[c]
+        if group_pairs >= task_pairs:
+            tasks.append(group)
+            group, group_pairs = [], 0
+    if group:
+        tasks.append(group)
+
+    local = np.empty(n, dtype=np.int64)
+    payloads = []
+    for group in tasks:
+        in_group = np.isin(labels, group)
+        items = np.flatnonzero(in_group)
+        local[items] = np.arange(len(items))
+        pairs = in_group[index1]
+        payloads.append((
+            items,
+            local[index1[pairs]],
+            local[index2[pairs]],
+            win1[pairs], win2[pairs], tie[pairs],
+            solver_kwargs,
+        ))
+
+    params = np.full(n, np.nan)
+    if len(payloads) > 1 and processes != 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_solveTask, payloads)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_solveTask(p) for p in payloads]
+    for items, p in results:
+        params[items] = p
+
+    scored = ~np.isnan(params)
+    normalized = np.full(n, np.nan)
+    normalized[scored] = NormalizeComponents(
+        params[scored], np.unique(labels[scored], return_inverse=True)[1], normalize
+    )
+    return pd.DataFrame({
+        "image":      images,
+        "component":  labels,
+        "size":       sizes[labels],
+        "score":      params,
+        "normalized": normalized,
+    }, columns=["image", "component", "size", "score", "normalized"])
@@ -5,22 +5,23 @@ based on the structure of the csv UCLA has sent us."""
 
 
 import os
+import time
 import numpy as np
 import pandas as pd
-import collections
-import random
-import time
-import choix
-from sklearn.preprocessing import MinMaxScaler
-import os
+from . import mturk_batch
+from . import pairwise_solver
 from PIL import Image
 from scipy import stats
 
 
 def MapImagesToIndexes(df):
     """Given a panda data frame of the data, creates a 
-    dictonary mapping image names to ints and vice versa """
-    image_ids = list(set(df['image1'].tolist() + df['image2'].tolist()))
+    dictonary mapping image names to ints and vice versa.
+    Images are numbered in order of first appearance, so the
+    mapping is the same from run to run """
+    _, image_ids = pd.factorize(
+        np.concatenate([df['image1'].values, df['image2'].values])
+    )
     int_to_idx = dict(enumerate(image_ids))
     idx_to_int = dict((v, k) for k, v in int_to_idx.items())
     return int_to_idx, idx_to_int
@@ -28,39 +29,39 @@ def MapImagesToIndexes(df):
 def GenrateChoixData(df, idx_to_int):
     """ make data for choix.opt_pairwise given a dataframe and 
     a dict mapping image names to ints """
-    pairs = []
-    for row in df.iterrows():
-        id1 = idx_to_int[row[1]['image1']]
-        id2 = idx_to_int[row[1]['image2']]
-        win1 = row[1]['win1']
-        win2 = row[1]['win2']
-        tie = row[1]['tie']
-        for _ in range(win1):
-            pairs.append((id1, id2))
-            pairs.append((id1, id2))
-        for _ in range(win2):
-            pairs.append((id2, id1))
-            pairs.append((id2, id1))
-        for _ in range(tie):
-            pairs.append((id1, id2))
-            pairs.append((id2, id1))
-    return pairs
+    return mturk_batch.ChoixTuples(pd.DataFrame({
+        'index1': df['image1'].map(idx_to_int).values,
+        'index2': df['image2'].map(idx_to_int).values,
+        'win1':   df['win1'].values,
+        'win2':   df['win2'].values,
+        'tie':    df['tie'].values,
+    }))
 
 def GenerateChoixScores(df_in, csvPath = ''):
     """ Given a data frame, it calculates the Choix scores for those pairs and 
     outputs it to a csv file given in the csvPath argument"""
-    int_to_idx, idx_to_int = MapImagesToIndexes(df_in)
-    n_items = len(idx_to_int)
-    pairs = GenrateChoixData(df_in, idx_to_int)
     start_time = time.time()
-    params = choix.opt_pairwise(n_items, pairs)
+    codes, image_ids = pd.factorize(
+        np.concatenate([df_in['image1'].values, df_in['image2'].values])
+    )
+    n_pairs = len(df_in)
+    # the aggregated counts are solved directly, instead of expanding them
+    # into tuples with `GenrateChoixData` for `choix.opt_pairwise`:
+    params = pairwise_solver.OptChoixPairwise(
+        len(image_ids),
+        codes[:n_pairs],
+        codes[n_pairs:],
+        df_in['win1'].values,
+        df_in['win2'].values,
+        df_in['tie'].values,
+    )
     df = pd.DataFrame(params)
-    df['fname'] = [int_to_idx[i] for i in df.index]
+    df['fname'] = np.asarray(image_ids, dtype=object)
     if csvPath != '':
         df.to_csv(csvPath)
+        print(time.time() - start_time)
     else:
         return df
-    print(time.time() - start_time)
     
 def ReadScoresFromCsv(csvPath):
     """ reads scores from a csv file """
@@ -68,17 +69,16 @@ def ReadScoresFromCsv(csvPath):
     df.columns = ['violence', 'fname']
     return df
 
-def MinMax(df, column):
+def MinMax(df, column, inplace=False):
     """ Performs a min max operation into a dataframe column specified using a string"""
-    df_result = df.copy()
-    v = np.matrix(df_result[column])
-    scaler = MinMaxScaler()
-    df_result[column] = scaler.fit_transform(v.T)
+    df_result = df if inplace else df.copy()
+    v = df_result[column].values.astype(np.float64)
+    lo, hi = v.min(), v.max()
+    df_result[column] = (v - lo) / (hi - lo) if hi > lo else np.zeros_like(v)
     return df_result
 
-def ClipValues(df, cutpoint): 
+def ClipValues(df, cutpoint, inplace=False):
     """Given a data frame with a column named violence, clips the values based on a cutpoint """
-    df_result = df.copy()
-    ix_large = df_result[df_result['violence'] > cutpoint].index
-    df_result.loc[ix_large, 'violence'] = cutpoint
+    df_result = df if inplace else df.copy()
+    df_result['violence'] = df_result['violence'].clip(upper=cutpoint)
     return df_result
@@ -0,0 +1,140 @@
+""" This library packs image pairs into MTurk HITs and writes the input csv.
+
+A HIT (a row of the input csv) holds 10 pairs. The pairs are given as two
+integer arrays (index1, index2) of image codes, so that millions of pairs
+take a few arrays and no strings until the csv is written.
+
+The pairs are packed in one pass over a random order of the pairs, each
+pair going to the first round where neither of its images is yet, and then
+sorted by round, so the first HITs show most images once, the next HITs a
+second time and so on. Every prefix of the HITs, e.g. the part of a batch
+that is done when it is stopped, shows the images about equally often, and
+consecutive pairs rarely share an image. The few HITs where an image still
+shows up more than `max_per_hit` times are repaired by swapping the pair with
+a pair of a random other HIT, where both HITs stay within the cap. A HIT that
+cannot be repaired within a bounded number of tries, and the last pairs that
+do not fill a HIT, are returned as leftovers instead of being dropped."""
+
+
+import csv
+import numpy as np
+
+PAIRS_PER_HIT = 10
+# fewer than 5 times per HIT, as `test_turk_input.py` and
+# `turk_input_validator.py` check:
+MAX_PER_HIT = 4
+
+
+def Header(pairs_per_hit=PAIRS_PER_HIT):
+    """ The column names of the MTurk input csv """
+    return ["image_%s-%s" % (i, j) for i in range(pairs_per_hit) for j in range(1, 3)]
+
+def ExposureOrder(index1, index2, rng):
+    """ Returns the pairs in a random order, sorted by round, where an image
+    is in at most one pair of a round """
+    perm = rng.permutation(len(index1))
+    n_items = int(max(index1.max(), index2.max())) + 1 if len(perm) else 0
+    next_round = [0] * n_items
+    rounds = []
+    for a, b in zip(index1[perm].tolist(), index2[perm].tolist()):
+        r = max(next_round[a], next_round[b])
+        next_round[a] = next_round[b] = r + 1
+        rounds.append(r)
+    return perm[np.argsort(np.array(rounds, dtype=np.int64), kind="mergesort")]
+
+def _OverCap(images, max_per_hit):
+    """ Given the images of each HIT as rows, returns the rows where an
+    image occurs more than `max_per_hit` times """
+    s = np.sort(images, axis=1)
+    return (s[:, max_per_hit:] == s[:, :-max_per_hit]).any(axis=1)
+
+def _Fits(index1, index2, hit, slot, pair, max_per_hit):
+    """ Whether `pair` can take the place of hit[slot] within the cap """
+    others = np.delete(hit, slot)
+    images = np.concatenate([index1[others], index2[others]])
+    a, b = index1[pair], index2[pair]
+    return (np.sum(images == a) < max_per_hit and np.sum(images == b) < max_per_hit)
+
+def _Repair(hits, index1, index2, h, max_per_hit, rng, max_tries):
+    """ Swaps pairs out of HIT h until it is within the cap. Returns False if
+    it is not within `max_tries` tries """
+    n_hits, per_hit = hits.shape
+    for _ in range(max_tries):
+        images = np.concatenate([index1[hits[h]], index2[hits[h]]])
+        values, counts = np.unique(images, return_counts=True)
+        over = values[counts > max_per_hit]
+        if not len(over):
+            return True
+        # the last pair holding an image over the cap:
+        slot = np.flatnonzero(np.isin(index1[hits[h]], over) | np.isin(index2[hits[h]], over))[-1]
+        other = int(rng.randint(n_hits))
+        other_slot = int(rng.randint(per_hit))
+        if other == h:
+            continue
+        if (_Fits(index1, index2, hits[h], slot, hits[other, other_slot], max_per_hit) and
+                _Fits(index1, index2, hits[other], other_slot, hits[h, slot], max_per_hit)):
+            hits[h, slot], hits[other, other_slot] = hits[other, other_slot], hits[h, slot]
+    images = np.concatenate([index1[hits[h]], index2[hits[h]]])
+    return np.unique(images, return_counts=True)[1].max() <= max_per_hit
+
+def PackHITs(index1, index2, pairs_per_hit=PAIRS_PER_HIT, max_per_hit=MAX_PER_HIT, seed=None,
+             max_tries=1000):
+    """ Packs the pairs into HITs. Returns an n_hits x pairs_per_hit array of
+    pair numbers, where no image occurs more than `max_per_hit` times in a
+    row, and the array of the pair numbers left over """
+    index1 = np.asarray(index1, dtype=np.int64)
+    index2 = np.asarray(index2, dtype=np.int64)
+    rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+    order = ExposureOrder(index1, index2, rng)
+    n_hits = len(order) // pairs_per_hit
+    hits = order[:n_hits * pairs_per_hit].reshape(n_hits, pairs_per_hit)
+    leftovers = [order[n_hits * pairs_per_hit:]]
+    if not n_hits:
+        return hits, leftovers[0]
+
+    over = np.flatnonzero(_OverCap(
+        np.concatenate([index1[hits], index2[hits]], axis=1), max_per_hit
+    ))
+    failed = [h for h in over.tolist() if not _Repair(hits, index1, index2, h, max_per_hit, rng, max_tries)]
+    if failed:
+        # a repair may have moved pairs into a HIT that failed before, the
+        # HITs over the cap in the end are left over:
+        failed = np.flatnonzero(_OverCap(
+            np.concatenate([index1[hits], index2[hits]], axis=1), max_per_hit
+        ))
+        leftovers.append(hits[failed].ravel())
+        hits = np.delete(hits, failed, axis=0)
+    return hits, np.concatenate(leftovers)
+
+def _Rows(hits, names1, names2, prefix):
+    """ The csv rows of the HITs, pairs as (image 1, image 2) """
+    cells = np.empty((len(hits), 2 * hits.shape[1]), dtype=object)
+    cells[:, 0::2] = names1[hits]
+    cells[:, 1::2] = names2[hits]
+    if prefix:
+        cells = prefix + cells
+    return cells.tolist()
+
+def WriteHITs(csv_path, hits, names1, names2, prefix="", chunk=10000):
+    """ Writes the MTurk input csv, a HIT per row, `chunk` rows at a time.
+    names1[p] and names2[p] are the names of the images of pair p, `prefix`
+    is put in front of every name, e.g. the bucket url. Returns the number of
+    rows written """
+    names1 = np.asarray(names1, dtype=object)
+    names2 = np.asarray(names2, dtype=object)
+    with open(csv_path, "w") as f:
+        writer = csv.writer(f, delimiter=",")
+        writer.writerow(Header(hits.shape[1]))
+        for start in range(0, len(hits), chunk):
+            writer.writerows(_Rows(hits[start:start + chunk], names1, names2, prefix))
+    return len(hits)
+
+def WritePairs(csv_path, pairs, names1, names2, prefix=""):
+    """ Writes the given pairs, one per row, e.g. the leftovers of PackHITs """
+    pairs = np.asarray(pairs, dtype=np.int64)
+    with open(csv_path, "w") as f:
+        writer = csv.writer(f, delimiter=",")
+        writer.writerow(["image-1", "image-2"])
+        writer.writerows(_Rows(pairs.reshape(-1, 1), np.asarray(names1, dtype=object),
+                               np.asarray(names2, dtype=object), prefix))
+    return len(pairs)
@@ -0,0 +1,109 @@
+""" This library scores the comparisons of several sources in one model.
+
+The UCLA comparisons and the MTurk comparisons of the Luca Rossi images were
+scored separately so far, each with its own min-max scaling. When the two
+sets of images are linked by comparisons across the sources, one model over
+all comparisons puts every image on the same scale.
+
+The sources do not have to agree on how often people answer "the same": each
+source gets its own Rao-Kupper tie parameter `theta`, estimated from the data
+unless given, and a weight that scales its counts, so that a noisier source
+can count less. The scores and the tie parameters are fitted in turns: the
+scores with `pairwise_solver.OptPairwise` given the tie parameters, then each
+tie parameter by maximum likelihood given the scores."""
+
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize_scalar
+
+from . import pairwise_solver
+from .comparison_graph import IndexComparisons
+
+MAX_THETA = 100.0
+
+
+def TieLogLikelihood(theta, p1, p2, win1, win2, tie):
+    """ Returns the Rao-Kupper log-likelihood of the counts, given the
+    strengths p1 and p2 of the images of each pair """
+    d12 = p1 + theta * p2
+    d21 = theta * p1 + p2
+    return (
+        np.sum(win1 * np.log(p1 / d12)) +
+        np.sum(win2 * np.log(p2 / d21)) +
+        np.sum(tie * np.log((theta ** 2 - 1) * p1 * p2 / (d12 * d21)))
+    )
+
+def FitTheta(params, index1, index2, win1, win2, tie):
+    """ Returns the tie parameter maximizing the likelihood given the scores """
+    if np.sum(tie) == 0:
+        return 1.0
+    p = np.exp(params)
+    p1, p2 = p[index1], p[index2]
+    result = minimize_scalar(
+        lambda theta: -TieLogLikelihood(theta, p1, p2, win1, win2, tie),
+        bounds=(1 + 1e-6, MAX_THETA),
+        method="bounded",
+    )
+    return float(result.x)
+
+def InitialTheta(win1, win2, tie):
+    """ The tie parameter of a tie rate `tau` between equal images,
+    theta = (1 + tau) / (1 - tau), a first guess before any scores """
+    n = np.sum(win1) + np.sum(win2) + np.sum(tie)
+    tau = min(np.sum(tie) / n, 0.99) if n else 0.0
+    return (1 + tau) / (1 - tau)
+
+def JointScores(comparisons, theta=None, weight=None, n_rounds=3, **solver_kwargs):
+    """ Scores all comparisons in one model. `comparisons` has the columns
+    image1, image2, win1, win2, tie and source. `theta` and `weight` are dicts
+    by source, the sources missing in `theta` get an estimated tie parameter
+    and the sources missing in `weight` get weight 1.
+
+    Returns a data frame with the columns image, component, sources (the
+    sources of the comparisons of the image, joined by "|") and score (the
+    log-strength), and the dict of tie parameters by source."""
+    theta = dict(theta or {})
+    weight = dict(weight or {})
+    images, index1, index2 = IndexComparisons(comparisons)
+    n_items = len(images)
+    source_codes, sources = pd.factorize(comparisons["source"].fillna(""))
+
+    w = np.array([weight.get(s, 1.0) for s in sources])[source_codes]
+    win1 = comparisons["win1"].values * w
+    win2 = comparisons["win2"].values * w
+    tie = comparisons["tie"].values * w
+
+    fixed = set(theta)
+    for k, s in enumerate(sources):
+        if s not in fixed:
+            rows = source_codes == k
+            theta[s] = InitialTheta(win1[rows], win2[rows], tie[rows])
+
+    params = None
+    for step in range(n_rounds if len(fixed) < len(sources) else 1):
+        if step:
+            for k, s in enumerate(sources):
+                if s not in fixed:
+                    rows = source_codes == k
+                    theta[s] = FitTheta(
+                        params, index1[rows], index2[rows], win1[rows], win2[rows], tie[rows]
+                    )
+        pair_theta = np.array([theta[s] for s in sources])[source_codes]
+        params = pairwise_solver.OptPairwise(
+            n_items, index1, index2, win1, win2, tie,
+            theta=pair_theta, initial_params=params, **solver_kwargs
+        )
+
+    _, labels = pairwise_solver.Components(n_items, index1, index2)
+    image_sources = pd.DataFrame({
+        "image":  np.concatenate([index1, index2]),
+        "source": np.tile(np.asarray(sources, dtype=object)[source_codes], 2),
+    }).drop_duplicates().sort_values("source").groupby("image")["source"].agg("|".join)
+
+    return pd.DataFrame({
+        "image":     images,
+        "component": labels,
+        "sources":   image_sources.reindex(np.arange(n_items)).values,
+        "score":     params,
+    }, columns=["image", "component", "sources", "score"]), theta
@@ -0,0 +1,159 @@
+""" This library parses the Batch csv output from MTurk in a columnar way.
+
+Every assignment (row) of the batch holds 10 image pairs in the columns
+`Input.image_<j>-1` and `Input.image_<j>-2` and the answer for the pair
+in `Answer.choice<j>`, where -1 means the first image is the most violent,
+1 means the second image is the most violent and 0 is a tie.
+
+Instead of going through the rows one by one, the pair columns are melted
+into one vote per row and image names are integer encoded with
+`pd.factorize`, so that counting wins and ties is a single `np.bincount`."""
+
+
+import hashlib
+import numpy as np
+import pandas as pd
+
+BASE_URL = "https://s3.eu-central-1.amazonaws.com/ecb-protest/"
+
+# The image column names follows the same (weird) structure,
+# ordered as the pairs appears in the row:
+IMG_COLS = ["Input.image_%s-%s" % (j, i) for j in range(10) for i in range(1, 3)]
+ANSWER_COLS = ["Answer.choice%s" % j for j in range(10)]
+
+# Meaning of the `choice` column of the votes:
+WIN1, TIE, WIN2 = 0, 1, 2
+
+
+def ReadBatch(csv_path, columns=(), **kwargs):
+    """ Reads the image and answer columns of a batch file, as well as the
+    optional extra `columns`, e.g. "WorkerId". Extra keyword arguments are
+    passed on to `pd.read_csv`, e.g. `chunksize` """
+    usecols = IMG_COLS + ANSWER_COLS + [c for c in columns if c not in IMG_COLS + ANSWER_COLS]
+    return pd.read_csv(csv_path, usecols=usecols, dtype=str, **kwargs)
+
+def MeltVotes(batch, base=None, columns=()):
+    """ Given a batch data frame, returns a data frame with one row per vote
+    and the array of unique image names, in order of first appearance.
+
+    The votes have the columns:
+        assignment  the row number of the assignment in the batch
+        index1      the index of the image that comes first by name
+        index2      the index of the image that comes last by name
+        choice      WIN1, TIE or WIN2
+    plus the extra `columns` of the batch, repeated for each vote.
+
+    The answer is not flipped when the images of a pair are put in order by
+    name. The inputs written by `amazon_input_driver` always holds the pairs
+    in order by name, so the two orders are the same."""
+    base = BASE_URL if base is None else base
+    n_rows = len(batch)
+
+    # (row, pair, a/b) flattened row by row, so that factorize gives the
+    # order of first appearance as in the csv file:
+    urls = batch[IMG_COLS].values.ravel()
+    url_codes, unique_urls = pd.factorize(urls)
+    names = np.array([u.replace(base, '') for u in unique_urls], dtype=object)
+    name_codes, unique_images = pd.factorize(names)
+    codes = name_codes[url_codes].reshape(n_rows * 10, 2)
+
+    # put each pair in order by name:
+    rank = np.empty(len(unique_images), dtype=np.int64)
+    rank[np.argsort(unique_images)] = np.arange(len(unique_images))
+    a, b = codes[:, 0], codes[:, 1]
+    a_first = rank[a] <= rank[b]
+
+    votes = pd.DataFrame({
+        "assignment": np.repeat(np.arange(n_rows), 10),
+        "index1":     np.where(a_first, a, b),
+        "index2":     np.where(a_first, b, a),
+        "choice":     batch[ANSWER_COLS].values.astype(np.int64).ravel() + 1,
+    }, columns=["assignment", "index1", "index2", "choice"])
+    for c in columns:
+        votes[c] = np.repeat(batch[c].values, 10)
+
+    return votes, np.asarray(unique_images, dtype=object)
+
+def AggregateVotes(votes, unique_images, weights=None):
+    """ Sums up the votes per image pair. Returns a data frame with the columns
+    image1, image2, win1, win2, tie, index1, index2 with a row per pair, in
+    order of first appearance. If `weights` is set, it is an array holding a
+    weight per vote and the counts will be the sums of the weights."""
+    n_items = len(unique_images)
+    keys = votes["index1"].values.astype(np.int64) * n_items + votes["index2"].values
+    pair_codes, unique_keys = pd.factorize(keys)
+    n_pairs = len(unique_keys)
+
+    counts = np.bincount(
+        pair_codes * 3 + votes["choice"].values,
+        weights=weights,
+        minlength=n_pairs * 3
+    ).reshape(n_pairs, 3)
+    if weights is None:
+        counts = counts.astype(np.int64)
+
+    index1 = unique_keys // n_items
+    index2 = unique_keys % n_items
+    return pd.DataFrame({
+        "image1": unique_images[index1],
+        "image2": unique_images[index2],
+        "win1":   counts[:, WIN1],
+        "win2":   counts[:, WIN2],
+        "tie":    counts[:, TIE],
+        "index1": index1,
+        "index2": index2,
+    }, columns=["image1", "image2", "win1", "win2", "tie", "index1", "index2"])
+
+def ParseBatch(csv_path, base=None):
+    """ Parses a batch file, returns the aggregated comparisons and the
+    array of unique image names, see `AggregateVotes` """
+    votes, unique_images = MeltVotes(ReadBatch(csv_path), base=base)
+    return AggregateVotes(votes, unique_images), unique_images
+
+def AggregateBatchFile(csv_path, base=None, chunksize=100000):
+    """ Parses a batch file chunk by chunk, so that memory grows with the
+    number of image pairs and not with the number of assignments. Returns
+    the comparisons with the columns image1, image2, win1, win2, tie, in
+    order of first appearance, and the number of assignments """
+    parts, n_rows = [], 0
+    for chunk in ReadBatch(csv_path, chunksize=chunksize):
+        votes, unique_images = MeltVotes(chunk, base=base)
+        parts.append(AggregateVotes(votes, unique_images)[["image1", "image2", "win1", "win2", "tie"]])
+        n_rows += len(chunk)
+    if len(parts) == 1:
+        return parts[0], n_rows
+    if not parts:
+        return pd.DataFrame(columns=["image1", "image2", "win1", "win2", "tie"]), n_rows
+    comparisons = pd.concat(parts).groupby(["image1", "image2"], sort=False).sum()
+    return comparisons.reset_index(), n_rows
+
+def FileDigest(path):
+    """ Returns the sha1 hex digest of the content of a file, the key of a
+    batch file in `score_state.ScoreState` and in the IngestedBatches table """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def ChoixTuples(comparisons):
+    """ Expands the aggregated comparisons into the list of (winner, loser)
+    tuples for `choix.opt_pairwise`. Per pair, a win counts twice, and a tie
+    counts once for each of the images. """
+    i = comparisons["index1"].values
+    j = comparisons["index2"].values
+    win1 = 2 * comparisons["win1"].values
+    win2 = 2 * comparisons["win2"].values
+    tie = 2 * comparisons["tie"].values
+
+    lengths = win1 + win2 + tie
+    starts = np.cumsum(lengths) - lengths
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    pos = np.arange(lengths.sum()) - starts[rows]
+
+    # wins for image 1, then wins for image 2, then the ties alternating:
+    tie_pos = pos - win1[rows] - win2[rows]
+    forward = (pos < win1[rows]) | ((tie_pos >= 0) & (tie_pos % 2 == 0))
+    winners = np.where(forward, i[rows], j[rows])
+    losers = np.where(forward, j[rows], i[rows])
+    return list(zip(winners.tolist(), losers.tolist()))
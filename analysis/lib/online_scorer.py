@@ -0,0 +1,207 @@
+""" This library scores images from a stream of votes, one vote at a time.
+
+Each image has a rating and a rating deviation (the uncertainty of the
+rating), and every vote moves the ratings of its two images with the Glicko
+update of Glickman (1999), "Parameter estimation in large dynamic paired
+comparison experiments", treating the vote as a rating period of one game.
+An update only touches the two images of the vote, so the cost per vote does
+not grow with the number of images or votes. The ratings and deviations are
+kept in numpy arrays that grow by doubling as new images show up.
+
+The ratings are an approximation of the Bradley-Terry scores of
+`pairwise_solver` (on the scale of 400 / ln(10) per unit of log-strength)
+that is usable while the votes are still coming in, e.g. while a HIT batch
+is running."""
+
+
+import os
+import math
+import numpy as np
+import pandas as pd
+
+from . import mturk_batch
+
+Q = math.log(10) / 400
+
+# score of the first image of a vote, by `mturk_batch` choice:
+OUTCOME = {
+    mturk_batch.WIN1: 1.0,
+    mturk_batch.TIE:  0.5,
+    mturk_batch.WIN2: 0.0,
+}
+
+# the arrays of `GlickoScorer.save`, besides the extra ones:
+_SAVED = ("names", "rating", "rd", "votes", "cursor")
+
+
+def _g(rd):
+    return 1 / math.sqrt(1 + 3 * (Q * rd) ** 2 / math.pi ** 2)
+
+
+class GlickoScorer:
+    """ Ratings and deviations of the images, updated one vote at a time.
+
+    Example usage:
+    ```
+    scorer = GlickoScorer.Load("live.npz")
+    scorer.add("hash1", "hash2", mturk_batch.WIN1)
+    scorer.scores()
+    scorer.save("live.npz")
+    ```
+    """
+
+    def __init__(self, names=(), rating=(), rd=(), votes=(), cursor=0, extra=None,
+                 initial_rating=1500.0, initial_rd=350.0, min_rd=30.0):
+        self.initial_rating = initial_rating
+        self.initial_rd = initial_rd
+        self.min_rd = min_rd  # keeps the ratings moving when the votes drift
+        self.names = list(names)
+        self.name_to_index = { n: i for i, n in enumerate(self.names) }
+        n = len(self.names)
+        capacity = max(16, 2 * n)
+        self._rating = np.full(capacity, initial_rating)
+        self._rd = np.full(capacity, initial_rd)
+        self._votes = np.zeros(capacity, dtype=np.int64)
+        self._rating[:n] = rating
+        self._rd[:n] = rd
+        self._votes[:n] = votes
+        self.cursor = cursor  # position in the stream, kept by the caller
+        self.extra = dict(extra or {})  # arrays of the caller, saved along
+
+    @classmethod
+    def Load(cls, path, **kwargs):
+        """ Loads a scorer saved with `save`, returns a new scorer if the file
+        does not exist """
+        if not os.path.exists(path):
+            return cls(**kwargs)
+        with np.load(path, allow_pickle=False) as f:
+            return cls(
+                names  = f["names"].tolist(),
+                rating = f["rating"],
+                rd     = f["rd"],
+                votes  = f["votes"],
+                cursor = int(f["cursor"]),
+                extra  = { k: f[k] for k in f.files if k not in _SAVED },
+                **kwargs
+            )
+
+    def save(self, path):
+        """ Saves the scorer as a compressed `.npz` file """
+        n = self.n_items
+        np.savez_compressed(
+            path,
+            names  = np.array(self.names, dtype=str),
+            rating = self._rating[:n],
+            rd     = self._rd[:n],
+            votes  = self._votes[:n],
+            cursor = np.array(self.cursor),
+            **self.extra
+        )
+
+    @property
+    def n_items(self):
+        return len(self.names)
+
+    @property
+    def rating(self):
+        return self._rating[:self.n_items]
+
+    @property
+    def rd(self):
+        return self._rd[:self.n_items]
+
+    def index(self, name):
+        """ Returns the index of an image, adding it if it is new """
+        i = self.name_to_index.get(name)
+        if i is None:
+            i = len(self.names)
+            if i == len(self._rating):
+                self._grow()
+            self.name_to_index[name] = i
+            self.names.append(name)
+        return i
+
+    def _grow(self):
+        capacity = 2 * len(self._rating)
+        for attr, fill in (("_rating", self.initial_rating), ("_rd", self.initial_rd), ("_votes", 0)):
+            old = getattr(self, attr)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, attr, new)
+
+    def add(self, name1, name2, choice):
+        """ Updates the ratings with one vote, `choice` being one of
+        `mturk_batch.WIN1`, `TIE` or `WIN2` """
+        self.addIndex(self.index(name1), self.index(name2), OUTCOME[choice])
+
+    def addIndex(self, i, j, s):
+        """ Glicko update of images i and j, where `s` is the score of i:
+        1 for a win, 0.5 for a tie and 0 for a loss """
+        r_i, r_j = float(self._rating[i]), float(self._rating[j])
+        rd_i, rd_j = float(self._rd[i]), float(self._rd[j])
+
+        g_j, g_i = _g(rd_j), _g(rd_i)
+        e_i = 1 / (1 + 10 ** (-g_j * (r_i - r_j) / 400))
+        e_j = 1 / (1 + 10 ** (-g_i * (r_j - r_i) / 400))
+
+        v_i = 1 / (1 / rd_i ** 2 + Q ** 2 * g_j ** 2 * e_i * (1 - e_i))
+        v_j = 1 / (1 / rd_j ** 2 + Q ** 2 * g_i ** 2 * e_j * (1 - e_j))
+
+        self._rating[i] = r_i + Q * v_i * g_j * (s - e_i)
+        self._rating[j] = r_j + Q * v_j * g_i * ((1 - s) - e_j)
+        self._rd[i] = max(math.sqrt(v_i), self.min_rd)
+        self._rd[j] = max(math.sqrt(v_j), self.min_rd)
+        self._votes[i] += 1
+        self._votes[j] += 1
+
+    def addVotes(self, votes, unique_images):
+        """ Adds the votes of `mturk_batch.MeltVotes`, in order """
+        index = np.array([self.index(n) for n in unique_images], dtype=np.int64)
+        outcome = np.array([OUTCOME[c] for c in range(3)])
+        rows = zip(
+            index[votes["index1"].values].tolist(),
+            index[votes["index2"].values].tolist(),
+            outcome[votes["choice"].values].tolist(),
+        )
+        for i, j, s in rows:
+            self.addIndex(i, j, s)
+
+    def addCounts(self, name1, name2, win1, win2, tie):
+        """ Adds the votes of an aggregated comparison, interleaved so that
+        the order does not favour one of the images """
+        i, j = self.index(name1), self.index(name2)
+        counts = [(1.0, int(win1)), (0.0, int(win2)), (0.5, int(tie))]
+        outcomes = np.concatenate([np.full(n, s) for s, n in counts])
+        # spread each kind of outcome evenly over the sequence:
+        position = np.concatenate([(np.arange(n) + 0.5) / n for _, n in counts])
+        for s in outcomes[np.argsort(position, kind="mergesort")].tolist():
+            self.addIndex(i, j, s)
+
+    def scores(self, z=1.96):
+        """ Returns a data frame with the columns fname, rating, rd, votes,
+        and violence, ci_low and ci_high: the rating and the interval of
+        +- `z` deviations, min-max scaled to [0, 1] by the ratings """
+        rating, rd = self.rating, self.rd
+        lo, hi = (rating.min(), rating.max()) if self.n_items else (0, 1)
+        span = hi - lo if hi > lo else 1.0
+        return pd.DataFrame({
+            "fname":    self.names,
+            "rating":   rating,
+            "rd":       rd,
+            "votes":    self._votes[:self.n_items],
+            "violence": (rating - lo) / span,
+            "ci_low":   np.clip((rating - z * rd - lo) / span, 0, 1),
+            "ci_high":  np.clip((rating + z * rd - lo) / span, 0, 1),
+        }, columns=["fname", "rating", "rd", "votes", "violence", "ci_low", "ci_high"])
+
+    def snapshot(self, pc, source):
+        """ Replaces the labels of `source` with the current scores, the
+        names being the image hashes. Returns the number of labels """
+        scores = self.scores()
+        return pc.writeLabels(
+            source,
+            scores["fname"],
+            scores["violence"],
+            ci_low  = scores["ci_low"],
+            ci_high = scores["ci_high"],
+        )
@@ -0,0 +1,223 @@
+""" This library builds random k-regular pair graphs for the MTurk input,
+where every image is paired with k distinct other images.
+
+The pairs are drawn with the configuration model: every image is repeated k
+times ("stubs"), the stubs are shuffled and paired up in order. That gives
+every image exactly k pairs in linear time, but a few pairs are bad: an image
+paired with itself, or the same two images paired twice. For n images and k
+pairs there are about (k^2 - 1) / 4 bad pairs whatever n is, and each of them
+is repaired with an edge switch: the bad pair (a, b) and a random good pair
+(c, d) become (a, d) and (c, b), which keeps the number of pairs of every
+image. Both steps only use the random state given, so the same seed
+gives the same pairs, and the number of switches tried is bounded, a draw
+that cannot be repaired is started over, a bounded number of times. When
+more than half of all possible pairs are asked for, the switches get stuck,
+and the pairs are the complement of a random graph with the missing pairs.
+
+Pairs can be excluded, e.g. the near-duplicate images of
+`phash_index.NearPairs`: they count as bad pairs and are switched away like
+the repeated ones.
+
+The bipartite version pairs every image of A with images of B only."""
+
+
+import numpy as np
+import pandas as pd
+
+
+def _Repair(u, v, n_items, rng, bipartite, max_tries, excluded=()):
+    """ Repairs the bad pairs (u[i], v[i]) in place with edge switches.
+    `excluded` is a set of the keys of the pairs that are bad as well.
+    Returns False if it did not succeed within `max_tries` switches """
+    n_pairs = len(u)
+    lo, hi = np.minimum(u, v), np.maximum(u, v)
+    keys = lo * n_items + hi
+    _, first = np.unique(keys, return_index=True)
+    bad = np.ones(n_pairs, dtype=bool)
+    bad[first] = False
+    bad |= u == v
+    if excluded:
+        bad |= np.isin(keys, np.fromiter(excluded, dtype=np.int64, count=len(excluded)))
+    bad_pairs = np.flatnonzero(bad)
+    if not len(bad_pairs):
+        return True
+
+    key = lambda a, b: min(a, b) * n_items + max(a, b)
+    seen = set(keys[~bad].tolist())
+    is_bad = bad.tolist()
+    tries = 0
+    for i in bad_pairs.tolist():
+        while True:
+            tries += 1
+            if tries > max_tries:
+                return False
+            j = int(rng.randint(n_pairs))
+            if is_bad[j]:
+                continue
+            a, b, c, d = int(u[i]), int(v[i]), int(u[j]), int(v[j])
+            if not bipartite and rng.rand() < 0.5:
+                c, d = d, c
+            # (a, b), (c, d) -> (a, d), (c, b) keeps the sides of a
+            # bipartite graph, and is one of the two switches otherwise:
+            if a == d or c == b:
+                continue
+            k1, k2 = key(a, d), key(c, b)
+            if k1 == k2 or k1 in seen or k2 in seen or k1 in excluded or k2 in excluded:
+                continue
+            seen.discard(key(c, d))
+            seen.add(k1)
+            seen.add(k2)
+            u[i], v[i], u[j], v[j] = a, d, c, b
+            is_bad[i] = False
+            break
+    return True
+
+def _Draw(stubs_u, stubs_v, n_items, rng, bipartite, max_restarts, max_tries, excluded=()):
+    """ Pairs the shuffled stubs, repairing the bad pairs """
+    for _ in range(max_restarts + 1):
+        if bipartite:
+            u = stubs_u.copy()
+            v = stubs_v[rng.permutation(len(stubs_v))]
+        else:
+            shuffled = stubs_u[rng.permutation(len(stubs_u))]
+            u, v = shuffled[0::2].copy(), shuffled[1::2].copy()
+        if _Repair(u, v, n_items, rng, bipartite, max_tries(len(u)), excluded):
+            return u, v
+    raise RuntimeError(
+        "Could not draw the pairs in %s attempts, there are too few images "
+        "for the number of pairs" % (max_restarts + 1)
+    )
+
+def _Keys(u, v, n_items):
+    """ The set of the keys of the pairs (u[i], v[i]), in either order """
+    u = np.asarray(u, dtype=np.int64)
+    v = np.asarray(v, dtype=np.int64)
+    return set((np.minimum(u, v) * n_items + np.maximum(u, v)).tolist())
+
+def _MaxTries(n_pairs):
+    return 1000 + 100 * int(np.sqrt(n_pairs))
+
+def _Complement(keys, all_u, all_v, all_keys, rng):
+    """ Returns the pairs (all_u, all_v) whose keys are not in `keys`, in
+    random order """
+    keep = np.flatnonzero(~np.isin(all_keys, keys))
+    keep = keep[rng.permutation(len(keep))]
+    return all_u[keep], all_v[keep]
+
+def RandomPairs(n_items, k, seed=None, max_restarts=10, exclude=None):
+    """ Returns two arrays (u, v) holding the n_items * k / 2 pairs of a
+    random graph on the images 0 .. n_items - 1 where every image has k
+    pairs, all with distinct images. `seed` is a seed or a RandomState.
+    `exclude` is an optional tuple of two arrays of pairs (a, b) that are
+    never drawn """
+    if k >= n_items:
+        raise ValueError("Cannot pair %s images with %s others each" % (n_items, k))
+    if n_items * k % 2:
+        raise ValueError("n_items * k must be even, got %s * %s" % (n_items, k))
+    rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+    excluded = _Keys(exclude[0], exclude[1], n_items) if exclude is not None else set()
+    if 2 * k > n_items - 1 and not excluded:
+        # dense, where edge switches get stuck: the complement of a random
+        # graph with n_items - 1 - k pairs per image is a random graph with k:
+        u, v = RandomPairs(n_items, n_items - 1 - k, seed=rng, max_restarts=max_restarts)
+        i, j = np.triu_indices(n_items, 1)
+        i, j = i.astype(np.int64), j.astype(np.int64)
+        keys = np.minimum(u, v) * n_items + np.maximum(u, v)
+        return _Complement(keys, i, j, i * n_items + j, rng)
+    stubs = np.repeat(np.arange(n_items, dtype=np.int64), k)
+    return _Draw(stubs, None, n_items, rng, False, max_restarts, _MaxTries, excluded)
+
+def RandomBipartitePairs(n_a, n_b, k, seed=None, max_restarts=10, same=None, exclude=None):
+    """ Returns two arrays (u, v), u indexes 0 .. n_a - 1 into A and v
+    indexes 0 .. n_b - 1 into B, where every image of A has k pairs and every
+    image of B has k * n_a / n_b pairs, all with distinct images. `same` is
+    an optional array of length n_b holding for each image of B its index in
+    A if it is in both, else -1, so that no image is paired with itself.
+    `exclude` is an optional tuple of two arrays of pairs (a, b), a into A
+    and b into B, that are never drawn """
+    if (n_a * k) % n_b:
+        raise ValueError("n_a * k must be a multiple of n_b, got %s * %s and %s" % (n_a, k, n_b))
+    k_b = n_a * k // n_b
+    if k > n_b or k_b > n_a:
+        raise ValueError("Cannot pair %s x %s images with %s pairs each" % (n_a, n_b, k))
+    rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+    if 2 * k > n_b and (same is None or np.all(np.asarray(same) < 0)) and exclude is None:
+        # dense, see `RandomPairs`:
+        u, v = RandomBipartitePairs(n_a, n_b, n_b - k, seed=rng, max_restarts=max_restarts)
+        i, j = np.indices((n_a, n_b)).reshape(2, -1).astype(np.int64)
+        return _Complement(u * n_b + v, i, j, i * n_b + j, rng)
+
+    # A are 0 .. n_a - 1 and B are n_a .. n_a + n_b - 1, except the images
+    # that are in both:
+    b_index = np.arange(n_a, n_a + n_b, dtype=np.int64)
+    if same is not None:
+        same = np.asarray(same, dtype=np.int64)
+        b_index = np.where(same >= 0, same, b_index)
+    excluded = set()
+    if exclude is not None:
+        excluded = _Keys(exclude[0], b_index[np.asarray(exclude[1], dtype=np.int64)], n_a + n_b)
+    u, v = _Draw(
+        np.repeat(np.arange(n_a, dtype=np.int64), k),
+        np.repeat(b_index, k_b),
+        n_a + n_b, rng, True, max_restarts, _MaxTries, excluded,
+    )
+    to_b = np.empty(n_a + n_b, dtype=np.int64)
+    to_b[b_index] = np.arange(n_b)
+    return u, to_b[v]
+
+def PairsToDict(names_u, names_v):
+    """ Returns the dict of `amazon_input_driver.create_random_pairs`, the
+    list of the images paired with each image """
+    pairs = {}
+    for a, b in zip(names_u, names_v):
+        pairs.setdefault(a, []).append(b)
+        pairs.setdefault(b, []).append(a)
+    return pairs
+
+def _Indexes(names, exclude):
+    """ The positions in `names` of the excluded pairs of names (a, b), the
+    pairs with a name that is not in `names` dropped """
+    index = pd.Index(names)
+    a = index.get_indexer(np.asarray(exclude[0], dtype=object))
+    b = index.get_indexer(np.asarray(exclude[1], dtype=object))
+    keep = (a >= 0) & (b >= 0)
+    return a[keep], b[keep]
+
+def NamePairs(names, k, seed=None, exclude=None):
+    """ Returns the names of the images of each pair, as two arrays, for a
+    list of image names, see `RandomPairs`. `exclude` is an optional tuple
+    of two arrays of the names of pairs that are never drawn """
+    names = np.asarray(names, dtype=object)
+    if len(pd.unique(names)) != len(names):
+        raise ValueError("The image names are not unique")
+    if exclude is not None:
+        exclude = _Indexes(names, exclude)
+    u, v = RandomPairs(len(names), k, seed=seed, exclude=exclude)
+    return names[u], names[v]
+
+def NamePairsFrom(A, B, k, seed=None, exclude=None):
+    """ Returns the names of the images of each pair (a, b), a in A and b in
+    B, as two arrays, see `RandomBipartitePairs`. `exclude` is as in
+    `NamePairs`, in either order """
+    A = np.asarray(A, dtype=object)
+    B = np.asarray(B, dtype=object)
+    if len(pd.unique(A)) != len(A) or len(pd.unique(B)) != len(B):
+        raise ValueError("The image names are not unique")
+    a_index = pd.Series(np.arange(len(A)), index=A)
+    same = a_index.reindex(B).fillna(-1).values.astype(np.int64)
+    if exclude is not None:
+        x, y = np.asarray(exclude[0], dtype=object), np.asarray(exclude[1], dtype=object)
+        a, b = pd.Index(A).get_indexer(np.concatenate([x, y])), pd.Index(B).get_indexer(np.concatenate([y, x]))
+        keep = (a >= 0) & (b >= 0)
+        exclude = (a[keep], b[keep])
+    u, v = RandomBipartitePairs(len(A), len(B), k, seed=seed, same=same, exclude=exclude)
+    return A[u], B[v]
+
+def PairNames(names, k, seed=None, exclude=None):
+    """ Returns the dict of pairs for a list of image names, see `RandomPairs` """
+    return PairsToDict(*NamePairs(names, k, seed=seed, exclude=exclude))
+
+def PairNamesFrom(A, B, k, seed=None, exclude=None):
+    """ Returns the dict of pairs (a, b), a in A and b in B, see
+    `RandomBipartitePairs` """
+    return PairsToDict(*NamePairsFrom(A, B, k, seed=seed, exclude=exclude))
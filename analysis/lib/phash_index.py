@@ -0,0 +1,153 @@
+""" This library finds the near-duplicate images by their perceptual hash,
+the 64 bit dhash the images are stored under, so that they are not paired.
+
+Two images are near-duplicates when their hashes differ in at most `radius`
+bits, e.g. retweets of the same photo that were cropped or compressed a bit
+differently. Comparing all n^2 hashes is too slow for tens of thousands of
+images, so the hashes are indexed by multi-index hashing: the 64 bits are
+split into m chunks, and two hashes within the radius have at least one chunk
+that differs in at most radius // m bits (pigeonhole). The chunk values are
+kept sorted, and the candidates of a hash are looked up by its chunk values
+with up to radius // m bits flipped. The candidates are then
+checked on the full hash. The chunks are about log2(n) bits wide, so that a
+chunk value matches few hashes by chance.
+
+Example usage:
+```
+index = HashIndex(["f0e4c2d1a3b59687", "f0e4c2d1a3b59686", ...], radius=4)
+index.near("f0e4c2d1a3b59687")    # the positions of the near-duplicates
+i, j = index.pairs()              # all pairs of near-duplicates
+```
+"""
+
+
+import itertools
+import numpy as np
+
+BITS = 64
+RADIUS = 4
+TABLE_BITS = 20
+
+# the number of set bits of every byte:
+_POPCOUNT8 = np.array([bin(b).count("1") for b in range(256)], dtype=np.int64)
+
+
+def HashBits(hashes):
+    """ Returns the hex hashes as an array of uint64 """
+    bits = np.empty(len(hashes), dtype=np.uint64)
+    for i, h in enumerate(hashes):
+        if len(h) != BITS // 4:
+            raise ValueError("'%s' is not a %s bit hex hash" % (h, BITS))
+        bits[i] = int(h, 16)
+    return bits
+
+def PopCount(x):
+    """ The number of set bits of each uint64 """
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def Hamming(a, b):
+    """ The number of bits in which the uint64 hashes a and b differ """
+    return PopCount(np.bitwise_xor(a, b))
+
+def _Chunks(n_items, radius):
+    """ Returns the (shift, width) of the chunks for n_items hashes """
+    width = max(1, int(np.ceil(np.log2(max(n_items, 2)))))
+    m = max(1, min(radius + 1, BITS // width))
+    edges = np.linspace(0, BITS, m + 1).astype(int)
+    return [(int(lo), int(hi - lo)) for lo, hi in zip(edges[:-1], edges[1:])]
+
+def _Masks(width, flips):
+    """ All the values of `width` bits with at most `flips` bits set """
+    masks = [0]
+    for f in range(1, min(flips, width) + 1):
+        masks.extend(sum(1 << b for b in bs) for bs in itertools.combinations(range(width), f))
+    return np.array(masks, dtype=np.uint64)
+
+def _Lookup(sorted_values, first, wanted):
+    """ The range lo .. hi - 1 of each of the `wanted` values in
+    `sorted_values` """
+    if first is not None:
+        wanted = wanted.astype(np.int64)
+        return first[wanted], first[wanted + 1]
+    return (np.searchsorted(sorted_values, wanted, side="left"),
+            np.searchsorted(sorted_values, wanted, side="right"))
+
+
+class HashIndex:
+    """ The multi-index of a list of 64 bit hashes, see the module docstring """
+
+    def __init__(self, hashes, radius=RADIUS):
+        self.bits = hashes if isinstance(hashes, np.ndarray) else HashBits(hashes)
+        self.bits = self.bits.astype(np.uint64)
+        self.radius = radius
+        chunks = _Chunks(len(self.bits), radius)
+        flips = radius // len(chunks)
+        self.chunks = []
+        for shift, width in chunks:
+            values = (self.bits >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            order = np.argsort(values, kind="mergesort")
+            sorted_values = values[order]
+            # for narrow chunks the start of every value in sorted_values,
+            # so a lookup is two array reads instead of a binary search:
+            first = None
+            if width <= TABLE_BITS:
+                first = np.searchsorted(sorted_values, np.arange((1 << width) + 1, dtype=np.uint64))
+            self.chunks.append((shift, width, values, order, sorted_values, first, _Masks(width, flips)))
+
+    def __len__(self):
+        return len(self.bits)
+
+    def _candidates(self, chunk, positions):
+        """ Returns the pairs (i, j), i in `positions`, where the chunk
+        values of i and j differ in at most radius // m bits """
+        _, _, values, order, sorted_values, first, masks = self.chunks[chunk]
+        wanted = np.bitwise_xor(values[positions][:, None], masks[None, :]).ravel()
+        lo, hi = _Lookup(sorted_values, first, wanted)
+        counts = hi - lo
+        i = np.repeat(np.repeat(positions, len(masks)), counts)
+        # the positions lo .. hi - 1 of every lookup, one after the other:
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        j = order[starts + np.arange(counts.sum())]
+        return i, j
+
+    def _within(self, i, j):
+        keep = (i != j) & (Hamming(self.bits[i], self.bits[j]) <= self.radius)
+        return i[keep], j[keep]
+
+    def near(self, h):
+        """ Returns the positions of the hashes within the radius of `h`, a
+        hex hash or a uint64, the hashes equal to `h` excluded """
+        bits = np.array([int(h, 16) if isinstance(h, str) else h], dtype=np.uint64)
+        found = []
+        for shift, width, _, order, sorted_values, first, masks in self.chunks:
+            value = (bits >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            lo, hi = _Lookup(sorted_values, first, np.bitwise_xor(value, masks))
+            found.extend(order[a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a)
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        found = np.unique(np.concatenate(found))
+        distance = Hamming(self.bits[found], np.repeat(bits, len(found)))
+        return found[(distance <= self.radius) & (distance > 0)]
+
+    def pairs(self, chunk_size=10000):
+        """ Returns all the pairs (i, j), i < j, of hashes within the
+        radius, as two arrays. The lookups go `chunk_size` hashes at a time
+        to bound the memory """
+        keys = []
+        n_items = len(self.bits)
+        for chunk in range(len(self.chunks)):
+            for start in range(0, n_items, chunk_size):
+                positions = np.arange(start, min(start + chunk_size, n_items))
+                i, j = self._within(*self._candidates(chunk, positions))
+                keep = i < j
+                keys.append(i[keep] * n_items + j[keep])
+        if not keys:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        keys = np.unique(np.concatenate(keys))
+        return keys // n_items, keys % n_items
+
+def NearPairs(hashes, radius=RADIUS):
+    """ Returns the pairs (i, j), i < j, of positions in the list of hex
+    hashes that are within `radius` bits of each other """
+    return HashIndex(hashes, radius).pairs()
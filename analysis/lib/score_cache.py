@@ -0,0 +1,118 @@
+""" This library caches computed scores by the content of their input.
+
+A score run is identified by a digest of the comparison set it was computed
+from (the source filter, the number of rows, the latest timestamp and a hash
+of the rows) and of the solver parameters. The scores and the image names
+they belong to are stored as `<digest>.npz` in the cache folder. The same
+inputs give the same digest and the cached scores are returned right away,
+while any change in the comparisons or in the parameters gives a new digest,
+so the scores are never stale.
+
+Example usage:
+```
+scores = CachedScores(df, "drivers_output/score_cache", source="UCLA")
+```
+"""
+
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from . import pairwise_solver
+from .comparison_graph import IndexComparisons
+
+# bump when the solver changes in a way that changes the scores, the
+# `score_state` files saved before are then re-solved when loaded:
+SOLVER_VERSION = 2
+
+COLUMNS = ["image1", "image2", "win1", "win2", "tie"]
+
+
+def Digest(comparisons, source=None, **solver_kwargs):
+    """ Returns the hex digest identifying the scores of `comparisons`, a data
+    frame with the columns image1, image2, win1, win2, tie and optionally
+    timestamp. `source` describes the filter the comparisons were selected
+    with. The row order does not matter. """
+    rows = pd.util.hash_pandas_object(comparisons[COLUMNS], index=False).values
+    latest = str(comparisons["timestamp"].max()) if "timestamp" in comparisons and len(comparisons) else ""
+    header = json.dumps({
+        "source":    source,
+        "rows":      len(comparisons),
+        "timestamp": latest,
+        "solver":    SOLVER_VERSION,
+        "params":    solver_kwargs,
+    }, sort_keys=True)
+
+    sha1 = hashlib.sha1(header.encode("utf-8"))
+    sha1.update(np.sort(rows).tobytes())
+    return sha1.hexdigest()
+
+def ComputeScores(comparisons, **solver_kwargs):
+    """ Returns the image names, in order of first appearance, and their
+    scores. Keyword arguments are passed on to `pairwise_solver.OptPairwise` """
+    names, index1, index2 = IndexComparisons(comparisons)
+    params = pairwise_solver.OptChoixPairwise(
+        len(names),
+        index1,
+        index2,
+        comparisons["win1"].values,
+        comparisons["win2"].values,
+        comparisons["tie"].values,
+        **solver_kwargs
+    )
+    return names, params
+
+
+class ScoreCache:
+    """ A folder of `.npz` files holding scores, named by their digest """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, digest):
+        return os.path.join(self.folder, "%s.npz" % digest)
+
+    def load(self, digest):
+        """ Returns the names and scores stored under `digest`, or None """
+        path = self.path(digest)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as f:
+            return f["names"].astype(object), f["params"]
+
+    def save(self, digest, names, params):
+        """ Stores the names and scores under `digest`. The file is written
+        under a temporary name first, so a run that is interrupted never
+        leaves a broken file behind """
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        tmp = self.path(digest + ".tmp")
+        np.savez_compressed(
+            tmp,
+            names  = np.array(names, dtype=str),
+            params = np.asarray(params, dtype=np.float64),
+        )
+        os.replace(tmp, self.path(digest))
+
+    def scores(self, comparisons, source=None, **solver_kwargs):
+        """ Returns the names and scores of `comparisons`, from the cache if
+        they were computed before, otherwise they are computed and stored """
+        digest = Digest(comparisons, source=source, **solver_kwargs)
+        cached = self.load(digest)
+        if cached is not None:
+            return cached
+        names, params = ComputeScores(comparisons, **solver_kwargs)
+        self.save(digest, names, params)
+        return names, params
+
+def CachedScores(comparisons, folder, source=None, **solver_kwargs):
+    """ Returns a data frame with the columns violence and fname, like
+    `csv_scores.ReadScoresFromCsv`, using the cache in `folder` """
+    names, params = ScoreCache(folder).scores(comparisons, source=source, **solver_kwargs)
+    return pd.DataFrame({
+        "violence": params,
+        "fname":    names,
+    }, columns=["violence", "fname"])
@@ -0,0 +1,189 @@
+""" This library keeps a persisted score state, so that scores can be
+updated when new comparisons arrive instead of being computed from scratch.
+
+The state holds the image names, the aggregated counts per image pair and
+the current scores. `ScoreState.update` adds new comparisons to the counts
+and re-solves only the components of the comparison graph that the new
+comparisons touch, warm-started from the previous scores, which typically
+takes a handful of iterations. The solver parameters are the ones of a full
+run, so that the updates give the scores of a re-solve from scratch."""
+
+
+import os
+import numpy as np
+import pandas as pd
+
+from . import pairwise_solver
+from .score_cache import SOLVER_VERSION
+
+class ScoreState:
+    """ Scores plus the aggregated comparison counts they were computed from.
+
+    Example usage:
+    ```
+    state = ScoreState.Load("scores.npz")   # or ScoreState() the first time
+    state.update(comparisons)               # columns image1, image2, win1, win2, tie
+    state.save("scores.npz")
+    state.scores()
+    ```
+    """
+
+    def __init__(self, names=(), index1=(), index2=(), win1=(), win2=(), tie=(),
+                 params=(), keys=(), timestamp=None, **solver_kwargs):
+        self.names = list(names)
+        self.name_to_index = { n: i for i, n in enumerate(self.names) }
+        self.index1 = np.asarray(index1, dtype=np.int64)
+        self.index2 = np.asarray(index2, dtype=np.int64)
+        self.win1 = np.asarray(win1, dtype=np.float64)
+        self.win2 = np.asarray(win2, dtype=np.float64)
+        self.tie = np.asarray(tie, dtype=np.float64)
+        self.params = np.asarray(params, dtype=np.float64)
+        self.keys = set(keys)        # identifiers of the updates already included
+        self.timestamp = timestamp   # the latest comparison timestamp included
+        self.solver_kwargs = solver_kwargs
+
+    @classmethod
+    def Load(cls, path, **solver_kwargs):
+        """ Loads a state saved with `save`, returns an empty state if the
+        file does not exist. The scores of a state saved by another solver
+        version are re-computed """
+        if not os.path.exists(path):
+            return cls(**solver_kwargs)
+        with np.load(path, allow_pickle=False) as f:
+            timestamp = str(f["timestamp"]) if f["timestamp"].size else None
+            solver = int(f["solver"]) if "solver" in f else None
+            state = cls(
+                names     = f["names"].tolist(),
+                index1    = f["index1"],
+                index2    = f["index2"],
+                win1      = f["win1"],
+                win2      = f["win2"],
+                tie       = f["tie"],
+                params    = f["params"],
+                keys      = f["keys"].tolist(),
+                timestamp = timestamp or None,
+                **solver_kwargs
+            )
+        if solver != SOLVER_VERSION and state.n_items:
+            state._resolve(np.arange(state.n_items), state.params, state.n_items)
+        return state
+
+    def save(self, path):
+        """ Saves the state as a compressed `.npz` file """
+        np.savez_compressed(
+            path,
+            names     = np.array(self.names, dtype=str),
+            index1    = self.index1,
+            index2    = self.index2,
+            win1      = self.win1,
+            win2      = self.win2,
+            tie       = self.tie,
+            params    = self.params,
+            keys      = np.array(sorted(self.keys), dtype=str),
+            timestamp = np.array(self.timestamp or "", dtype=str),
+            solver    = SOLVER_VERSION,
+        )
+
+    @property
+    def n_items(self):
+        return len(self.names)
+
+    def _indices(self, names):
+        """ Returns the indices of `names`, adding the unknown names """
+        names = list(names)
+        for n in pd.unique(np.asarray(names, dtype=object)):
+            if n not in self.name_to_index:
+                self.name_to_index[n] = len(self.names)
+                self.names.append(n)
+        return np.array([self.name_to_index[n] for n in names], dtype=np.int64)
+
+    def update(self, comparisons, key=None):
+        """ Adds the comparisons, a data frame with the columns image1,
+        image2, win1, win2 and tie, and re-computes the scores of the
+        affected components. If `key` is set and was seen before, nothing
+        happens, so that the same batch is not counted twice.
+
+        Returns the indices of the images whose scores were re-computed."""
+        if key is not None:
+            if key in self.keys:
+                return np.array([], dtype=np.int64)
+            self.keys.add(key)
+        if "timestamp" in comparisons and len(comparisons):
+            latest = str(comparisons["timestamp"].max())
+            self.timestamp = max(self.timestamp or latest, latest)
+
+        n_old = self.n_items
+        i = self._indices(comparisons["image1"])
+        j = self._indices(comparisons["image2"])
+        w1 = comparisons["win1"].values.astype(np.float64)
+        w2 = comparisons["win2"].values.astype(np.float64)
+        t = comparisons["tie"].values.astype(np.float64)
+
+        # Sum up the counts per pair, the pairs are kept with the lowest
+        # index first, and the old pairs keep their positions:
+        swap = i > j
+        i, j = np.where(swap, j, i), np.where(swap, i, j)
+        w1, w2 = np.where(swap, w2, w1), np.where(swap, w1, w2)
+
+        n = self.n_items
+        keys = np.concatenate([self.index1 * n + self.index2, i * n + j])
+        codes, unique_keys = pd.factorize(keys)
+        n_pairs = len(unique_keys)
+        self.index1 = unique_keys // n
+        self.index2 = unique_keys % n
+        self.win1 = np.bincount(codes, np.concatenate([self.win1, w1]), n_pairs)
+        self.win2 = np.bincount(codes, np.concatenate([self.win2, w2]), n_pairs)
+        self.tie = np.bincount(codes, np.concatenate([self.tie, t]), n_pairs)
+
+        old_params = self.params
+        self.params = np.concatenate([old_params, np.zeros(n - n_old)])
+        touched = np.unique(np.concatenate([i, j]))
+        return self._resolve(touched, old_params, n_old)
+
+    def _resolve(self, touched, old_params, n_old):
+        """ Re-solves the components holding the `touched` images """
+        _, labels = pairwise_solver.Components(self.n_items, self.index1, self.index2)
+        affected = np.isin(labels, labels[touched])
+        items = np.flatnonzero(affected)
+        if len(items) == 0:
+            return items
+
+        local = np.full(self.n_items, -1, dtype=np.int64)
+        local[items] = np.arange(len(items))
+        pairs = affected[self.index1]
+
+        params = pairwise_solver.OptChoixPairwise(
+            len(items),
+            local[self.index1[pairs]],
+            local[self.index2[pairs]],
+            self.win1[pairs],
+            self.win2[pairs],
+            self.tie[pairs],
+            initial_params = self.params[items],
+            **self.solver_kwargs
+        )
+
+        # Keep the scale of the scores from before: within each component,
+        # the images that already had a score keep the same mean score.
+        comp = labels[items]
+        was_scored = items < n_old
+        if was_scored.any():
+            _, comp_codes = np.unique(comp, return_inverse=True)
+            n_comp = comp_codes.max() + 1
+            counts = np.bincount(comp_codes[was_scored], minlength=n_comp)
+            shift = (
+                np.bincount(comp_codes[was_scored], old_params[items[was_scored]], n_comp) -
+                np.bincount(comp_codes[was_scored], params[was_scored], n_comp)
+            ) / np.maximum(counts, 1)
+            params = params + shift[comp_codes]
+
+        self.params[items] = params
+        return items
+
+    def scores(self):
+        """ Returns a data frame with the columns fname and violence, the
+        violence being the raw score """
+        return pd.DataFrame({
+            "fname":    self.names,
+            "violence": self.params,
+        }, columns=["fname", "violence"])
@@ -0,0 +1,153 @@
+""" This library estimates how reliable each MTurk worker is, from the votes
+of `mturk_batch.MeltVotes` with the WorkerId column, and turns it into a
+weight per vote for `mturk_batch.AggregateVotes`.
+
+Two measures are available:
+    Divergence  the share of the pairs of a worker where the vote differs from
+                the most frequent vote of the pair, as in
+                `annomaly_detection/annomaly_detection.py`
+    DawidSkene  the EM estimate of Dawid and Skene (1979), "Maximum likelihood
+                estimation of observer error-rates using the EM algorithm",
+                with a 3 x 3 confusion matrix per worker over the answers
+                (first image, same, second image)
+
+Both work on integer codes of the pairs and the workers, the divergence is a
+few `np.bincount` over the votes and each EM step is two sparse matrix
+products."""
+
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+N_CHOICES = 3
+
+
+def _Codes(votes, worker_col):
+    """ Returns the pair code and the worker code of each vote, and the
+    worker ids """
+    n_items = max(votes["index1"].max(), votes["index2"].max()) + 1
+    pair, _ = pd.factorize(votes["index1"].values.astype(np.int64) * n_items + votes["index2"].values)
+    worker, workers = pd.factorize(votes[worker_col].values)
+    return pair, worker, np.asarray(workers, dtype=object)
+
+def Mode(pair, choice, n_pairs):
+    """ Returns the most frequent choice of each pair code, -1 where more
+    than one choice is the most frequent """
+    counts = np.bincount(pair * N_CHOICES + choice, minlength=n_pairs * N_CHOICES)
+    counts = counts.reshape(n_pairs, N_CHOICES)
+    top = counts.max(axis=1)
+    has_mode = (counts == top[:, None]).sum(axis=1) == 1
+    return np.where(has_mode, counts.argmax(axis=1), -1)
+
+def LastVotes(worker, pair, n_pairs):
+    """ Returns the positions of the last vote of each worker on each pair,
+    in order """
+    key = worker.astype(np.int64) * max(n_pairs, 1) + pair
+    _, first_from_end = np.unique(key[::-1], return_index=True)
+    return np.sort(len(key) - 1 - first_from_end)
+
+def DivergenceCodes(worker, pair, choice, n_workers, mode):
+    """ Returns the divergence of each worker code, given the codes of the
+    votes and the most frequent choice of each pair, see `Mode` """
+    last = LastVotes(worker, pair, len(mode))
+    w, p, c = worker[last], pair[last], choice[last]
+    divergent = (mode[p] >= 0) & (c != mode[p])
+    total = np.bincount(w, minlength=n_workers)
+    return np.bincount(w, divergent, n_workers) / np.maximum(total, 1)
+
+def Divergence(votes, worker_col="WorkerId"):
+    """ Returns a Series with the divergence of each worker: the share of the
+    pairs voted by the worker where the vote is not the most frequent vote of
+    the pair. Pairs with more than one most frequent vote are never counted
+    as divergent, and a worker who voted on a pair twice counts with the last
+    vote. `annomaly_detection.py` computes it the same way, on its own codes """
+    pair, worker, workers = _Codes(votes, worker_col)
+    choice = votes["choice"].values
+    n_pairs = pair.max() + 1 if len(pair) else 0
+    return pd.Series(
+        DivergenceCodes(worker, pair, choice, len(workers), Mode(pair, choice, n_pairs)),
+        index=workers,
+        name="divergence",
+    )
+
+def DawidSkene(votes, worker_col="WorkerId", max_iter=100, tol=1e-6, smoothing=0.01):
+    """ Runs the Dawid-Skene EM. Returns
+        posterior   n_pairs x 3, the probability of each answer being the true
+                    one for each pair, pairs in order of first appearance
+        confusion   n_workers x 3 x 3, the probability of a worker answering
+                    l (last axis) when the true answer is k (middle axis)
+        prior       the probability of each true answer
+        workers     the worker ids
+    `smoothing` is added to the confusion counts, so that a worker with few
+    votes does not get probabilities of 0 """
+    pair, worker, workers = _Codes(votes, worker_col)
+    choice = votes["choice"].values.astype(np.int64)
+    n_pairs = pair.max() + 1 if len(pair) else 0
+    n_workers = len(workers)
+    K = N_CHOICES
+
+    # votes as a (worker, answer) x pair matrix of counts, so that both
+    # steps are a sparse matrix product:
+    votes_matrix = sparse.csr_matrix(
+        (np.ones(len(pair)), (worker * K + choice, pair)),
+        shape=(n_workers * K, n_pairs)
+    )
+    votes_matrix_t = votes_matrix.T.tocsr()
+
+    # initialized with the share of each answer per pair:
+    posterior = np.bincount(pair * K + choice, minlength=n_pairs * K).reshape(n_pairs, K)
+    posterior = posterior / posterior.sum(axis=1, keepdims=True)
+
+    log_likelihood = -np.inf
+    for _ in range(max_iter):
+        # M-step, the confusion counts of worker w for true answer k and
+        # answer l are the sum of the posteriors of k over the votes w, l:
+        prior = posterior.mean(axis=0)
+        confusion = votes_matrix.dot(posterior).reshape(n_workers, K, K).transpose(0, 2, 1)
+        confusion = confusion + smoothing
+        confusion /= confusion.sum(axis=2, keepdims=True)
+
+        # E-step:
+        log_confusion = np.log(confusion).transpose(0, 2, 1).reshape(n_workers * K, K)
+        log_posterior = np.log(prior) + votes_matrix_t.dot(log_confusion)
+        # (reductions column by column, which is much faster over 3 columns)
+        top = np.maximum(np.maximum(log_posterior[:, 0], log_posterior[:, 1]), log_posterior[:, 2])
+        posterior = np.exp(log_posterior - top[:, None])
+        norm = posterior[:, 0] + posterior[:, 1] + posterior[:, 2]
+        posterior /= norm[:, None]
+
+        new_log_likelihood = np.sum(np.log(norm) + top)
+        if abs(new_log_likelihood - log_likelihood) < tol * abs(new_log_likelihood):
+            break
+        log_likelihood = new_log_likelihood
+
+    return posterior, confusion, prior, workers
+
+def DawidSkeneReliability(votes, worker_col="WorkerId", **kwargs):
+    """ Returns a Series with the reliability of each worker from the
+    Dawid-Skene confusion matrices: the probability of answering the true
+    answer, corrected for chance, so that 1 is a perfect worker and 0 a
+    worker that is no better than answering at random by the prior """
+    _, confusion, prior, workers = DawidSkene(votes, worker_col, **kwargs)
+    accuracy = np.einsum("k,wkk->w", prior, confusion)
+    chance = np.sum(prior ** 2)
+    return pd.Series(
+        np.clip((accuracy - chance) / (1 - chance), 0, 1),
+        index=workers,
+        name="reliability",
+    )
+
+def WorkerReliability(votes, method="dawid-skene", worker_col="WorkerId"):
+    """ Returns a Series with the reliability in [0, 1] of each worker, by
+    `method`: "divergence" (1 - divergence) or "dawid-skene" """
+    if method == "divergence":
+        return (1 - Divergence(votes, worker_col)).rename("reliability")
+    if method == "dawid-skene":
+        return DawidSkeneReliability(votes, worker_col)
+    raise ValueError("Unknown method: %s" % method)
+
+def VoteWeights(votes, reliability, worker_col="WorkerId"):
+    """ Returns the weight of each vote, the reliability of its worker """
+    return votes[worker_col].map(reliability).fillna(0).values
@@ -1,144 +1,222 @@
-
-import csv
-import statistics
-from PIL import Image
-import requests
-from io import BytesIO
 import argparse
+import numpy as np
+import pandas as pd
+from image_cache import ImageCache, Prefetcher, SideBySide, CACHE_DIR
+# run from the repository root with PYTHONPATH=., see the README:
+from analysis.lib import worker_quality
 
-PATH_TO_FILE = "../mturk/Batch_3134899_batch_results.csv"
+PATH_TO_FILE = "mturk/Batch_3134899_batch_results.csv"
 
 """
 This script has two purposes. First is to calculate a divergency measure defined as "the percentage of votes that deviate from the most frequent vote across
 the whole data set". The second purpouse is, given a worker, visually inspects his votes.
-"""
 
-class Worker:
-	"""Defines a mturk worker as his id and votes he had"""
+The votes are kept as integer columns: the image urls, the image pairs and the worker ids are
+encoded as ints with `pd.factorize`, so that the most frequent vote of every pair and the divergence
+of every worker are computed with a few `np.bincount`, also over many batch files at once.
+"""
 
-	def __init__(self, id):
-		self.id = id
-		self.votes = {}
+# The pair columns of the batch file, in the order they appear in the row:
+IMG_COLS = [("Input.image_%s-1" % i, "Input.image_%s-2" % i) for i in range(10)]
+ANSWER_COLS = ["Answer.choice%s" % i for i in range(10)]
+TIME_COLS = ["WorkTimeInSeconds", "AcceptTime", "SubmitTime"]
+VOTES = np.array([-1, 0, 1])
+
+
+class Votes:
+	"""The votes of one or more batch files as integer columns:
+		worker, pair, vote      one entry per vote, in file order, where vote is the index in VOTES
+		workers                 the worker ids, by worker code
+		urls                    the image urls, by url code
+		pair_urls               n_pairs x 2, the url codes of each pair
+		work_time               one entry per assignment (row), the seconds spent on it, NaN if unknown
+	The votes of an assignment are the 10 consecutive votes vote[10 * row: 10 * row + 10]
+	"""
 
-	def add_vote(self, img_tuple, vote):
-		self.votes[img_tuple] = vote
+	def __init__(self, worker, pair, vote, workers, urls, pair_urls, work_time=None):
+		self.worker = worker
+		self.pair = pair
+		self.vote = vote
+		self.workers = workers
+		self.urls = urls
+		self.pair_urls = pair_urls
+		self.work_time = np.full(len(worker) // 10, np.nan) if work_time is None else work_time
 
-	def __eq__(self, other):
-		return self.id == other.id
+	@property
+	def n_pairs(self):
+		return len(self.pair_urls)
 
-	def __repr__(self):
-		return str(self.votes)
+	@property
+	def n_workers(self):
+		return len(self.workers)
 
-	def inspectVote(self, img_tuple):
-		print(img_tuple)
-		try:
-			img1_req = requests.get(img_tuple[0], timeout = 10)
-			img1 = Image.open(BytesIO(img1_req.content))
-			img2_req = requests.get(img_tuple[1], timeout = 10)
-			img2 = Image.open(BytesIO(img2_req.content))
+	@property
+	def assignment_worker(self):
+		return self.worker[::10]
 
-			img1.show()
-			input("image 1")
-			img2.show()
-			input("image 2")
+	def pairUrls(self, pair):
+		return tuple(self.urls[self.pair_urls[pair]])
 
-			print(self.votes[img_tuple])
-		except Exception as e:
-			print ("could not load link")
-			print(e)
 
+def WorkTime(chunk):
+	"""
+	Returns the seconds spent on each assignment of a chunk of a batch file, from WorkTimeInSeconds
+	or else from SubmitTime - AcceptTime, NaN when neither is there
+	"""
+	if "WorkTimeInSeconds" in chunk:
+		return pd.to_numeric(chunk["WorkTimeInSeconds"], errors="coerce").values.astype(np.float64)
+	if "AcceptTime" in chunk and "SubmitTime" in chunk:
+		# as in "Tue Mar 20 03:12:45 PDT 2018", both in the same time zone:
+		parse = lambda col: pd.to_datetime(
+			chunk[col].replace(r" [A-Z]{3,4} (\d{4})$", r" \1", regex=True),
+			format="%a %b %d %H:%M:%S %Y",
+			errors="coerce",
+		)
+		return (parse("SubmitTime") - parse("AcceptTime")).dt.total_seconds().values
+	return np.full(len(chunk), np.nan)
+
+
+def ReadVotes(csv_paths, chunksize=100000):
+	"""
+	Reads the votes of one or more batch files. The files are read in chunks, and only the
+	integer codes are kept from each chunk, so that memory grows with the number of votes
+	and not with the size of the text. An assignment that is in several files, e.g. in two
+	downloads of a running batch, is only read the first time (by AssignmentId)
+	"""
+	if isinstance(csv_paths, str):
+		csv_paths = [csv_paths]
+	usecols = ["WorkerId"] + [c for pair in IMG_COLS for c in pair] + ANSWER_COLS
+
+	url_index, worker_index = {}, {}
+	def encode(values, index):
+		codes, uniques = pd.factorize(values)
+		mapping = np.array([index.setdefault(u, len(index)) for u in uniques], dtype=np.int64)
+		return mapping[codes]
+
+	workers, urls1, urls2, answers, times = [], [], [], [], []
+	seen = set()
+	for path in csv_paths:
+		header = pd.read_csv(path, nrows=0).columns
+		time_cols = [c for c in TIME_COLS if c in header]
+		id_cols = ["AssignmentId"] if "AssignmentId" in header else []
+		for chunk in pd.read_csv(path, usecols=usecols + time_cols + id_cols, dtype=str, chunksize=chunksize):
+			if id_cols:
+				ids = chunk["AssignmentId"]
+				chunk = chunk[~(ids.duplicated() | ids.isin(seen)).values]
+				seen.update(chunk["AssignmentId"])
+			n = len(chunk)
+			workers.append(np.repeat(encode(chunk["WorkerId"].values, worker_index), 10))
+			# (row, pair) flattened row by row:
+			urls = encode(chunk[[c for pair in IMG_COLS for c in pair]].values.ravel(), url_index)
+			urls = urls.reshape(n * 10, 2)
+			urls1.append(urls[:, 0])
+			urls2.append(urls[:, 1])
+			answers.append(chunk[ANSWER_COLS].values.astype(np.int64).ravel() + 1)
+			times.append(WorkTime(chunk))
+
+	worker = np.concatenate(workers) if workers else np.zeros(0, dtype=np.int64)
+	url1 = np.concatenate(urls1) if urls1 else np.zeros(0, dtype=np.int64)
+	url2 = np.concatenate(urls2) if urls2 else np.zeros(0, dtype=np.int64)
+	vote = np.concatenate(answers) if answers else np.zeros(0, dtype=np.int64)
+	work_time = np.concatenate(times) if times else np.zeros(0)
+
+	# a pair is the (image 1, image 2) tuple, in the order of the file:
+	pair, pair_keys = pd.factorize(url1 * max(len(url_index), 1) + url2)
+	pair_urls = np.stack([pair_keys // max(len(url_index), 1), pair_keys % max(len(url_index), 1)], axis=1)
+
+	return Votes(
+		worker,
+		pair,
+		vote,
+		np.array(sorted(worker_index, key=worker_index.get), dtype=object),
+		np.array(sorted(url_index, key=url_index.get), dtype=object),
+		pair_urls,
+		work_time,
+	)
 
 
 def GetWorkersVotesAndMostVoted(csv_path):
 	"""
-	Given an csv path, this function loads a dictonary with the most frequent vote per pair of images
-	and another one mapping a workerid to a worker object. The worker object also contains a dictonary
-	that maps a pair of images to the worker vote
+	Given one or more csv paths, this function loads the votes and returns them together with
+	the most frequent vote per pair of images, as an array by pair code holding the index in VOTES
+	of the most frequent vote, or -1 if no vote is more frequent than all others
 	"""
-	header = {}
-
-	with open(csv_path, 'r') as f:
-		reader = csv.reader(f, delimiter = ',', quotechar = '"')
-		header_input = next(reader)
-		votes = {}
-		votes_count = {}
-		workers = {}
-		for k, v in enumerate(header_input):
-			header[v] = k
-		for row in reader:
-
-			worker_id = row[header["WorkerId"]]
-
-			for i in range(10):
-				img_1 = row[header["Input.image_" + str(i) + "-1"]]
-				img_2 = row[header["Input.image_" + str(i) + "-2"]]
-				vote = int(row[header["Answer.choice" + str(i)]])
-				#print(img_1, " ", img_2, " ", vote)
-				if (img_1, img_2) not in votes:
-					votes[(img_1, img_2)] = [vote]
-				else:
-					votes[(img_1, img_2)].append(vote)
-
-				if worker_id not in workers:
-					workers[worker_id] = Worker(worker_id)
-
-				workers[worker_id].add_vote((img_1, img_2), vote)
+	votes = csv_path if isinstance(csv_path, Votes) else ReadVotes(csv_path)
+	return votes, MostVoted(votes)
 
 
-		for key, value in votes.items():
-			#print(key)
-			try:
-				votes_count[key] = statistics.mode(value)
-			except Exception:
-				continue
+def MostVoted(votes):
+	"""Returns the most frequent vote per pair, -1 if there are more than one"""
+	return worker_quality.Mode(votes.pair, votes.vote, votes.n_pairs)
 
-	return votes_count, workers
 
+def LastVotes(votes):
+	"""Returns the positions of the last vote of each worker on each pair"""
+	return worker_quality.LastVotes(votes.worker, votes.pair, votes.n_pairs)
 
 
-def GetWorkersDivergencyPercentage(votes, workers):
+def GetWorkersDivergencyPercentage(votes, most_voted):
 	"""
-	Given a dictonary "votes" mapping a pair of images (tuple) to the mode of the votes,
-	and a dictonary mapping workers ids to worker objects,
-	this function returns a dictonary mapping a worker id to the percentage of times he 
-	diverges from the most frequent vote
+	Given the votes, and the most frequent vote by pair, this function returns a Series mapping
+	a worker id to the percentage of times he diverges from the most frequent vote. A worker who
+	voted twice on a pair counts with the last vote, and pairs without a single most frequent vote
+	are never divergent
 	"""
+	return pd.Series(
+		worker_quality.DivergenceCodes(votes.worker, votes.pair, votes.vote, votes.n_workers, most_voted),
+		index = votes.workers,
+	)
 
-	result = {}
 
-	for worker_id, worker in workers.items():
-		total_votes = len(worker.votes)
-		divergent_votes = 0
-		for pair, vote in worker.votes.items():
-			if pair not in votes:
-				continue
-			most_voted = votes[pair]
-			if vote != most_voted:
-				divergent_votes += 1
-		result[worker_id] = float(divergent_votes/total_votes)
-	return result
+def outPutWorkerDivergency(workers_div):
+	"""Prints out the results from the worker divergence series """
+	for worker_id, div in workers_div.sort_values(kind="mergesort").items():
+		print(worker_id, ",", div)
 
 
-def outPutWorkerDivergency(workers_div):
-	"""Prints out the results from the worker divergence dict """
-	for tup in sorted(workers_div.items(), key=lambda x: x[1]):
-		print(tup[0], ",", tup[1])
-
-def inspectWorkersVotes(worker_id, workers):
-	""" display the images and vote for each pair for a given worker """
-	worker = workers[worker_id]
-	for pair in worker.votes:
-		worker.inspectVote(pair)
+def inspectVote(img_tuple, vote, images=None, cache=None):
+	"""
+	Shows both images of a pair side by side in one window, with the vote. The images are taken
+	from `images` if given, else from the cache
+	"""
+	print(img_tuple)
+	try:
+		if isinstance(images, Exception):
+			raise images
+		if images is None:
+			cache = cache or ImageCache()
+			images = tuple(cache.get(url) for url in img_tuple)
+		SideBySide(images[0], images[1], caption = "vote: %s" % vote).show()
+		print(vote)
+	except Exception as e:
+		print ("could not load link")
+		print(e)
+
+
+def inspectWorkersVotes(worker_id, votes, cache=None, ahead=8):
+	"""
+	display the images and vote for each pair for a given worker. The images of the next `ahead`
+	pairs are downloaded in the background
+	"""
+	worker = np.flatnonzero(votes.workers == worker_id)
+	if not len(worker):
+		raise KeyError(worker_id)
+	last = LastVotes(votes)
+	last = last[votes.worker[last] == worker[0]]
+	pairs = [votes.pairUrls(pair) for pair in votes.pair[last]]
+	prefetcher = Prefetcher(cache or ImageCache(), pairs, ahead = ahead)
+	for (img_tuple, images), vote in zip(prefetcher, votes.vote[last]):
+		inspectVote(img_tuple, VOTES[vote], images)
 		input("next pair")
 
 
-def main(csv_path, worker_id):
-	pairs_most_votes, workers = GetWorkersVotesAndMostVoted(csv_path)
+def main(csv_path, worker_id, cache_dir=CACHE_DIR, prefetch=8):
+	votes, pairs_most_votes = GetWorkersVotesAndMostVoted(csv_path)
 	if worker_id is None:
-		workers_divergency = GetWorkersDivergencyPercentage(pairs_most_votes, workers)
+		workers_divergency = GetWorkersDivergencyPercentage(votes, pairs_most_votes)
 		outPutWorkerDivergency(workers_divergency)
 	else:
-		inspectWorkersVotes(worker_id, workers)
+		inspectWorkersVotes(worker_id, votes, ImageCache(cache_dir), prefetch)
 
 
 
@@ -152,14 +230,28 @@ if __name__ == '__main__':
 	parser.add_argument(
 		'--csv_path',
 	    metavar='path',
-	    help='Path to the csv file',
-	    default = PATH_TO_FILE
+	    nargs='+',
+	    help='Path to the csv file, or several batch files analysed together',
+	    default = [PATH_TO_FILE]
 	)
 	parser.add_argument(
 		'--worker_id',
-	    metavar='path',
-	    help='Path to the csv file',
+	    metavar='id',
+	    help='The id of a worker whose votes are inspected',
 	    type = str
 	)
+	parser.add_argument(
+		'--cache_dir',
+	    metavar='path',
+	    help='The folder where the images are cached when inspecting votes',
+	    default = CACHE_DIR
+	)
+	parser.add_argument(
+		'--prefetch',
+	    metavar='K',
+	    help='The number of pairs downloaded ahead when inspecting votes',
+	    type = int,
+	    default = 8
+	)
 	args = parser.parse_args()
-	main(args.csv_path, args.worker_id)
+	main(args.csv_path, args.worker_id, args.cache_dir, args.prefetch)
@@ -0,0 +1,125 @@
+from PIL import Image, ImageDraw
+import requests
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import threading
+
+CACHE_DIR = "image_cache"
+
+"""
+A local cache for the images of the batch files, so that inspecting the votes of a worker does not
+download the same image again and again, and a prefetcher that downloads the next pairs in the
+background while the current pair is being looked at.
+
+The images are stored by the sha1 of their content, in CACHE_DIR/ab/abcdef... , and the file
+CACHE_DIR/urls.tsv maps each url to the sha1 of its image, so an image shared by several urls is
+stored once.
+"""
+
+
+class ImageCache:
+	"""A content-addressed cache of images, safe to use from several threads"""
+
+	def __init__(self, folder=CACHE_DIR, timeout=10):
+		self.folder = folder
+		self.timeout = timeout
+		self.index_path = os.path.join(folder, "urls.tsv")
+		self.urls = {}
+		self.lock = threading.Lock()
+		self.session = requests.Session()
+		os.makedirs(folder, exist_ok=True)
+		if os.path.exists(self.index_path):
+			with open(self.index_path) as f:
+				for line in f:
+					digest, _, url = line.rstrip("\n").partition("\t")
+					if url and os.path.exists(self.path(digest)):
+						self.urls[url] = digest
+
+	def path(self, digest):
+		return os.path.join(self.folder, digest[:2], digest)
+
+	def fetch(self, url):
+		"""Returns the bytes of the image at url, from the cache or else downloaded and stored"""
+		digest = self.urls.get(url)
+		if digest is not None:
+			with open(self.path(digest), "rb") as f:
+				return f.read()
+
+		response = self.session.get(url, timeout = self.timeout)
+		response.raise_for_status()
+		content = response.content
+		digest = hashlib.sha1(content).hexdigest()
+		path = self.path(digest)
+		if not os.path.exists(path):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			tmp = "%s.%s.tmp" % (path, threading.get_ident())
+			with open(tmp, "wb") as f:
+				f.write(content)
+			os.replace(tmp, path)
+		with self.lock:
+			if url not in self.urls:
+				self.urls[url] = digest
+				with open(self.index_path, "a") as f:
+					f.write("%s\t%s\n" % (digest, url))
+		return content
+
+	def get(self, url):
+		"""Returns the image at url as a PIL image"""
+		img = Image.open(BytesIO(self.fetch(url)))
+		img.load()
+		return img
+
+
+class Prefetcher:
+	"""
+	Iterates over pairs of urls, yielding for each pair the two images, or the exception raised
+	while getting them. The images of the next `ahead` pairs are downloaded by `threads` threads
+	while the current one is being handled
+	"""
+
+	def __init__(self, cache, pairs, ahead=8, threads=4):
+		self.cache = cache
+		self.pairs = pairs
+		self.ahead = max(ahead, 1)
+		self.threads = threads
+
+	def _get(self, pair):
+		return tuple(self.cache.get(url) for url in pair)
+
+	def __iter__(self):
+		pairs = iter(self.pairs)
+		with ThreadPoolExecutor(max_workers = self.threads) as executor:
+			pending = deque()
+			def submit():
+				for pair in pairs:
+					pending.append((pair, executor.submit(self._get, pair)))
+					return
+			for _ in range(self.ahead):
+				submit()
+			while pending:
+				pair, future = pending.popleft()
+				submit()
+				try:
+					yield pair, future.result()
+				except Exception as e:
+					yield pair, e
+
+
+def SideBySide(img1, img2, caption=None, height=400, margin=10):
+	"""Returns one image with img1 and img2 side by side, scaled to the same height, and an optional caption below"""
+	imgs = [img.convert("RGB") for img in (img1, img2)]
+	imgs = [img.resize((max(int(img.width * height / img.height), 1), height)) for img in imgs]
+	caption_height = 30 if caption else 0
+	out = Image.new(
+		"RGB",
+		(imgs[0].width + imgs[1].width + 3 * margin, height + 2 * margin + caption_height),
+		"white",
+	)
+	out.paste(imgs[0], (margin, margin))
+	out.paste(imgs[1], (imgs[0].width + 2 * margin, margin))
+	if caption:
+		ImageDraw.Draw(out).text((margin, height + 2 * margin), caption, fill="black")
+	return out
@@ -0,0 +1,183 @@
+import argparse
+import numpy as np
+import pandas as pd
+from annomaly_detection import ReadVotes, MostVoted, GetWorkersDivergencyPercentage, PATH_TO_FILE
+
+"""
+This script looks for spamming workers in one or more batch files, with three measures next to the
+divergency of annomaly_detection.py:
+
+	seconds_per_pair    the median over the assignments of a worker of WorkTimeInSeconds / 10,
+	                    nobody looks at two images and compares them in a second
+	entropy             the entropy of the answers of a worker (first image, same, second image),
+	                    scaled to [0, 1], a worker who always gives the same answer has 0
+	straight_lining     the share of the assignments of a worker where all 10 answers are the same
+
+All of them are computed per worker with np.bincount over the integer columns of ReadVotes, for all
+batch files at once. The workers breaking any of the thresholds are flagged, and the list of flagged
+workers can be given to `mturk_score_driver.py --exclude-workers` to leave their votes out of the
+scores.
+"""
+
+MIN_SECONDS_PER_PAIR = 2.0
+MIN_ENTROPY = 0.3
+MAX_STRAIGHT_LINING = 0.5
+DIVERGENCE_MADS = 3.0
+MIN_VOTES = 20
+
+MEASURES = ["seconds_per_pair", "entropy", "straight_lining", "divergence"]
+
+
+def GroupMedian(codes, values, n_groups):
+	"""Returns the median of the values of each group, NaN values left out, NaN for empty groups"""
+	ok = ~np.isnan(values)
+	codes, values = codes[ok], values[ok]
+	order = np.lexsort((values, codes))
+	values = values[order]
+	counts = np.bincount(codes, minlength=n_groups)
+	starts = np.cumsum(counts) - counts
+	median = np.full(n_groups, np.nan)
+	has = counts > 0
+	low = starts[has] + (counts[has] - 1) // 2
+	high = starts[has] + counts[has] // 2
+	median[has] = (values[low] + values[high]) / 2
+	return median
+
+
+def WorkerMeasures(votes):
+	"""Returns a data frame by worker id with the number of assignments and votes, and the MEASURES"""
+	n_workers = votes.n_workers
+	assignment_worker = votes.assignment_worker
+	n_assignments = np.bincount(assignment_worker, minlength=n_workers)
+
+	answers = np.bincount(votes.worker * 3 + votes.vote, minlength=n_workers * 3).reshape(n_workers, 3)
+	n_votes = answers.sum(axis=1)
+	p = answers / np.maximum(n_votes, 1)[:, None]
+	with np.errstate(divide="ignore", invalid="ignore"):
+		entropy = np.abs(np.nansum(np.where(p > 0, p * np.log(p), 0), axis=1)) / np.log(3)
+
+	rows = votes.vote.reshape(-1, 10)
+	straight = (rows == rows[:, :1]).all(axis=1)
+
+	return pd.DataFrame({
+		"assignments":      n_assignments,
+		"votes":            n_votes,
+		"seconds_per_pair": GroupMedian(assignment_worker, votes.work_time / 10, n_workers),
+		"entropy":          entropy,
+		"straight_lining":  np.bincount(assignment_worker, straight, n_workers) / np.maximum(n_assignments, 1),
+		"divergence":       GetWorkersDivergencyPercentage(votes, MostVoted(votes)).values,
+	}, index = pd.Index(votes.workers, name="worker"), columns = ["assignments", "votes"] + MEASURES)
+
+
+def DivergenceThreshold(divergence, mads=DIVERGENCE_MADS):
+	"""
+	The divergency of honest workers depends on the batch (how hard the pairs are, how many votes
+	each pair has), so the threshold is the median plus `mads` times the scaled median absolute
+	deviation of the divergencies of the batch
+	"""
+	median = np.median(divergence) if len(divergence) else 0.0
+	mad = 1.4826 * np.median(np.abs(divergence - median)) if len(divergence) else 0.0
+	return median + mads * mad
+
+
+def FlagWorkers(measures, min_seconds=MIN_SECONDS_PER_PAIR, min_entropy=MIN_ENTROPY,
+		max_straight=MAX_STRAIGHT_LINING, max_divergence=None, divergence_mads=DIVERGENCE_MADS,
+		min_votes=MIN_VOTES):
+	"""
+	Adds to the measures the columns `reasons`, the thresholds broken by each worker joined by "|",
+	and `flagged`. The entropy and the divergence are only judged for workers with at least
+	`min_votes` votes. Without `max_divergence`, the threshold of the divergence is given by
+	DivergenceThreshold
+	"""
+	enough = measures["votes"].values >= min_votes
+	if max_divergence is None:
+		max_divergence = DivergenceThreshold(measures["divergence"].values[enough], divergence_mads)
+	rules = [
+		("fast", measures["seconds_per_pair"].values < min_seconds),
+		("entropy", enough & (measures["entropy"].values < min_entropy)),
+		("straight", measures["straight_lining"].values > max_straight),
+		("divergent", enough & (measures["divergence"].values > max_divergence)),
+	]
+	broken = np.array([hit for _, hit in rules])
+	names = np.array([name for name, _ in rules], dtype=object)
+	measures = measures.copy()
+	measures["reasons"] = ["|".join(names[b]) for b in broken.T]
+	measures["flagged"] = broken.any(axis=0)
+	return measures
+
+
+def CompareToDivergence(measures):
+	"""
+	Returns a data frame by measure with its Spearman correlation with the divergence, and how
+	many of the workers breaking its threshold are also flagged as divergent
+	"""
+	reasons = measures["reasons"].str.split("|")
+	divergent = reasons.map(lambda r: "divergent" in r)
+	rows = []
+	for measure, reason in zip(MEASURES[:-1], ["fast", "entropy", "straight"]):
+		hit = reasons.map(lambda r: reason in r)
+		rows.append((
+			measure,
+			measures[measure].corr(measures["divergence"], method="spearman"),
+			int(hit.sum()),
+			int((hit & divergent).sum()),
+		))
+	return pd.DataFrame(rows, columns=["measure", "spearman", "flagged", "also_divergent"]).set_index("measure")
+
+
+def main(csv_path, report=None, flagged_out=None, **thresholds):
+	votes = ReadVotes(csv_path)
+	measures = FlagWorkers(WorkerMeasures(votes), **thresholds)
+	flagged = measures[measures["flagged"]].sort_values("divergence", ascending=False, kind="mergesort")
+
+	print("%s votes of %s workers, %s flagged" % (len(votes.vote), votes.n_workers, len(flagged)))
+	print(CompareToDivergence(measures).to_string())
+	print()
+	print(flagged.to_string())
+
+	if report:
+		measures.to_csv(report)
+	if flagged_out:
+		with open(flagged_out, "w") as f:
+			f.writelines("%s\n" % worker for worker in flagged.index)
+
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		prog='Spam detection script',
+	    description='This script computes per worker the median time per pair, the entropy of the\
+	    answers, the share of straight-lined assignments and the divergency, and flags the\
+	    workers that are likely spamming'
+	)
+	parser.add_argument(
+		'--csv_path',
+	    metavar='path',
+	    nargs='+',
+	    help='Path to the csv file, or several batch files analysed together',
+	    default = [PATH_TO_FILE]
+	)
+	parser.add_argument(
+		'--report',
+	    metavar='path',
+	    help='A csv file for the measures of all workers'
+	)
+	parser.add_argument(
+		'--flagged_out',
+	    metavar='path',
+	    help='A file for the ids of the flagged workers, one per line, for mturk_score_driver.py --exclude-workers'
+	)
+	parser.add_argument('--min_seconds', type=float, default=MIN_SECONDS_PER_PAIR,
+	    help='Flags workers with a median time per pair below this')
+	parser.add_argument('--min_entropy', type=float, default=MIN_ENTROPY,
+	    help='Flags workers whose answers have an entropy (in [0, 1]) below this')
+	parser.add_argument('--max_straight', type=float, default=MAX_STRAIGHT_LINING,
+	    help='Flags workers with a larger share of assignments with the same answer for all pairs')
+	parser.add_argument('--max_divergence', type=float,
+	    help='Flags workers with a larger divergency, by default the median plus --divergence_mads\
+	    scaled median absolute deviations of the divergencies of the batch')
+	parser.add_argument('--divergence_mads', type=float, default=DIVERGENCE_MADS,
+	    help='See --max_divergence')
+	parser.add_argument('--min_votes', type=int, default=MIN_VOTES,
+	    help='The entropy and divergency are only judged for workers with at least this many votes')
+	main(**vars(parser.parse_args()))
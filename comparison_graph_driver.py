@@ -0,0 +1,91 @@
+import argparse
+import json
+from protestDB import cursor
+from analysis.lib import comparison_graph as cg
+
+
+def main(source=None, min_degree=3, scores_out=None, images_out=None,
+         processes=None, normalize="center", as_json=False):
+    pc = cursor.ProtestCursor()
+    comparisons = cg.LoadComparisons(pc, source)
+    print("Loaded %s comparisons" % len(comparisons))
+    if not len(comparisons):
+        return
+
+    summary, per_image = cg.GraphReport(comparisons, min_degree=min_degree)
+    if as_json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print("images:            %s" % summary["images"])
+        print("pairs:             %s" % summary["pairs"])
+        print("components:        %s" % summary["components"])
+        print("largest component: %s" % summary["largest_component"])
+        print("component sizes:   %s" % ", ".join(
+            "%s x %s" % (v, k) for k, v in sorted(summary["component_sizes"].items())))
+        print("mean degree:       %.2f" % summary["degree_mean"])
+        print("degree:            %s" % ", ".join(
+            "%s: %s" % (k, v) for k, v in sorted(summary["degree"].items())))
+        print("never won:         %s" % summary["never_won"])
+        print("never lost:        %s" % summary["never_lost"])
+        print("weak images:       %s (degree < %s or outside the largest strongly connected part)" % (
+            summary["weak_images"], min_degree))
+    if images_out:
+        per_image.to_csv(images_out, index=False)
+
+    if scores_out:
+        scores = cg.ScoreComponents(comparisons, processes=processes, normalize=normalize)
+        scores.to_csv(scores_out, index=False)
+        print("Wrote the scores of %s images to %s" % (scores["score"].notnull().sum(), scores_out))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog = "Comparison graph driver",
+        description = "This program reports the structure of the graph of comparisons in the db,\
+        and optionally scores each of its connected components independently"
+    )
+    parser.add_argument(
+        "--source",
+        help = "only use the comparisons of this source, e.g. 'UCLA_original'",
+    )
+    parser.add_argument(
+        "--min-degree",
+        type = int,
+        default = 3,
+        help = "images compared with fewer other images are reported as weak",
+    )
+    parser.add_argument(
+        "--images-out",
+        help = "a csv file where the per image statistics are written",
+    )
+    parser.add_argument(
+        "--scores-out",
+        help = "a csv file where the scores of every component are written",
+    )
+    parser.add_argument(
+        "--processes",
+        type = int,
+        help = "the number of processes scoring components, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--normalize",
+        choices = ["center", "zscore", "minmax"],
+        default = "center",
+        help = "how the scores are normalized within each component",
+    )
+    parser.add_argument(
+        "--json",
+        action = "store_true",
+        help = "print the report as json",
+    )
+
+    args = parser.parse_args()
+    main(
+        source     = args.source,
+        min_degree = args.min_degree,
+        scores_out = args.scores_out,
+        images_out = args.images_out,
+        processes  = args.processes,
+        normalize  = args.normalize,
+        as_json    = args.json,
+    )
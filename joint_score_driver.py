@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+" This script scores the comparisons of all sources in the database in one
+" model, so that the UCLA images and the Luca Rossi images end up on the same
+" scale, linked by the comparisons across the two sets of images
+" (see `amazon_input_sample_driver.py`).
+"
+" Each source gets its own tie parameter, estimated from the data unless set
+" with `--theta`, and optionally a weight with `--weight`, e.g. to make a
+" noisy source count less. See `analysis/lib/joint_scores.py`.
+"
+" **Usage:**
+"
+" ```
+"   ./joint_score_driver.py -o joint_scores.csv
+"   ./joint_score_driver.py --weight "UCLA_original=0.5" --insert-labels
+" ```
+"""
+
+import argparse
+
+from protestDB import cursor
+from analysis.lib import comparison_graph, joint_scores
+
+LABEL_SOURCE = "joint"
+
+
+def parse_source_values(items):
+    """ Parses ["source=value", ...] into a dict """
+    values = {}
+    for item in items or []:
+        source, _, value = item.rpartition("=")
+        if not source:
+            raise ValueError("Expected source=value, got: %s" % item)
+        values[source] = float(value)
+    return values
+
+
+def main(**kwargs):
+    pc = cursor.ProtestCursor()
+    comparisons = comparison_graph.LoadComparisons(pc)
+    if kwargs['sources']:
+        comparisons = comparisons[comparisons['source'].isin(kwargs['sources'])]
+    print("Loaded %s comparisons" % len(comparisons))
+    if not len(comparisons):
+        return
+    for source, n in comparisons['source'].value_counts().items():
+        print("\t%-40s %s" % (source, n))
+
+    scores, theta = joint_scores.JointScores(
+        comparisons,
+        theta  = parse_source_values(kwargs['theta']),
+        weight = parse_source_values(kwargs['weight']),
+    )
+    print("Tie parameters:")
+    for source, value in sorted(theta.items()):
+        print("\t%-40s %.3f" % (source, value))
+
+    n_components = scores['component'].nunique()
+    if n_components > 1:
+        print("WARNING: the comparisons form %s separate components, the scores "
+              "are only comparable within a component" % n_components)
+
+    v = scores['score'].values
+    scores['violence'] = (v - v.min()) / (v.max() - v.min()) if v.max() > v.min() else 0.0
+
+    if kwargs['output_file']:
+        scores.to_csv(kwargs['output_file'], index=False)
+        print("Wrote %s scores to %s" % (len(scores), kwargs['output_file']))
+
+    if kwargs['insert_labels']:
+        n_labels = pc.writeLabels(kwargs['label_source'], scores['image'], scores['violence'])
+        print("Inserted %s labels of '%s'" % (n_labels, kwargs['label_source']))
+
+
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description= "Scores the comparisons of all sources in the db in one model, "
+                     "on a common scale."
+    )
+    parser.add_argument(
+        "--sources",
+        nargs   = "+",
+        help    = " Only use the comparisons of these sources, by default all are used."
+    )
+    parser.add_argument(
+        "--theta",
+        action  = "append",
+        metavar = "SOURCE=VALUE",
+        help    = " Fixes the tie parameter (>= 1) of a source instead of estimating it, "
+                  " can be repeated."
+    )
+    parser.add_argument(
+        "--weight",
+        action  = "append",
+        metavar = "SOURCE=VALUE",
+        help    = " Multiplies the counts of a source, 1 by default, can be repeated."
+    )
+    parser.add_argument(
+        "-o",
+        "--output-file",
+        metavar = "file",
+        type    = str,
+        help    = " A csv file for the scores, with the image hash, its component, "
+                  " sources, log-strength and min-max scaled violence."
+    )
+    parser.add_argument(
+        "--insert-labels",
+        action  = "store_true",
+        help    = " If set, the scaled scores replace the labels of --label-source."
+    )
+    parser.add_argument(
+        "--label-source",
+        default = LABEL_SOURCE,
+        help    = " The source of the labels, '%s' by default." % LABEL_SOURCE
+    )
+
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+" This script adds the comparisons of all MTurk batch files in a directory
+" to the database, so that an ongoing labelling campaign only needs its
+" result files to be dropped into the directory.
+"
+" Every file is identified by the sha1 of its content in the
+" `IngestedBatches` table, and a file is only ingested once, however often
+" the script runs, in the same transaction as its comparisons. The files are
+" parsed chunk by chunk and the counts of each image pair are added to the
+" comparison of the pair in the database, or inserted as a new comparison.
+"
+" The files directly in the directory get the source `--source`, and the
+" files in a sub directory get the name of the sub directory as source.
+"
+" With `--watch`, the directory is polled every `--interval` seconds. With
+" `--state`, the scores of the persisted score state are updated with each new
+" file (see `mturk_score_driver.py --state`), and with `--insert-labels` they
+" replace the labels of `--label-source` after each round of new files.
+"
+" **Usage:**
+"
+" ```
+"   ./mturk_ingest_driver.py mturk/results/
+"   ./mturk_ingest_driver.py mturk/results/ --watch --state scores.npz --insert-labels
+" ```
+"""
+
+import os
+import time
+import argparse
+import datetime
+import numpy as np
+
+from protestDB import cursor, models
+from analysis.lib import mturk_batch, score_state
+
+SOURCE = "Luca Rossi - ECB, 1000"
+
+
+def get_hash(name):
+    return name.split('.')[0]
+
+def find_batch_files(directory, source, settle=0.0):
+    """ Returns the (path, source) of the csv files in the directory and its
+    sub directories, skipping the files modified less than `settle` seconds
+    ago, which may still be being written """
+    found = []
+    now = time.time()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        rel = os.path.relpath(root, directory)
+        file_source = source if rel == os.curdir else rel.split(os.sep)[0]
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name.lower().endswith(".csv") and now - os.path.getmtime(path) >= settle:
+                found.append((path, file_source))
+    return found
+
+def update_state(state, state_path, comparisons, digest):
+    """ Updates the score state with the comparisons of a file and saves it
+    right away, so that the state holds every file in the ledger """
+    print("\tre-computed scores for %s images" % len(state.update(comparisons, key=digest)))
+    if state_path:
+        state.save(state_path)
+
+def ingest_file(pc, path, source, digest, chunksize=100000, state=None, state_path=None,
+                dry_run=False):
+    """ Adds the comparisons of one batch file and its ledger entry in one
+    transaction, then updates and saves the score state. Returns the
+    comparisons """
+    comparisons, n_assignments = mturk_batch.AggregateBatchFile(
+        path, base=mturk_batch.BASE_URL, chunksize=chunksize
+    )
+    updated, inserted, skipped = pc.upsertComparisons(
+        source,
+        [get_hash(name) for name in comparisons["image1"]],
+        [get_hash(name) for name in comparisons["image2"]],
+        comparisons["win1"].values,
+        comparisons["win2"].values,
+        comparisons["tie"].values,
+        do_commit = False,
+    )
+    pc.session.add(models.IngestedBatches(
+        fileHASH    = digest,
+        filename    = os.path.basename(path),
+        source      = source,
+        assignments = n_assignments,
+        comparisons = len(comparisons),
+        timestamp   = datetime.datetime.now(),
+    ))
+    if dry_run:
+        pc.session.rollback()
+    else:
+        pc.try_commit()
+    print("%s: %s assignments, %s pairs of '%s' (%s updated, %s new%s)" % (
+        path, n_assignments, len(comparisons), source, updated, inserted,
+        ", %s held by another source and skipped" % skipped if skipped else ""))
+
+    if state is not None and not dry_run:
+        update_state(state, state_path, comparisons, digest)
+    return comparisons
+
+def ingest_directory(pc, directory, source, settle=0.0, state=None, state_path=None,
+                     chunksize=100000, dry_run=False):
+    """ Ingests the batch files of the directory that are not in the ledger.
+    Files in the ledger that the score state does not hold, e.g. when a run
+    stopped between the commit and the save of the state, are added to the
+    state only. Returns the number of files ingested or added """
+    n_files = 0
+    for path, file_source in find_batch_files(directory, source, settle):
+        digest = mturk_batch.FileDigest(path)
+        if pc.instance_exists(models.IngestedBatches, fileHASH=digest):
+            if state is not None and digest not in state.keys and not dry_run:
+                print("%s: in the db but not in the score state, adding it" % path)
+                comparisons, _ = mturk_batch.AggregateBatchFile(
+                    path, base=mturk_batch.BASE_URL, chunksize=chunksize
+                )
+                update_state(state, state_path, comparisons, digest)
+                n_files += 1
+            continue
+        try:
+            ingest_file(pc, path, file_source, digest, chunksize=chunksize, state=state,
+                        state_path=state_path, dry_run=dry_run)
+        except (ValueError, KeyError) as e:
+            # e.g. unknown images or a file that is not a batch file, it is
+            # tried again at the next round:
+            print("Could not ingest %s: %s" % (path, e))
+            continue
+        n_files += 1
+    return n_files
+
+
+def main(**kwargs):
+    pc = cursor.ProtestCursor()
+    state = score_state.ScoreState.Load(kwargs['state']) if kwargs['state'] else None
+
+    try:
+        while True:
+            n_files = ingest_directory(
+                pc,
+                kwargs['directory'],
+                kwargs['source'],
+                settle     = kwargs['settle'] if kwargs['watch'] else 0.0,
+                state      = state,
+                state_path = kwargs['state'],
+                chunksize  = kwargs['chunksize'],
+                dry_run    = kwargs['dry_run'],
+            )
+            if n_files and state is not None and not kwargs['dry_run']:
+                if kwargs['insert_labels']:
+                    scores = state.params
+                    span = scores.max() - scores.min()
+                    n_labels = pc.writeLabels(
+                        kwargs['label_source'],
+                        [get_hash(name) for name in state.names],
+                        (scores - scores.min()) / span if span > 0 else np.zeros(len(scores)),
+                    )
+                    print("Inserted %s labels of '%s'" % (n_labels, kwargs['label_source']))
+            if not kwargs['watch']:
+                break
+            time.sleep(kwargs['interval'])
+    except KeyboardInterrupt:
+        print("Stopping...")
+
+
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description= "Adds the comparisons of the new MTurk batch files in a directory "
+                     "to the `comparisons` table in the `protestDB`."
+    )
+    parser.add_argument(
+        "directory",
+        help    = " The directory with the MTurk batch files (*.csv)."
+    )
+    parser.add_argument(
+        "--source",
+        default = SOURCE,
+        help    = " The source of the comparisons of the files directly in the directory, "
+                  " '%s' by default. Files in sub directories get the name of the sub "
+                  " directory as source." % SOURCE
+    )
+    parser.add_argument(
+        "--watch",
+        action  = "store_true",
+        help    = " Keep polling the directory for new files."
+    )
+    parser.add_argument(
+        "--interval",
+        type    = float,
+        default = 60.0,
+        help    = " With --watch, seconds between polls of the directory."
+    )
+    parser.add_argument(
+        "--settle",
+        type    = float,
+        default = 10.0,
+        help    = " With --watch, files modified less than this many seconds ago are "
+                  " left for the next poll, as they may still be being written."
+    )
+    parser.add_argument(
+        "--chunksize",
+        type    = int,
+        default = 100000,
+        help    = " The number of assignments parsed at a time."
+    )
+    parser.add_argument(
+        "--state",
+        metavar = "file",
+        type    = str,
+        help    = " A .npz file with the persisted score state, updated with each new "
+                  " file, see `mturk_score_driver.py --state`."
+    )
+    parser.add_argument(
+        "--insert-labels",
+        action  = "store_true",
+        help    = " With --state, the min-max scaled scores replace the labels of "
+                  " --label-source whenever new files were ingested."
+    )
+    parser.add_argument(
+        "--label-source",
+        default = SOURCE,
+        help    = " The source of the labels, '%s' by default." % SOURCE
+    )
+    parser.add_argument(
+        "--dry-run",
+        action  = "store_true",
+        help    = " Parse the new files and report what would be added, without "
+                  " writing anything."
+    )
+
+    main(**vars(parser.parse_args()))
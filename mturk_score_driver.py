@@ -94,185 +94,91 @@
 
 import csv
 import argparse
-import choix
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
 
-from protestDB import cursor, models
+from protestDB import cursor
+from analysis.lib import bootstrap, mturk_batch, pairwise_solver, score_state, worker_quality
 pc = cursor.ProtestCursor()
 
-base = "https://s3.eu-central-1.amazonaws.com/ecb-protest/"
+base = mturk_batch.BASE_URL
 def get_name(url, _base=None):
     return url.replace(_base or base, '')
 
 def get_hash(url, _base=None):
     return get_name(url, _base=_base).split('.')[0]
 
+def read_worker_ids(path):
+    """ Reads worker ids, one per line, as written by
+    `annomaly_detection/spam_detection.py --flagged_out` """
+    with open(path) as f:
+        return set(line.strip() for line in f if line.strip() and not line.startswith('#'))
+
 def as_dsv(row):
     cols = "{:<8} {:<25} {:<25} {:5} {:5} {:5}"
     return cols.format(*row)
 
-class image:
-    """ Just a placeholder class
-        that can hold a name and an index
-        and is hashable, comparable etc
-    """
-    def __init__(self, name, index):
-        self.name  = name
-        self.index = index
-
-    def __hash__(self):
-        return self.name.__hash__()
-
-    def __eq__(self, other):
-        if type(other) == str:
-            return other == self.name
-        return other.name == self.name
-
 
 def main(input_file, **kwargs):
     """
     The `main` def for the driver file.
     """
 
-    # The keys will be unique per image pair comparison,
-    # the values will be a list of 3 entries with the format:
-    # [win1, win2, tie]
-    pair_dict = {}
-    header = {}
     data = []
     UCLA_header      = ["row", "image1", "image2", "win1", "win2", "tie"]
-    ucla_header_dict = { v: k for k, v in enumerate(UCLA_header) }
-    tuples           = []    # a list of tuples used for choix score computation
-    n_items          = set() # used to count number of unique items
-    unique_images    = []    # in-order placement of image names matching the choix output
-
-    def rowToDict(row, header=None):
-        header   = header or ucla_header_dict
-        row_dict = {}
-        for k, v in header.items():
-            row_dict[k] = row[v]
-        return row_dict
-
-
-
-    with open(input_file, 'r') as f:
-        reader = csv.reader(f, delimiter=',', quotechar='"')
-
-        # Parse the header row in to a dict
-        # so that each key is a column name, and the value
-        # is the row index
-        header = { v: k for k, v in enumerate(next(reader)) }
-
-        # The image column names follows the same (weird) structure
-        # so we can just generate the names of all of them:
-        img_cols = [
-            "Input.image_%s-%s" % (j, i) for j in range(10) for i in range(1, 3)
-        ]
-
-        for row in reader:
-            # Get the values from the image columns,
-            # and parse get the image names from the url:
-            images = list(map(
-                lambda x: get_name(row[header.get(x)]),
-                img_cols
-            ))
-
-            # get: Answer.choice[0-9]
-            # for every image pair
-            for pair in range(0, len(img_cols), 2):
-
-                answer = row[header.get("Answer.choice%s" % int(pair/2))]
-                vote = [ 1 if i-1 == int(answer) else 0 for i in range(3) ]
-
-                # The image pair sits adjacent in the row of HITs:
-                img_a, img_b = images[pair:pair+2]
-
-                # Count the items:
-                if not img_a in n_items:
-                    #n_items[img_a] = "ost"
-                    n_items.update([
-                        image(name=img_a, index=len(unique_images))
-                    ])
-                    unique_images.append(img_a)
-                if not img_b in n_items:
-                    n_items.update([
-                        image(name=img_b, index=len(unique_images))
-                    ])
-                    unique_images.append(img_b)
-
-                # Compute key, uniquely for this pair of images:
-                pair_key = ";".join(sorted([img_a, img_b]))
-
-                # Sum up current score:
-                pair_dict[pair_key] = [ x + vote[i] for i, x in enumerate(
-                    pair_dict.get(pair_key, [0, 0, 0]))
-                ]
 
+    # One row per unique image pair with the summed up [win1, win2, tie],
+    # and the in-order image names matching the score output:
+    batch = mturk_batch.ReadBatch(input_file, columns=["WorkerId"])
+    if kwargs['exclude_workers']:
+        excluded = batch["WorkerId"].isin(read_worker_ids(kwargs['exclude_workers']))
+        print("Excluding %s assignments of %s workers" % (
+            excluded.sum(), batch.loc[excluded, "WorkerId"].nunique()))
+        batch = batch[~excluded.values].reset_index(drop=True)
+    votes, unique_images = mturk_batch.MeltVotes(batch, base=base, columns=["WorkerId"])
+    comparisons = mturk_batch.AggregateVotes(votes, unique_images)
+    n_items = len(unique_images)
+
+    # The comparisons stored are the plain counts, the scores may be computed
+    # from the counts weighted by the reliability of the workers:
+    weights = None
+    scored = comparisons
+    if kwargs['worker_weights']:
+        reliability = worker_quality.WorkerReliability(votes, kwargs['worker_weights'])
+        print("Worker reliability (%s), least reliable workers:" % kwargs['worker_weights'])
+        print(reliability.sort_values().head(10).to_string())
+        weights = worker_quality.VoteWeights(votes, reliability)
+        scored = mturk_batch.AggregateVotes(votes, unique_images, weights=weights)
+
+    if kwargs['dry_run']:
+        print(as_dsv(UCLA_header))
+
+    rows = zip(
+        comparisons["image1"],
+        comparisons["image2"],
+        comparisons["win1"].tolist(),
+        comparisons["win2"].tolist(),
+        comparisons["tie"].tolist(),
+    )
+    for c, (img_a, img_b, win1, win2, tie) in enumerate(rows, 1):
+        row = [c, img_a, img_b, win1, win2, tie]
+        data.append(row)
 
         if kwargs['dry_run']:
-            print(as_dsv(UCLA_header))
-
-
-        c = 0
-        indices = { i.name: i.index for i in n_items }
-
-        #Check indices:
-        for i in n_items:
-            assert i.name == unique_images[i.index], "Enough of your mumbo jumbo!"
-
-        assert len(indices.items()) == len(n_items), "You fucked it up, cowboy!"
-
-        for k, v in pair_dict.items():
-            c += 1
-            row = [
-                c,               # Row number
-                k.split(";")[0], # image 1
-                k.split(";")[1], # image 2
-                v[0],            # win1
-                v[2],            # win2
-                v[1],            # tie
-            ]
-            data.append(row)
-            row_dict = rowToDict(row, ucla_header_dict)
-
-            # Add to list of tuples:
-            img_a   = row_dict.get("image1")
-            img_b   = row_dict.get("image2")
-            index_a = indices[img_a]
-            index_b = indices[img_b]
-
+            print(as_dsv(row))
 
-            ### Insert number of wins and ties for the pair:
-            for win1 in range(row_dict.get("win1")):
-                tuples.append((index_a, index_b))
-                tuples.append((index_a, index_b))
+        if not kwargs['no_db'] and not kwargs['dry_run']:
 
-            for win2 in range(row_dict.get("win2")):
-                tuples.append((index_b, index_a))
-                tuples.append((index_b, index_a))
-
-            for tie in range(row_dict.get("tie")):
-                tuples.append((index_a, index_b))
-                tuples.append((index_b, index_a))
-
-
-            if kwargs['dry_run']:
-                print(as_dsv(row))
-
-
-            if not kwargs['no_db'] and not kwargs['dry_run']:
-
-                comparison = pc.insertComparison(
-                    imageID_1   = get_hash(row_dict.get("image1"), ""),
-                    imageID_2   = get_hash(row_dict.get("image2"), ""),
-                    win1        = row_dict.get("win1"),
-                    win2        = row_dict.get("win2"),
-                    tie         = row_dict.get("tie"),
-                    source      = "Luca Rossi - ECB, 1000",
-                    do_commit   = False,
-                )
-                print("Inserting:\n\t%s" % comparison)
+            comparison = pc.insertComparison(
+                imageID_1   = get_hash(img_a, ""),
+                imageID_2   = get_hash(img_b, ""),
+                win1        = win1,
+                win2        = win2,
+                tie         = tie,
+                source      = "Luca Rossi - ECB, 1000",
+                do_commit   = False,
+            )
+            print("Inserting:\n\t%s" % comparison)
 
     # commit comparisons:
     if not kwargs['no_db'] and not kwargs['dry_run']:
@@ -286,42 +192,70 @@ def main(input_file, **kwargs):
             writer.writerows(data)
 
     print("_" * 80)
-    print("n_items: %s" % len(n_items))
-    print("Computing choix pairwise scores...")
-    scores          = choix.opt_pairwise(len(n_items), tuples)
-    v               = np.matrix(scores)
+    if kwargs['state']:
+        # Add this batch to the persisted counts, and warm-start from the
+        # previous scores. The scores then cover all images in the state:
+        print("Updating pairwise scores in %s..." % kwargs['state'])
+        state = score_state.ScoreState.Load(kwargs['state'])
+        updated = state.update(scored, key=mturk_batch.FileDigest(input_file))
+        print("re-computed scores for %s images" % len(updated))
+        if not kwargs['dry_run']:
+            state.save(kwargs['state'])
+        unique_images = state.names
+        n_items       = state.n_items
+        scores        = state.params
+    else:
+        print("Computing pairwise scores...")
+        scores          = pairwise_solver.OptChoixPairwise(
+            n_items,
+            scored["index1"].values,
+            scored["index2"].values,
+            scored["win1"].values,
+            scored["win2"].values,
+            scored["tie"].values,
+        )
+    print("n_items: %s" % n_items)
     scaler          = MinMaxScaler()
-    scaled          = scaler.fit_transform(v.T)
+    scaled          = scaler.fit_transform(np.reshape(scores, (-1, 1)))[:, 0]
 
     print(scaled)
 
-    # Pair image names with the violence score for the image:
-    for t in [(unique_images[i], scaled[i][0]) for i in range(len(n_items)) ]:
-        img_hash = get_hash(t[0], '')
-        violence = t[1]
-
-        exists = pc.instance_exists(models.Images, imageHASH=img_hash)
-        if not exists:
-            raise ValueError("Image with hash: %s, does not exists!" % img_hash)
-
-        label = pc.insertLabel(
-            img_hash,
-            violence,
-            source = "Luca Rossi - ECB, 1000",
-            do_commit=False,
-        )
-        if kwargs['dry_run'] or kwargs['no_db'] or not kwargs['insert_labels']:
-            print("Would insert:\n\t%s" % label)
+    ci_low = ci_high = None
+    if kwargs['bootstrap']:
+        # With a state, the votes of the earlier batches are gone and the
+        # image pairs are resampled instead of the assignments:
+        print("Bootstrapping %s replicates..." % kwargs['bootstrap'])
+        if kwargs['state']:
+            samples = bootstrap.BootstrapComparisons(
+                n_items, state.index1, state.index2, state.win1, state.win2, state.tie,
+                B=kwargs['bootstrap'], params=scores, **state.solver_kwargs
+            )
         else:
-            print("Inserting:\n\t%s" % label)
-
-    if kwargs['dry_run'] or kwargs['no_db']:
-        pc.session.rollback()
-    elif kwargs['insert_labels']:
-        pc.try_commit()
+            samples = bootstrap.BootstrapVotes(
+                votes, comparisons, n_items, B=kwargs['bootstrap'], params=scores,
+                weights=weights,
+            )
+        low, high = bootstrap.ConfidenceIntervals(samples)
+        ci_low    = bootstrap.ScaleLike(low, scores)
+        ci_high   = bootstrap.ScaleLike(high, scores)
+
+    # Pair image hashes with the violence score for the image, the labels
+    # replace the previous labels of the source:
+    commit = kwargs['insert_labels'] and not (kwargs['dry_run'] or kwargs['no_db'])
+    n_labels = pc.writeLabels(
+        "Luca Rossi - ECB, 1000",
+        [get_hash(name, '') for name in unique_images],
+        scaled,
+        ci_low    = ci_low,
+        ci_high   = ci_high,
+        do_commit = commit,
+    )
+    if commit:
+        print("Inserted %s labels" % n_labels)
     else:
-        print("\nWill not commit insertion of labels, use '--insert-labels' to commit labels to db")
-        pc.session.rollback()
+        print("Would insert %s labels" % n_labels)
+        if not (kwargs['dry_run'] or kwargs['no_db']):
+            print("\nWill not commit insertion of labels, use '--insert-labels' to commit labels to db")
 
     print("_" * 80)
 
@@ -366,6 +300,39 @@ if __name__ == "__main__":
         help    =  " If set, will not do anything, but will output the potential "
                    " content of a file to stdout.                                "
     )
+    parser.add_argument(
+        "--state",
+        metavar = "file",
+        type    = str,
+        help    = " A .npz file with the persisted score state. If set, the batch is "
+                  " added to the comparison counts of the state (once per batch file) "
+                  " and the scores are updated from the previous ones instead of being "
+                  " computed from scratch. The file is created if it does not exist.   "
+    )
+    parser.add_argument(
+        "--bootstrap",
+        metavar = "B",
+        type    = int,
+        default = 0,
+        help    = " If set, the scores are re-computed on B bootstrap resamples of the "
+                  " assignments (of the image pairs with --state), and the 95%% "
+                  " confidence interval of each label is stored with it.             "
+    )
+    parser.add_argument(
+        "--worker-weights",
+        choices = ["divergence", "dawid-skene"],
+        help    = " If set, each vote counts with the reliability of its worker in the "
+                  " scores: 1 - the divergence of the worker, or the chance corrected "
+                  " accuracy of the worker estimated with Dawid-Skene. The comparisons "
+                  " stored in the db are not weighted."
+    )
+    parser.add_argument(
+        "--exclude-workers",
+        metavar = "file",
+        type    = str,
+        help    = " A file with worker ids, one per line, whose assignments are left "
+                  " out, e.g. the flagged workers of annomaly_detection/spam_detection.py. "
+    )
     parser.add_argument(
         "--insert-labels",
         action  = "store_true",
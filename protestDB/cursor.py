@@ -4,7 +4,7 @@ import sys
 import datetime
 from os.path import basename, splitext, exists as file_exists
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import exc
+from sqlalchemy import exc, text
 from PIL import Image
 import imghdr
 import imagehash
@@ -110,6 +110,23 @@ class ProtestCursor:
         return self.session.query(models.Images).all()
 
 
+    def getImageNames(self, imagehashes, chunk_size=500):
+        """ Returns a dict from the image hashes to the image names,
+            the hashes that are not in the database left out. The
+            hashes are looked up with one `IN` query per `chunk_size`
+            hashes, below the limit of query parameters of sqlite.
+        """
+        imagehashes = list(set(imagehashes))
+        names = {}
+        for start in range(0, len(imagehashes), chunk_size):
+            names.update(self.session.query(
+                models.Images.imageHASH, models.Images.name
+            ).filter(
+                models.Images.imageHASH.in_(imagehashes[start:start + chunk_size])
+            ))
+        return names
+
+
     def getTag(self, tagName):
         """ Returns tag identified by `tagName` or None
         """
@@ -292,19 +309,100 @@ class ProtestCursor:
         source,
         timestamp = None,
         do_commit = True,
+        ci_low    = None,
+        ci_high   = None,
     ):
         """ Inserts a label for an image in the scale [0, 1]
             where 1 indicates the most violent, and 0 no violence.
+            `ci_low` and `ci_high` are the optional bounds of the
+            confidence interval of the label, on the same scale.
         """
         return self.get_or_create(
             models.Labels,
             imageID     = imageId,
             label       = label,
             source      = source,
+            ci_low      = ci_low,
+            ci_high     = ci_high,
             timestamp   = timestamp or datetime.datetime.now(),
             do_commit   = do_commit,
         )
 
+    def writeLabels(
+        self,
+        source,
+        hashes,
+        labels,
+        ci_low    = None,
+        ci_high   = None,
+        timestamp = None,
+        do_commit = True,
+    ):
+        """ Replaces all labels of `source` with the given labels, one per
+            image hash, in a single transaction. `ci_low` and `ci_high` are
+            the optional confidence bounds, see `insertLabel`.
+
+            All hashes are checked against the Images table in one join
+            first, a ValueError listing the unknown hashes is raised if any,
+            and nothing is written. With `do_commit` False, everything is
+            checked and written but then rolled back.
+            Returns the number of labels written.
+        """
+        hashes = [str(h) for h in hashes]
+        labels = [float(l) for l in labels]
+        if len(labels) != len(hashes):
+            raise ValueError("Got %s labels for %s hashes" % (len(labels), len(hashes)))
+        n = len(hashes)
+        ci_low = [None] * n if ci_low is None else [None if c is None else float(c) for c in ci_low]
+        ci_high = [None] * n if ci_high is None else [None if c is None else float(c) for c in ci_high]
+        timestamp = timestamp or datetime.datetime.now()
+
+        conn = self.session.connection()
+        try:
+            conn.execute(text(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS label_hashes (imageHASH VARCHAR(100))"
+            ))
+            conn.execute(text("DELETE FROM label_hashes"))
+            if hashes:
+                conn.execute(
+                    text("INSERT INTO label_hashes (imageHASH) VALUES (:h)"),
+                    [{"h": h} for h in hashes]
+                )
+            missing = [r[0] for r in conn.execute(text(
+                "SELECT t.imageHASH FROM label_hashes t "
+                "LEFT JOIN Images i ON i.imageHASH = t.imageHASH "
+                "WHERE i.imageHASH IS NULL"
+            ))]
+            conn.execute(text("DROP TABLE label_hashes"))
+            if missing:
+                raise ValueError(
+                    "%s images do not exist, e.g. hash: %s" % (len(missing), missing[0])
+                )
+
+            conn.execute(
+                models.Labels.__table__.delete().where(models.Labels.source == source)
+            )
+            if hashes:
+                conn.execute(models.Labels.__table__.insert(), [
+                    {
+                        "imageID":   h,
+                        "label":     l,
+                        "source":    source,
+                        "timestamp": timestamp,
+                        "ci_low":    lo,
+                        "ci_high":   hi,
+                    }
+                    for h, l, lo, hi in zip(hashes, labels, ci_low, ci_high)
+                ])
+        except:
+            self.session.rollback()
+            raise
+        if do_commit:
+            self.try_commit()
+        else:
+            self.session.rollback()
+        return n
+
 
 
     def insertTag(
@@ -399,6 +497,96 @@ class ProtestCursor:
             do_commit = do_commit,
         )
 
+    def upsertComparisons(
+        self,
+        source,
+        imageID_1,
+        imageID_2,
+        win1,
+        win2,
+        tie,
+        timestamp = None,
+        do_commit = True,
+    ):
+        """ Adds the counts of many image pairs to the comparisons of
+            `source` in one statement each: the counts of a pair that is
+            already there are added to it, the other pairs are inserted.
+            The pairs are put in order as in `insertComparison`.
+
+            A pair held by another source is left untouched, as the pairs
+            are unique across sources. Unknown image hashes raise a
+            ValueError and nothing is written, as in `writeLabels`. With
+            `do_commit` False the transaction is left open, e.g. to add
+            more rows that should be committed together with the pairs.
+            Returns the number of (updated, inserted, skipped) pairs.
+        """
+        counts = {}
+        for a, b, w1, w2, t in zip(imageID_1, imageID_2, win1, win2, tie):
+            a, b = str(a), str(b)
+            if a > b:
+                a, b, w1, w2 = b, a, w2, w1
+            c = counts.setdefault((a, b), [0, 0, 0])
+            c[0] += int(w1)
+            c[1] += int(w2)
+            c[2] += int(t)
+        rows = [
+            {"a": a, "b": b, "w1": c[0], "w2": c[1], "t": c[2]}
+            for (a, b), c in counts.items()
+        ]
+        timestamp = timestamp or datetime.datetime.now()
+
+        conn = self.session.connection()
+        try:
+            conn.execute(text(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS upsert_pairs ("
+                "imageID_1 VARCHAR(100), imageID_2 VARCHAR(100), "
+                "win1 INTEGER, win2 INTEGER, tie INTEGER, "
+                "PRIMARY KEY (imageID_1, imageID_2))"
+            ))
+            conn.execute(text("DELETE FROM upsert_pairs"))
+            if rows:
+                conn.execute(text(
+                    "INSERT INTO upsert_pairs (imageID_1, imageID_2, win1, win2, tie) "
+                    "VALUES (:a, :b, :w1, :w2, :t)"
+                ), rows)
+            missing = [r[0] for r in conn.execute(text(
+                "SELECT h FROM ("
+                "SELECT imageID_1 AS h FROM upsert_pairs UNION SELECT imageID_2 FROM upsert_pairs"
+                ") t LEFT JOIN Images i ON i.imageHASH = t.h WHERE i.imageHASH IS NULL"
+            ))]
+            if missing:
+                raise ValueError(
+                    "%s images do not exist, e.g. hash: %s" % (len(missing), missing[0])
+                )
+
+            same_pair = (
+                "u.imageID_1 = Comparisons.imageID_1 AND u.imageID_2 = Comparisons.imageID_2"
+            )
+            skipped = conn.execute(text(
+                "SELECT count(*) FROM upsert_pairs u JOIN Comparisons ON %s "
+                "WHERE Comparisons.source IS NOT :source" % same_pair
+            ), source=source).scalar()
+            updated = conn.execute(text(
+                "UPDATE Comparisons SET "
+                "win1 = win1 + (SELECT u.win1 FROM upsert_pairs u WHERE {0}), "
+                "win2 = win2 + (SELECT u.win2 FROM upsert_pairs u WHERE {0}), "
+                "tie = tie + (SELECT u.tie FROM upsert_pairs u WHERE {0}), "
+                "timestamp = :timestamp "
+                "WHERE source = :source AND EXISTS (SELECT 1 FROM upsert_pairs u WHERE {0})".format(same_pair)
+            ), source=source, timestamp=timestamp).rowcount
+            inserted = conn.execute(text(
+                "INSERT INTO Comparisons (imageID_1, imageID_2, win1, win2, tie, source, timestamp) "
+                "SELECT u.imageID_1, u.imageID_2, u.win1, u.win2, u.tie, :source, :timestamp "
+                "FROM upsert_pairs u WHERE NOT EXISTS (SELECT 1 FROM Comparisons WHERE %s)" % same_pair
+            ), source=source, timestamp=timestamp).rowcount
+            conn.execute(text("DROP TABLE upsert_pairs"))
+        except:
+            self.session.rollback()
+            raise
+        if do_commit:
+            self.try_commit()
+        return updated, inserted, skipped
+
     def remove(
         self,
         obj,
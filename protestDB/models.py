@@ -149,7 +149,30 @@ class Labels(Base):
     source      = Column(String(100))
     timestamp   = Column(DateTime, nullable=False)
     label       = Column(Float, nullable=False)
+    ci_low      = Column(Float)  # bootstrap confidence interval of the label
+    ci_high     = Column(Float)
 
     def __repr__(self):
         return "<Labels labelID=%s, imageID='%s', label='%s'>" % (
                 self.labelID, self.imageID, self.label)
+
+
+class IngestedBatches(Base):
+    """
+    A ledger of the MTurk batch files whose comparisons were added to the
+    Comparisons table, by the sha1 of the file content, so that a file is
+    never counted twice
+    """
+
+    __tablename__ = "IngestedBatches"
+
+    fileHASH    = Column(String(100), primary_key=True)
+    filename    = Column(String(255), nullable=False)
+    source      = Column(String(100), nullable=False)
+    assignments = Column(Integer, nullable=False)
+    comparisons = Column(Integer, nullable=False)
+    timestamp   = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return "<IngestedBatches fileHASH='%s', filename='%s', source='%s'>" % (
+                self.fileHASH, self.filename, self.source)
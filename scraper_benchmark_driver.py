@@ -0,0 +1,215 @@
+"""
+This script benchmarks the throughput of the scraper without network access.
+
+It starts a local stand-in for bing (see `serp_scraper/bench_server.py`) that serves
+synthetic result pages and images with configurable latency, error rate and size,
+runs the `Scraper` against it and reports images/sec, cpu time per image and
+the rate of db inserts. The images are saved to a temporary folder and the db
+insertions goes to a temporary sqlite file, so nothing is left behind.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+from protestDB import models
+from protestDB.engine import Connection
+from serp_scraper import keyword_scraper
+from serp_scraper.bench_server import BenchServer
+from serp_scraper.rate_limiter import RateLimiter, DEFAULT_SETTINGS
+
+
+class DBTimer:
+	""" Wraps the db methods of a cursor in order to time them.
+		Nested calls, e.g. `try_commit` inside of `insertImage`, are
+		only counted once.
+	"""
+
+	def __init__(self, pc, methods=("insertImage", "try_commit")):
+		self.seconds = 0.0
+		self.inserts = 0
+		self.depth = 0
+		for name in methods:
+			setattr(pc, name, self.wrap(getattr(pc, name), name == "insertImage"))
+
+	def wrap(self, method, is_insert):
+		def timed(*args, **kwargs):
+			self.depth += 1
+			start = time.perf_counter()
+			try:
+				return method(*args, **kwargs)
+			finally:
+				self.depth -= 1
+				if self.depth == 0:
+					self.seconds += time.perf_counter() - start
+				if is_insert:
+					self.inserts += 1
+		return timed
+
+
+def limiterSettings(max_rate):
+	""" Returns rate limiter settings where every engine starts at,
+		and is capped by, `max_rate` requests per second
+	"""
+	if max_rate is None:
+		return None
+	return {
+		engine: dict(s, rate=max_rate, max_rate=max_rate, burst=max(1, int(max_rate)))
+		for engine, s in DEFAULT_SETTINGS.items()
+	}
+
+
+def main(**kwargs):
+	workdir = tempfile.mkdtemp(prefix="scraper_benchmark_")
+	folder = os.path.join(workdir, "images")
+
+	# Point the db at a fresh sqlite file before any cursor is created:
+	engine = Connection.setupEngine(os.path.join(workdir, "benchmark.db"))
+	models.Base.metadata.create_all(engine)
+
+	server = BenchServer(
+		page_latency  = kwargs['page_latency'],
+		image_latency = kwargs['image_latency'],
+		error_rate    = kwargs['error_rate'],
+		throttle_rate = kwargs['throttle_rate'],
+		image_size    = kwargs['image_size'],
+	)
+	keywords = ["benchmark keyword %s" % i for i in range(kwargs['keywords'])]
+
+	try:
+		with server:
+			scraper = keyword_scraper.Scraper(
+				keywords,
+				folder,
+				kwargs['n_images'],
+				kwargs['timeout'],
+				kwargs['include_db'],
+				1.0,
+				"local",
+				rate_limiter=RateLimiter(limiterSettings(kwargs['max_rate'])),
+			)
+			scraper.bing_base_url = server.bing_base_url
+			db_timer = DBTimer(scraper.pc)
+
+			start_wall = time.perf_counter()
+			start_cpu = time.process_time()
+			with open(os.devnull, "w") as devnull:
+				with contextlib.redirect_stdout(sys.stdout if kwargs['verbose'] else devnull):
+					scraper.scrape("bing")
+			wall = time.perf_counter() - start_wall
+			cpu = time.process_time() - start_cpu
+
+		n_images = len(os.listdir(folder))
+		report = {
+			"images":          n_images,
+			"wall_sec":        wall,
+			"images_sec":      n_images / wall if wall > 0 else 0.0,
+			"cpu_ms_image":    1000 * cpu / n_images if n_images else None,
+			"db_inserts":      db_timer.inserts,
+			"db_sec":          db_timer.seconds,
+			"db_inserts_sec":  db_timer.inserts / db_timer.seconds if db_timer.seconds else None,
+			"rate_limiter":    {
+				"%s %s" % key: m for key, m in scraper.rate_limiter.metrics().items()
+			},
+		}
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	if kwargs['json']:
+		print(json.dumps(report, indent=2))
+		return report
+
+	print("_" * 80)
+	print("{:<20} {:>10}".format("images", report["images"]))
+	print("{:<20} {:>10.2f}".format("wall seconds", report["wall_sec"]))
+	print("{:<20} {:>10.2f}".format("images/sec", report["images_sec"]))
+	if report["cpu_ms_image"] is not None:
+		print("{:<20} {:>10.2f}".format("cpu ms/image", report["cpu_ms_image"]))
+	if report["db_inserts_sec"] is not None:
+		print("{:<20} {:>10.2f}".format("db inserts/sec", report["db_inserts_sec"]))
+	print("_" * 80)
+	scraper.rate_limiter.printMetrics()
+	return report
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		prog='Scraper benchmark',
+		description='Benchmarks the scraper against a local stand-in search server, no network needed',
+	)
+	parser.add_argument(
+		'--keywords',
+		help='The number of keywords to scrape. Default is 2',
+		default=2,
+		type=int,
+	)
+	parser.add_argument(
+		'--n_images',
+		help='The number of images to scrape per keyword. Default is 100',
+		default=100,
+		type=int,
+	)
+	parser.add_argument(
+		'--page_latency',
+		help='Seconds the server waits before answering a result page. Default is 0.05',
+		default=0.05,
+		type=float,
+	)
+	parser.add_argument(
+		'--image_latency',
+		help='Seconds the server waits before answering an image. Default is 0.02',
+		default=0.02,
+		type=float,
+	)
+	parser.add_argument(
+		'--error_rate',
+		help='Fraction of the requests answered with a 503. Default is 0',
+		default=0.0,
+		type=float,
+	)
+	parser.add_argument(
+		'--throttle_rate',
+		help='Fraction of the requests answered with a 429. Default is 0',
+		default=0.0,
+		type=float,
+	)
+	parser.add_argument(
+		'--image_size',
+		nargs=2,
+		metavar=('width', 'height'),
+		help='The size of the served images. Default is 320 240',
+		default=[320, 240],
+		type=int,
+	)
+	parser.add_argument(
+		'--timeout',
+		help='Timeout in seconds for the image downloads. Default is 10',
+		default=10,
+		type=float,
+	)
+	parser.add_argument(
+		'--max_rate',
+		help='If set, every rate limiter bucket runs at exactly this many requests per second',
+		type=float,
+	)
+	parser.add_argument(
+		'--include_db',
+		help='Insert the images into a temporary db, in order to measure the db insert rate',
+		action='store_true',
+	)
+	parser.add_argument(
+		'--json',
+		help='Output the report as json',
+		action='store_true',
+	)
+	parser.add_argument(
+		'--verbose',
+		help='Do not silence the output of the scraper',
+		action='store_true',
+	)
+
+	main(**vars(parser.parse_args()))
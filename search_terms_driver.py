@@ -8,6 +8,8 @@ The format is: "search_term, search_engine, n_images, label" per line and the he
 import argparse
 import csv
 from serp_scraper import keyword_scraper
+from serp_scraper.rate_limiter import RateLimiter
+from serp_scraper.browser_pool import BrowserPool
 
 def readParameters(filepath):
 	result = []
@@ -76,11 +78,17 @@ def main(filepath):
 	for par in parameters:
 		print (par)
 	if (confirm("This is the input, should we proced?")):
-		for par in parameters:
-			scraper = keyword_scraper.Scraper([par[0]], "images", par[2],\
-				10, 1, par[3], "local")
-			scraper.scrape(par[1])
-			scraper = None
+		rate_limiter = RateLimiter() # shared, so throttling carries over between search terms
+		browser_pool = BrowserPool() # shared, so chrome is only started once
+		try:
+			for par in parameters:
+				scraper = keyword_scraper.Scraper([par[0]], "images", par[2],\
+					10, 1, par[3], "local", rate_limiter=rate_limiter, browser_pool=browser_pool)
+				scraper.scrape(par[1])
+				scraper.close()
+				scraper = None
+		finally:
+			browser_pool.close()
 
 
 if __name__ == '__main__':
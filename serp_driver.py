@@ -69,13 +69,23 @@ def main():
 		choices=[Range(0,1)],
 	)
 
+	parser.add_argument(
+	    '--db_batch_size',
+	    help='The number of images inserted into the db per commit. Defaulted to 50 images',
+	    default='50',
+	    type = int,
+	)
+
 	args = parser.parse_args()
 	#print(args.label)
 	scraper = keyword_scraper.Scraper(args.key_words, args.download_folder, args.n_images,\
-	args.timeout, args.include_db, args.label, args.type)
+	args.timeout, args.include_db, args.label, args.type, db_batch_size=args.db_batch_size)
 	
-	for searchEng in args.sr:
-		scraper.scrape(searchEng)
+	try:
+		for searchEng in args.sr:
+			scraper.scrape(searchEng)
+	finally:
+		scraper.close()
 	
 
 class Range(object):
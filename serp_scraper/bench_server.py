@@ -0,0 +1,150 @@
+""" A local stand-in for the bing image search, used for benchmarking the scraper
+	without network access.
+
+	The server runs in its own process, so that its cpu time does not count
+	towards the cpu time of the scraper. It serves:
+
+		/images/search?q=<query>&first=<n>&count=<m>
+			A result page in the bing format, i.e. `a.iusc` anchors with the
+			`m` attribute holding json where `murl` is the url of the image.
+
+		/image/<query>/<n>.jpg
+			A jpeg of random noise, deterministic given the path, so that
+			every image gets its own dhash.
+
+	Latency, error rate and image size are configurable.
+"""
+import json
+import random
+import multiprocessing
+import time
+from io import BytesIO
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs, quote
+from PIL import Image
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+	""" Handles the requests, the settings are set on the server instance """
+
+	def log_message(self, format, *args):
+		pass
+
+	def do_GET(self):
+		settings = self.server.settings
+		parts = urlsplit(self.path)
+		is_image = parts.path.startswith("/image/")
+
+		time.sleep(settings["image_latency"] if is_image else settings["page_latency"])
+
+		rnd = random.random()
+		if rnd < settings["throttle_rate"]:
+			return self.respond(429, b"", "text/plain", {"Retry-After": "0"})
+		if rnd < settings["throttle_rate"] + settings["error_rate"]:
+			return self.respond(503, b"", "text/plain")
+
+		if is_image:
+			return self.respond(200, self.image(parts.path), "image/jpeg")
+		if parts.path == "/images/search":
+			return self.respond(200, self.resultPage(parse_qs(parts.query)), "text/html")
+		self.respond(404, b"", "text/plain")
+
+	def respond(self, status, body, content_type, headers=None):
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		for k, v in (headers or {}).items():
+			self.send_header(k, v)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def resultPage(self, query):
+		q = query.get("q", [""])[0]
+		first = int(query.get("first", ["1"])[0])
+		count = int(query.get("count", ["35"])[0])
+		host = "http://%s:%s" % self.server.server_address[:2]
+		anchors = []
+		for n in range(first, min(first + count, self.server.settings["results"] + 1)):
+			m = json.dumps({"murl": "%s/image/%s/%s.jpg" % (host, quote(q), n)})
+			anchors.append('<a class="iusc" m="%s" href="#">%s</a>' % (
+				m.replace('"', "&quot;"), n))
+		return ("<html><body>%s</body></html>" % "\n".join(anchors)).encode("utf-8")
+
+	def image(self, path):
+		width, height = self.server.settings["image_size"]
+		rnd = random.Random(path)
+		img = Image.frombytes(
+			"L",
+			(width, height),
+			rnd.getrandbits(8 * width * height).to_bytes(width * height, "little")
+		)
+		buf = BytesIO()
+		img.save(buf, format="JPEG")
+		return buf.getvalue()
+
+
+def _serve(settings, conn):
+	server = ThreadingHTTPServer(("127.0.0.1", 0), BenchHandler)
+	server.settings = settings
+	conn.send(server.server_address[1])
+	server.serve_forever()
+
+
+class BenchServer:
+	""" Starts the stand-in server in a separate process.
+
+		Example usage:
+		```
+		with BenchServer(page_latency=0.05, error_rate=0.01) as server:
+			scraper.bing_base_url = server.bing_base_url
+		```
+	"""
+
+	def __init__(
+		self,
+		page_latency  = 0.0,
+		image_latency = 0.0,
+		error_rate    = 0.0,
+		throttle_rate = 0.0,
+		image_size    = (320, 240),
+		results       = 1000,
+	):
+		self.settings = {
+			"page_latency":  page_latency,
+			"image_latency": image_latency,
+			"error_rate":    error_rate,
+			"throttle_rate": throttle_rate,
+			"image_size":    tuple(image_size),
+			"results":       results,
+		}
+		self.process = None
+		self.port = None
+
+	@property
+	def bing_base_url(self):
+		return "http://127.0.0.1:%s/images/search?q=" % self.port
+
+	def start(self):
+		parent, child = multiprocessing.Pipe()
+		self.process = multiprocessing.Process(target=_serve, args=(self.settings, child))
+		self.process.daemon = True
+		self.process.start()
+		self.port = parent.recv()
+		return self
+
+	def stop(self):
+		if self.process is not None:
+			self.process.terminate()
+			self.process.join()
+			self.process = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *args):
+		self.stop()
@@ -0,0 +1,95 @@
+""" A pool of reusable selenium browsers
+
+	Starting chrome takes seconds, so instead of starting a browser per
+	keyword, browsers are borrowed from a pool and given back when done.
+	A browser that raised a webdriver error is thrown away instead of being
+	given back, and a new one will be started when needed.
+"""
+import queue
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+
+class BrowserPool:
+	""" Holds up to `size` chrome browsers.
+
+		Example usage:
+		```
+		pool = BrowserPool(size=2)
+		with pool.browser() as driver:
+			driver.get(url)
+		pool.close()
+		```
+	"""
+
+	def __init__(self, size=1, headless=True):
+		self.size     = size
+		self.headless = headless
+		self.idle     = queue.Queue()
+		self.all      = []
+		self.lock     = threading.Lock()
+
+	def createBrowser(self):
+		""" Starts a new chrome instance """
+		options = webdriver.ChromeOptions()
+		if self.headless:
+			options.add_argument("--headless")
+			options.add_argument("--window-size=1920,1080")
+		return webdriver.Chrome(chrome_options=options)
+
+	def acquire(self):
+		""" Returns an idle browser, starts one if the pool is not full,
+			otherwise waits for one to be released
+		"""
+		try:
+			return self.idle.get_nowait()
+		except queue.Empty:
+			pass
+		with self.lock:
+			if len(self.all) < self.size:
+				driver = self.createBrowser()
+				self.all.append(driver)
+				return driver
+		return self.idle.get()
+
+	def release(self, driver):
+		self.idle.put(driver)
+
+	def discard(self, driver):
+		""" Quits a broken browser and removes it from the pool """
+		with self.lock:
+			if driver in self.all:
+				self.all.remove(driver)
+		try:
+			driver.quit()
+		except WebDriverException:
+			pass
+
+	@contextmanager
+	def browser(self):
+		""" Context manager lending a browser from the pool """
+		driver = self.acquire()
+		broken = False
+		try:
+			yield driver
+		except WebDriverException:
+			broken = True
+			raise
+		finally:
+			if broken:
+				self.discard(driver)
+			else:
+				self.release(driver)
+
+	def close(self):
+		""" Quits all browsers in the pool """
+		with self.lock:
+			drivers, self.all = self.all, []
+		self.idle = queue.Queue()
+		for driver in drivers:
+			try:
+				driver.quit()
+			except WebDriverException:
+				pass
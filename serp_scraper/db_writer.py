@@ -0,0 +1,93 @@
+""" Batched insertion of scraped images into the db
+
+	Calling `ProtestCursor.insertImage` with `do_commit=True` commits (and
+	thereby fsyncs) once per image, plus once per tag. Here the images are
+	collected and inserted with a single commit every `batch_size` images or
+	every `max_delay` seconds, whichever comes first.
+
+	There is no timer: the delay is only checked when an image is added, so
+	the last images of a quiet spell wait for the next `add` or an explicit
+	`flush`. The writer shares the cursor's session, which must not be used
+	from another thread, so callers flush when they are done, as
+	`Scraper.scrape` does after every search.
+
+	If anything in a batch fails, the batch is rolled back and replayed one
+	image at a time, so that a single bad image only loses itself.
+"""
+import time
+
+
+class BatchedImageWriter:
+	""" Collects the keyword arguments for `ProtestCursor.insertImage`
+		and writes them in batches.
+
+		Example usage:
+		```
+		writer = BatchedImageWriter(pc, batch_size=50)
+		writer.add(path_and_name=path, source="bing", origin="local", ...)
+		...
+		writer.flush()
+		```
+	"""
+
+	def __init__(self, pc, batch_size=50, max_delay=5.0):
+		self.pc         = pc
+		self.batch_size = batch_size
+		self.max_delay  = max_delay
+		self.pending    = []
+		self.paths      = set()
+		self.oldest     = None
+		self.written    = 0
+		self.commits    = 0
+		self.failed     = []   # list of (path_and_name, exception)
+
+	def add(self, **kwargs):
+		""" Queues an image for insertion, see `ProtestCursor.insertImage`
+			for the arguments. The same file is only queued once per batch.
+			Flushes when the batch is full or its oldest image has waited
+			`max_delay` seconds.
+		"""
+		if kwargs['path_and_name'] in self.paths:
+			return
+		self.paths.add(kwargs['path_and_name'])
+		self.pending.append(kwargs)
+		if self.oldest is None:
+			self.oldest = time.monotonic()
+
+		if (len(self.pending) >= self.batch_size or
+				time.monotonic() - self.oldest >= self.max_delay):
+			self.flush()
+
+	def flush(self):
+		""" Writes all queued images, returns the number of images written """
+		if not self.pending:
+			return 0
+		batch = self.pending
+		self.pending = []
+		self.paths = set()
+		self.oldest = None
+
+		try:
+			for kwargs in batch:
+				self.pc.insertImage(do_commit=False, **kwargs)
+			self.pc.try_commit()
+			self.commits += 1
+			self.written += len(batch)
+			return len(batch)
+		except Exception as e:
+			self.pc.session.rollback()
+			print("batch of %s images failed (%s), inserting one by one" % (len(batch), e))
+
+		written = 0
+		for kwargs in batch:
+			try:
+				self.pc.insertImage(do_commit=False, **kwargs)
+				self.pc.try_commit()
+				self.commits += 1
+				written += 1
+			except Exception as e:
+				self.pc.session.rollback()
+				self.failed.append((kwargs['path_and_name'], e))
+				print("could not insert %s: %s" % (kwargs['path_and_name'], e))
+		self.written += written
+		return written
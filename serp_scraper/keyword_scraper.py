@@ -6,24 +6,34 @@
 """
 import os
 import urllib.request
+import urllib.error
 import imagehash
 import serpscrap
 from PIL import Image
 from bs4 import BeautifulSoup
 import json
 import pprint
-from selenium import webdriver
 import time
 from io import BytesIO
 import requests
-from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from protestDB.cursor import ProtestCursor
+from serp_scraper.rate_limiter import RateLimiter, isThrottled
+from serp_scraper.db_writer import BatchedImageWriter
+from serp_scraper.browser_pool import BrowserPool
+
+GOOGLE_META_XPATH = '//div[contains(@class,"rg_meta")]'
+PAGE_HEIGHT_JS = "return document.body.scrollHeight;"
+# where google redirects a browser it takes for a bot, instead of a 429:
+GOOGLE_BLOCKED_PATH = "/sorry/"
 
 
 class Scraper:
 
 
-	def __init__(self, keywords, folder, n_images, timeout, includedb, label, tpe):
+	def __init__(self, keywords, folder, n_images, timeout, includedb, label, tpe, rate_limiter=None,
+		db_batch_size=50, db_batch_seconds=5.0, browser_pool=None):
 		self.includedb = includedb
 		self.type = tpe
 		self.label = label
@@ -34,12 +44,23 @@ class Scraper:
 		self.bing_limit = 210
 		self.bing_images_per_page = 35
 		self.pc = ProtestCursor()
+		self.db_writer = BatchedImageWriter(self.pc, db_batch_size, db_batch_seconds)
+		self.db_summary = None  # the counts of the db writer when they were last printed
 		self.google_base_url = "https://www.google.co.in/search?q="
 		self.google_end_url = "&source=lnms&tbm=isch"
 		self.bing_base_url = "http://www.bing.com/images/search?q=" 
 		self.bing_end_url = "&FORM=HDRSC2"
 		self.bing_header ={'User-Agent':"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/43.0.2357.134 Safari/537.36"}
-		self.google_header = {"Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36"}
+		self.google_header = {'User-Agent':"Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36"}
+		self.google_scroll_wait = 2.0  # seconds to wait for new results after a scroll
+		self.google_max_stale_scrolls = 3  # scrolls that neither add results nor grow the page before giving up
+		# the browser pool is only started when google is scraped, pass a pool
+		# to share the browsers between multiple scrapers:
+		self.browser_pool = browser_pool
+		self.owns_browser_pool = browser_pool is None
+		# shared between search engines and image downloads, pass the same
+		# limiter to multiple scrapers to have them share the buckets:
+		self.rate_limiter = rate_limiter or RateLimiter()
 		createFolder(self.folder) 
 	
 
@@ -52,12 +73,16 @@ class Scraper:
 			print('\n')
 			for keyword in self.keywords:
 				self.scrapeGoogle(keyword)
+			self.flushDB()
+			self.rate_limiter.printMetrics()
 			print('-' * 80)
 			print('\n')
 		elif(searchEng == 'bing'):
 			print('\n')
 			for keyword in self.keywords:
 				self.scrapeBing(keyword)
+			self.flushDB()
+			self.rate_limiter.printMetrics()
 			print('-' * 80)
 			print('\n')
 		else:
@@ -78,8 +103,15 @@ class Scraper:
 		while (True):	
 			first = current_page * self.bing_images_per_page - 34
 			query_url = self.bing_base_url + query + self.bing_end_url + "&first=" + str(first) + "&count=" + str(self.bing_images_per_page)
-			soup = get_soup(query_url,self.bing_header)
-			for a in soup.find_all("a",{"class":"iusc"}):
+			soup = self.getSoup("bing", query_url, self.bing_header)
+			if soup is None:
+				print("bing keeps throttling, giving up on keyword: " + keyword)
+				return
+			anchors = soup.find_all("a",{"class":"iusc"})
+			if not anchors:
+				print("no more results for keyword: " + keyword)
+				return
+			for a in anchors:
 				m = json.loads(a["m"])
 				url = m["murl"]
 				print("(image " + str(current_image) + " out of " + str(self.n_images) + ")" + "downloading url: " + url)
@@ -89,14 +121,13 @@ class Scraper:
 					print('\n')
 					return
 				current_image += 1
-				time.sleep(0.1) 
 			current_page += 1
-			time.sleep(0.3) 
 
 	def scrapeGoogle(self, keyword):
 		"""
-		Scrapes google images using a webdriver that simulates a browser. Here we have to scroll down to the end of the page
-		regardless of how many images we will scrape. From the fully open page we can get the urls and then download the images
+		Scrapes google images. The first results are embedded as json in the html of the result page,
+		so if those are enough we do not need a browser at all. Otherwise a browser from the pool
+		scrolls down the page until `n_images` results are loaded, or until no more results appear.
 		"""
 		print("scraping keyword: " + keyword + " on google")
 		print('\n')
@@ -104,34 +135,105 @@ class Scraper:
 		tags=query
 		query='+'.join(query)
 		query_url = self.google_base_url + query + self.google_end_url
-		driver = webdriver.Chrome()
-		driver.get(query_url)
 
-		img_count = 1
-		element = driver.find_element_by_tag_name("body")
-		# Scroll down
-		for i in range(30):
-		    element.send_keys(Keys.PAGE_DOWN)
-		    time.sleep(0.3)  # bot id protection
+		urls = self.googleUrlsFromHtml(query_url)
+		if len(urls) < self.n_images:
+			urls = self.googleUrlsFromBrowser(query_url)
 
-		driver.find_element_by_id("smb").click()
+		for img_count, url in enumerate(urls[:self.n_images], 1):
+			print("(image " + str(img_count) + " out of " + str(self.n_images) + ")" + "downloading url: " + url)
+			self.saveImageFromUrl(url, self.folder, self.timeout, "google", img_count, tags)
 
-		for i in range(50):
-		    element.send_keys(Keys.PAGE_DOWN)
-		    time.sleep(0.3)  # bot id protection
+	def googleUrlsFromHtml(self, query_url):
+		"""
+		Returns the image urls found in the `rg_meta` json of the plain html result page,
+		without starting a browser. Returns an empty list if anything goes wrong.
+		"""
+		try:
+			self.rate_limiter.acquire("google", query_url)
+			start = time.monotonic()
+			r = requests.get(query_url, headers = self.google_header, timeout = self.timeout)
+			self.rate_limiter.report(
+				"google",
+				query_url,
+				r.status_code,
+				time.monotonic() - start,
+				r.headers.get("Retry-After"),
+			)
+			r.raise_for_status()
+			soup = BeautifulSoup(r.text, 'html.parser')
+			return [
+				json.loads(div.get_text())["ou"]
+				for div in soup.find_all("div", {"class": "rg_meta"})
+			]
+		except Exception as e:
+			print(e)
+			print("could not parse the google result page without a browser")
+			return []
+
+	def googleUrlsFromBrowser(self, query_url):
+		"""
+		Returns the image urls of the result page loaded in a browser from the pool. Scrolls
+		to the bottom of the page only until `n_images` results are present, waiting for new
+		results or a taller page after each scroll instead of sleeping a fixed amount of time.
+		Returns an empty list if the page does not load or google blocks the browser.
+		"""
+		if self.browser_pool is None:
+			self.browser_pool = BrowserPool()
 
-		time.sleep(0.2)
+		with self.browser_pool.browser() as driver:
+			self.rate_limiter.acquire("google", query_url)
+			start = time.monotonic()
+			try:
+				driver.get(query_url)
+			except WebDriverException as e:
+				# no status code from the browser, the same as a failed request:
+				self.rate_limiter.report("google", query_url, None, time.monotonic() - start)
+				print(e)
+				print("could not load the google result page in the browser")
+				return []
+			# the browser does not see the status code, but a blocked browser
+			# ends up on the "sorry" page:
+			status = 429 if GOOGLE_BLOCKED_PATH in driver.current_url else 200
+			self.rate_limiter.report("google", query_url, status, time.monotonic() - start)
+			if isThrottled(status):
+				print("google blocked the browser, see " + driver.current_url)
+				return []
 
-		imges = driver.find_elements_by_xpath('//div[contains(@class,"rg_meta")]')
-		for img in imges:
-			url = json.loads(img.get_attribute('innerHTML'))["ou"]
-			print("(image " + str(img_count) + " out of " + str(self.n_images) + ")" + "downloading url: " + url)
-			self.saveImageFromUrl(url, self.folder, self.timeout, "google", img_count, tags)
-			img_count += 1
+			imges = driver.find_elements_by_xpath(GOOGLE_META_XPATH)
+			stale = 0
+			while len(imges) < self.n_images and stale < self.google_max_stale_scrolls:
+				loaded = len(imges)
+				height = driver.execute_script(PAGE_HEIGHT_JS)
+				self.rate_limiter.acquire("google", query_url)  # bot id protection
+				# to the bottom, where the lazy loading of the next results starts:
+				driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
 
-			if (img_count > self.n_images):
-				break
-		driver.quit()
+				# the "show more results" button shows up after the first ~400 images:
+				more = driver.find_elements_by_id("smb")
+				if more and more[0].is_displayed():
+					more[0].click()
+
+				try:
+					WebDriverWait(driver, self.google_scroll_wait).until(
+						lambda d: (len(d.find_elements_by_xpath(GOOGLE_META_XPATH)) > loaded or
+							d.execute_script(PAGE_HEIGHT_JS) > height)
+					)
+					stale = 0
+				except TimeoutException:
+					stale += 1
+				imges = driver.find_elements_by_xpath(GOOGLE_META_XPATH)
+
+			return [json.loads(img.get_attribute('innerHTML'))["ou"] for img in imges]
+
+	def close(self):
+		"""
+		Writes what is left for the db and quits the browsers, if this scraper started them
+		"""
+		self.flushDB()
+		if self.owns_browser_pool and self.browser_pool is not None:
+			self.browser_pool.close()
+			self.browser_pool = None
 
 
 	def saveImageFromUrl(self, url, folder, timeout, source, pos, tags = None):
@@ -143,7 +245,17 @@ class Scraper:
 		"""
 
 		try:
+			self.rate_limiter.acquire("download", url)
+			start = time.monotonic()
 			r = requests.get(url, timeout = timeout)
+			self.rate_limiter.report(
+				"download",
+				url,
+				r.status_code,
+				time.monotonic() - start,
+				r.headers.get("Retry-After"),
+			)
+			r.raise_for_status()
 			img = Image.open(BytesIO(r.content))
 			#imgpath, headers = urllib.request.urlretrieve(url)
 			#img = Image.open(imgpath)
@@ -152,7 +264,7 @@ class Scraper:
 			path = os.path.join(folder, filename)
 			img.save(path)
 			if(self.includedb):
-				self.pc.insertImage(
+				self.db_writer.add(
 		   			path_and_name = path,
 		   			source        = source,
 		   			origin        = self.type,
@@ -165,6 +277,47 @@ class Scraper:
 			print(e)
 			print("somenthing went wrong scraping the image url")
 
+	def flushDB(self):
+		"""
+		Writes the images still waiting in the db batch, and tells how it went. Silent when
+		nothing changed since the last time, e.g. when `close` flushes after the drivers did
+		"""
+		if not self.includedb:
+			return
+		self.db_writer.flush()
+		summary = (self.db_writer.written, self.db_writer.commits, len(self.db_writer.failed))
+		if summary == self.db_summary:
+			return
+		self.db_summary = summary
+		print("inserted " + str(self.db_writer.written) + " images into the db in " +
+			str(self.db_writer.commits) + " commits, " + str(len(self.db_writer.failed)) + " failed")
+
+	def getSoup(self, engine, url, header, retries=5):
+		"""
+		Rate limited version of `get_soup`. Retries when the server throttles us,
+		and returns None if it keeps doing so.
+		"""
+		for _ in range(retries):
+			self.rate_limiter.acquire(engine, url)
+			start = time.monotonic()
+			try:
+				soup = get_soup(url, header)
+			except urllib.error.HTTPError as e:
+				self.rate_limiter.report(
+					engine,
+					url,
+					e.code,
+					time.monotonic() - start,
+					e.headers.get("Retry-After"),
+				)
+				if not isThrottled(e.code):
+					raise
+				print("throttled by " + engine + " (status " + str(e.code) + "), backing off")
+				continue
+			self.rate_limiter.report(engine, url, 200, time.monotonic() - start)
+			return soup
+		return None
+
 def createFolder(folder_path):
 	"""
 	Creates a folder if it does not exist given a path
@@ -0,0 +1,228 @@
+""" Adaptive rate limiting for the scraper
+
+	Instead of sleeping a fixed amount of time between requests, every request
+	goes through a token bucket, one bucket per (engine, host). The rate of a
+	bucket is adapted from what the server tells us:
+
+		- A successful and fast response slowly increases the rate (additive).
+		- A slow response, compared to a decaying average of the recent
+		  latencies, decreases the rate slightly. Not for the downloads, whose
+		  latency follows the size of the image rather than the load of the
+		  server (`slow_factor` is None).
+		- A 429 or a 5xx response cuts the rate in half (multiplicative) and
+		  blocks the bucket for an exponentially growing backoff period, or
+		  for as long as the `Retry-After` header says.
+
+	In this way we go as fast as the server allows, and back off as soon as
+	the server starts throttling, before the IP is blocked.
+"""
+import time
+import threading
+from urllib.parse import urlsplit
+
+
+# Default settings per engine, everything not listed uses "default":
+DEFAULT_SETTINGS = {
+	"bing":     {"rate": 4.0, "min_rate": 0.2, "max_rate": 10.0, "burst": 3},
+	"google":   {"rate": 3.0, "min_rate": 0.2, "max_rate": 10.0, "burst": 3},
+	"download": {"rate": 10.0, "min_rate": 0.5, "max_rate": 50.0, "burst": 10, "slow_factor": None},
+	"default":  {"rate": 5.0, "min_rate": 0.2, "max_rate": 20.0, "burst": 5},
+}
+
+
+def isThrottled(status):
+	""" Returns True if the http status code means that we should back off """
+	return status is not None and (status == 429 or 500 <= status < 600)
+
+
+def parseRetryAfter(value):
+	""" Parses the value of a `Retry-After` header into seconds,
+		returns None if it is missing or given as a http date
+	"""
+	try:
+		return max(0.0, float(value))
+	except (TypeError, ValueError):
+		return None
+
+
+class TokenBucket:
+	""" A token bucket whose rate adapts from the observed responses.
+		The rate is in requests per second.
+	"""
+
+	def __init__(
+		self,
+		rate,
+		min_rate,
+		max_rate,
+		burst,
+		increase      = 0.1,
+		decrease      = 0.5,
+		slow_factor   = 3.0,
+		smoothing     = 0.1,
+		base_backoff  = 1.0,
+		max_backoff   = 120.0,
+	):
+		self.rate          = float(rate)
+		self.min_rate      = float(min_rate)
+		self.max_rate      = float(max_rate)
+		self.capacity      = float(burst)
+		self.tokens        = float(burst)
+		self.increase      = increase
+		self.decrease      = decrease
+		self.slow_factor   = slow_factor
+		self.smoothing     = smoothing
+		self.base_backoff  = base_backoff
+		self.max_backoff   = max_backoff
+		self.updated       = time.monotonic()
+		self.blocked_until = 0.0
+		self.failures      = 0     # consecutive throttled responses
+		self.avg_latency   = None  # decaying average of the latencies
+
+		# metrics:
+		self.requests       = 0
+		self.throttled      = 0
+		self.backoff_events = 0
+		self.waited         = 0.0
+		self.first_request  = None
+		self.lock           = threading.Lock()
+
+	def _refill(self, now):
+		self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self):
+		""" Blocks until a request is allowed, returns the seconds waited """
+		waited = 0.0
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self._refill(now)
+				if now < self.blocked_until:
+					delay = self.blocked_until - now
+				elif self.tokens >= 1.0:
+					self.tokens   -= 1.0
+					self.requests += 1
+					self.waited   += waited
+					if self.first_request is None:
+						self.first_request = now
+					return waited
+				else:
+					delay = (1.0 - self.tokens) / self.rate
+			time.sleep(delay)
+			waited += delay
+
+	def report(self, status, latency, retry_after=None):
+		""" Adapts the rate given the outcome of a request.
+			`status` is the http status code (None if the request failed
+			without a response) and `latency` is the response time in seconds.
+		"""
+		with self.lock:
+			if isThrottled(status):
+				self.throttled      += 1
+				self.backoff_events += 1
+				self.failures       += 1
+				self.rate = max(self.min_rate, self.rate * self.decrease)
+				backoff = retry_after
+				if backoff is None:
+					backoff = min(
+						self.max_backoff,
+						self.base_backoff * 2 ** (self.failures - 1)
+					)
+				self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+				self.tokens = 0.0
+				return
+
+			if status is None:
+				# Connection errors and timeouts says nothing about throttling
+				return
+
+			self.failures = 0
+			slow = (self.slow_factor is not None and self.avg_latency is not None and
+				latency > self.slow_factor * self.avg_latency)
+			if self.avg_latency is None:
+				self.avg_latency = latency
+			else:
+				self.avg_latency += self.smoothing * (latency - self.avg_latency)
+
+			if slow:
+				self.rate = max(self.min_rate, self.rate * 0.9)
+			else:
+				self.rate = min(self.max_rate, self.rate + self.increase)
+
+	def metrics(self):
+		""" Returns a dict with the metrics of this bucket """
+		with self.lock:
+			elapsed = 0.0
+			if self.first_request is not None:
+				elapsed = time.monotonic() - self.first_request
+			return {
+				"requests":       self.requests,
+				"requests_sec":   self.requests / elapsed if elapsed > 0 else 0.0,
+				"throttled":      self.throttled,
+				"backoff_events": self.backoff_events,
+				"waited_sec":     self.waited,
+				"rate":           self.rate,
+			}
+
+
+class RateLimiter:
+	""" Holds a token bucket per (engine, host). A single instance is meant
+		to be shared by everything that talks to the same servers, e.g.
+		`scrapeBing`, `scrapeGoogle` and the image downloads.
+
+		Example usage:
+		```
+		limiter.acquire("bing", url)
+		... do the request ...
+		limiter.report("bing", url, status, latency)
+		```
+	"""
+
+	def __init__(self, settings=None):
+		self.settings = dict(DEFAULT_SETTINGS)
+		self.settings.update(settings or {})
+		self.buckets  = {}
+		self.lock     = threading.Lock()
+
+	def bucket(self, engine, url):
+		""" Returns the bucket for the engine and the host of `url` """
+		key = (engine, urlsplit(url).netloc)
+		with self.lock:
+			if key not in self.buckets:
+				params = self.settings.get(engine, self.settings["default"])
+				self.buckets[key] = TokenBucket(**params)
+			return self.buckets[key]
+
+	def acquire(self, engine, url):
+		""" Blocks until a request to `url` is allowed """
+		return self.bucket(engine, url).acquire()
+
+	def report(self, engine, url, status, latency, retry_after=None):
+		""" Reports the outcome of a request to `url` """
+		self.bucket(engine, url).report(
+			status,
+			latency,
+			retry_after = parseRetryAfter(retry_after),
+		)
+
+	def metrics(self):
+		""" Returns a dict mapping (engine, host) to the metrics of its bucket """
+		with self.lock:
+			buckets = list(self.buckets.items())
+		return { key: b.metrics() for key, b in buckets }
+
+	def printMetrics(self):
+		""" Prints the metrics of all buckets as a table """
+		row = "{:<10} {:<35} {:>8} {:>8} {:>9} {:>8} {:>8}"
+		print(row.format("engine", "host", "requests", "req/sec", "throttled", "backoffs", "rate"))
+		for (engine, host), m in sorted(self.metrics().items()):
+			print(row.format(
+				engine,
+				host[:35],
+				m["requests"],
+				"%.2f" % m["requests_sec"],
+				m["throttled"],
+				m["backoff_events"],
+				"%.2f" % m["rate"],
+			))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+" This script keeps violence scores up to date while the votes come in,
+" without re-computing the scores from scratch.
+"
+" The votes are read either from an MTurk batch csv file that grows as
+" assignments are submitted (`--batch`), or from the rows added to or
+" updated in the Comparisons table (`--db`), e.g. by `mturk_ingest_driver.py`.
+" Rows of the batch file with a missing image or answer are skipped. Each
+" vote updates the rating of its two images,
+" see `analysis/lib/online_scorer.py`. Every `--snapshot-every` seconds, the
+" ratings are written as labels of `--label-source`, and saved to `--state`
+" so that the next run continues where this one stopped.
+"
+" **Usage:**
+"
+" ```
+"   ./stream_score_driver.py --batch <batch_output_csv> --state live.npz
+"   ./stream_score_driver.py --db --source "Luca Rossi - ECB, 1000" --once
+" ```
+"""
+
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, or_
+
+from protestDB import cursor, models
+from analysis.lib import mturk_batch
+from analysis.lib.online_scorer import GlickoScorer
+
+
+def poll_batch(scorer, csv_path, base=None):
+    """ Adds the votes of the assignments after the first `scorer.cursor`
+    rows of the batch file. Returns the number of votes added """
+    batch = mturk_batch.ReadBatch(csv_path, skiprows=range(1, scorer.cursor + 1))
+    complete = batch[mturk_batch.IMG_COLS + mturk_batch.ANSWER_COLS].notnull().all(axis=1).values
+    # the last row may be partially written and is read again at the next
+    # poll, an incomplete row followed by other rows stays incomplete and
+    # is skipped:
+    n_rows = len(batch) - 1 if len(batch) and not complete[-1] else len(batch)
+    skipped = np.flatnonzero(~complete[:n_rows])
+    if len(skipped):
+        print("Skipping %s incomplete rows of %s: %s" % (
+            len(skipped), csv_path, ", ".join(str(scorer.cursor + r + 1) for r in skipped[:10])))
+    batch = batch.iloc[:n_rows][complete[:n_rows]]
+    scorer.cursor += n_rows
+    if not len(batch):
+        return 0
+    votes, unique_images = mturk_batch.MeltVotes(batch, base=base)
+    scorer.addVotes(votes, [name.split('.')[0] for name in unique_images])
+    return len(votes)
+
+
+class DbStream:
+    """ The position in the Comparisons table: the (timestamp, comparisonID)
+    of the last row read, and the counts read so far of every comparison, so
+    that a comparison updated by `ProtestCursor.upsertComparisons` only adds
+    the votes it gained. Kept in the `extra` arrays of the scorer """
+
+    def __init__(self, pc, scorer):
+        extra = scorer.extra
+        self.timestamp = None
+        if "db_timestamp" in extra and str(extra["db_timestamp"]):
+            self.timestamp = pd.Timestamp(str(extra["db_timestamp"])).to_pydatetime()
+        self.counts = {
+            int(i): tuple(c) for i, c in zip(
+                extra.get("db_ids", np.zeros(0, dtype=np.int64)).tolist(),
+                extra.get("db_counts", np.zeros((0, 3), dtype=np.int64)).tolist(),
+            )
+        }
+        if "db_ids" not in extra and scorer.cursor:
+            # a state of before the updates were streamed, where the rows up
+            # to the comparisonID `scorer.cursor` were read:
+            C = models.Comparisons
+            self.counts = {
+                i: (w1, w2, t) for i, w1, w2, t in pc.query(
+                    C.comparisonID, C.win1, C.win2, C.tie
+                ).filter(C.comparisonID <= scorer.cursor)
+            }
+
+    def store(self, scorer):
+        """ Puts the position into the `extra` arrays of the scorer """
+        ids = sorted(self.counts)
+        scorer.extra["db_timestamp"] = np.array(str(self.timestamp or ""))
+        scorer.extra["db_ids"] = np.array(ids, dtype=np.int64)
+        scorer.extra["db_counts"] = np.array(
+            [self.counts[i] for i in ids], dtype=np.int64
+        ).reshape(-1, 3)
+
+def poll_db(scorer, pc, stream, source=None, chunk=10000):
+    """ Adds the votes of the comparisons inserted or updated since the last
+    poll, in order of (timestamp, comparisonID). Returns the number of
+    comparisons read """
+    C = models.Comparisons
+    q = pc.query(C.comparisonID, C.imageID_1, C.imageID_2, C.win1, C.win2, C.tie, C.timestamp)
+    if stream.timestamp is not None:
+        q = q.filter(or_(
+            C.timestamp > stream.timestamp,
+            and_(C.timestamp == stream.timestamp, C.comparisonID > scorer.cursor),
+        ))
+    if source is not None:
+        q = q.filter(C.source == source)
+    rows = q.order_by(C.timestamp, C.comparisonID).limit(chunk).all()
+    for comparison_id, image1, image2, win1, win2, tie, timestamp in rows:
+        old = stream.counts.get(comparison_id, (0, 0, 0))
+        new = (win1, win2, tie)
+        scorer.addCounts(image1, image2, *[max(n - o, 0) for n, o in zip(new, old)])
+        stream.counts[comparison_id] = new
+        stream.timestamp = timestamp
+        scorer.cursor = comparison_id
+    pc.session.rollback()  # ends the read transaction, to see new rows
+    return len(rows)
+
+
+def main(**kwargs):
+    pc = cursor.ProtestCursor()
+    if kwargs['state']:
+        scorer = GlickoScorer.Load(kwargs['state'])
+    else:
+        scorer = GlickoScorer()
+    stream = None if kwargs['batch'] else DbStream(pc, scorer)
+
+    def snapshot():
+        if kwargs['label_source'] and scorer.n_items:
+            n_labels = scorer.snapshot(pc, kwargs['label_source'])
+            print("Wrote %s labels of '%s'" % (n_labels, kwargs['label_source']))
+        if kwargs['state']:
+            if stream is not None:
+                stream.store(scorer)
+            scorer.save(kwargs['state'])
+
+    last_snapshot = time.time()
+    try:
+        while True:
+            if kwargs['batch']:
+                n = poll_batch(scorer, kwargs['batch'])
+            else:
+                n = poll_db(scorer, pc, stream, kwargs['source'])
+            if n:
+                print("Added %s %s, %s images" % (
+                    n, "votes" if kwargs['batch'] else "comparisons", scorer.n_items))
+            if kwargs['once']:
+                if n and not kwargs['batch']:
+                    continue  # read the remaining chunks of the table
+                break
+            if time.time() - last_snapshot >= kwargs['snapshot_every']:
+                snapshot()
+                last_snapshot = time.time()
+            time.sleep(kwargs['interval'])
+    except KeyboardInterrupt:
+        print("Stopping...")
+    snapshot()
+
+
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description= "Keeps scores up to date with an online rating of the images, "
+                     "updated one vote at a time as the votes come in."
+    )
+    parser.add_argument(
+        "--batch",
+        metavar = "file",
+        type    = str,
+        help    = " An MTurk batch file that is read again every --interval "
+                  " seconds for new assignments."
+    )
+    parser.add_argument(
+        "--db",
+        action  = "store_true",
+        help    = " Read the new rows of the Comparisons table instead of a batch file."
+    )
+    parser.add_argument(
+        "--source",
+        type    = str,
+        help    = " With --db, only use the comparisons of this source."
+    )
+    parser.add_argument(
+        "--state",
+        metavar = "file",
+        type    = str,
+        help    = " A .npz file with the ratings and the position in the batch file "
+                  " or table, created if it does not exist."
+    )
+    parser.add_argument(
+        "--label-source",
+        type    = str,
+        help    = " If set, the ratings replace the labels of this source at every "
+                  " snapshot, e.g. 'Luca Rossi - ECB, live'."
+    )
+    parser.add_argument(
+        "--interval",
+        type    = float,
+        default = 10.0,
+        help    = " Seconds between reads of new votes."
+    )
+    parser.add_argument(
+        "--snapshot-every",
+        type    = float,
+        default = 300.0,
+        help    = " Seconds between snapshots of the ratings into the labels and the state."
+    )
+    parser.add_argument(
+        "--once",
+        action  = "store_true",
+        help    = " Read the votes available now, snapshot and exit."
+    )
+
+    args = parser.parse_args()
+    if bool(args.batch) == args.db:
+        parser.error("Give exactly one of --batch or --db")
+    main(**vars(args))
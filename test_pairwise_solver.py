@@ -0,0 +1,80 @@
+"""
+This script tests that the scores of `analysis/lib/pairwise_solver.py` are the ones that
+`choix.opt_pairwise` computed so far on the expanded (winner, loser) tuples:
+- `mturk_batch.ChoixTuples` gives the same tuples as the row by row expansion
+- `OptChoixPairwise` matches `choix.opt_pairwise` on a random graph with ties
+"""
+
+import unittest
+import choix
+import numpy as np
+import pandas as pd
+from analysis.lib import mturk_batch, pairwise_solver
+
+
+N_ITEMS = 200
+N_PAIRS = 2000
+VOTES = 5
+
+
+def RandomComparisons(seed=0):
+    """ Returns the aggregated comparisons of a random graph, as a data frame
+    with the columns index1, index2, win1, win2 and tie """
+    rng = np.random.RandomState(seed)
+    true = rng.normal(size=N_ITEMS)
+    index1 = rng.randint(0, N_ITEMS, N_PAIRS)
+    index2 = rng.randint(0, N_ITEMS, N_PAIRS)
+    keep = index1 != index2
+    index1, index2 = index1[keep], index2[keep]
+    p = 1 / (1 + np.exp(true[index2] - true[index1]))
+    win1 = rng.binomial(VOTES, 0.8 * p)
+    tie = rng.binomial(VOTES - win1, 0.3)
+    return pd.DataFrame({
+        "index1": index1,
+        "index2": index2,
+        "win1":   win1,
+        "win2":   VOTES - win1 - tie,
+        "tie":    tie,
+    }, columns=["index1", "index2", "win1", "win2", "tie"])
+
+
+class TestPairwiseSolver(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.comparisons = RandomComparisons()
+
+    def test_choix_tuples(self):
+        # the expansion of mturk_score_driver.py, one row at a time:
+        tuples = []
+        for row in self.comparisons.itertuples():
+            a, b = row.index1, row.index2
+            for _ in range(row.win1):
+                tuples.append((a, b))
+                tuples.append((a, b))
+            for _ in range(row.win2):
+                tuples.append((b, a))
+                tuples.append((b, a))
+            for _ in range(row.tie):
+                tuples.append((a, b))
+                tuples.append((b, a))
+        self.assertEqual(mturk_batch.ChoixTuples(self.comparisons), tuples)
+
+    def test_matches_choix(self):
+        c = self.comparisons
+        expected = choix.opt_pairwise(N_ITEMS, mturk_batch.ChoixTuples(c))
+        expected -= expected.mean()
+        params = pairwise_solver.OptChoixPairwise(
+            N_ITEMS,
+            c["index1"].values,
+            c["index2"].values,
+            c["win1"].values,
+            c["win2"].values,
+            c["tie"].values,
+        )
+        self.assertLess(np.max(np.abs(params - expected)), 1e-2)
+        self.assertGreater(np.corrcoef(params, expected)[0, 1], 0.9999)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,9 +17,9 @@ and on the images that are sitting on amazon s3 bucket. The tests are as follow:
 
 import unittest
 import argparse
-import csv
+import numpy as np
 from protestDB import cursor
-from protestDB import models
+import turk_input_validator as validator
 from amazon_input_driver import url
 import asyncio
 import aiohttp
@@ -32,80 +32,41 @@ PATH_CSV = "mturk-input.csv"
 
 class TestTurkInput(unittest.TestCase):
 
-    def setUp(self):
-        self.pc = cursor.ProtestCursor()
-        self.data = {}
-        self.rows = []
-        self.unique_images = set()
-        with open(PATH_CSV, 'r') as f:
-            csvreader = csv.reader(f, delimiter = ',')
-            next(csvreader)
-            for row in csvreader:
-                row_dict = {}
-                img_as = row[::2] # gets every second image
-                img_bs = row[1::2] # gets every second image starting from index 1
+    @classmethod
+    def setUpClass(cls):
+        # the csv is parsed once for all tests, see `turk_input_validator.py`:
+        cls.pc = cursor.ProtestCursor()
+        cls.images, cls.index1, cls.index2, cls.hit, _ = validator.parse_input(PATH_CSV)
+        cls.unique_images = [url + name for name in cls.images]
 
-                for i in range(len(img_as)):
-                    # checks if there are pairs of the same image
-                    assert img_as[i] != img_bs[i], "there was a duplicate"
-
-
-                    # ads the first image to the dictonary
-                    if (img_as[i] in self.data):
-                        self.data[img_as[i]].append(img_bs[i])
-                    else:
-                        self.data[img_as[i]] = [img_bs[i]]
-
-                    # ads the second image to the dictonary
-                    if (img_bs[i] in self.data):
-                        self.data[img_bs[i]].append(img_as[i])
-                    else:
-                        self.data[img_bs[i]] = [img_as[i]]
-
-                    # keep a count of how many times each image appears
-                    if img_as[i] in row_dict:
-                        row_dict[img_as[i]] += 1
-                    else:
-                        row_dict[img_as[i]] = 1
-
-                    if img_bs[i] in row_dict:
-                        row_dict[img_bs[i]] += 1
-                    else:
-                        row_dict[img_bs[i]] = 1
-
-
-                    self.unique_images.update([img_bs[i], img_as[i]])
-
-                self.rows.append(row_dict)
+    def test_no_same_image_pairs(self):
+        same = self.index1 == self.index2
+        self.assertFalse(same.any(), msg="there was a duplicate: %s" % (
+            self.images[self.index1[same]][:10].tolist()))
 
     def test_image_has_10_pairs(self):
-        for key in self.data:
-            self.assertEqual(len(self.data[key]), 10)
+        degree = np.bincount(np.concatenate([self.index1, self.index2]),
+                             minlength=len(self.images))
+        wrong = degree != 10
+        self.assertFalse(wrong.any(),
+                         msg="%s" % dict(zip(self.images[wrong][:10], degree[wrong][:10].tolist())))
 
     # This test should fail if a single image appears 5 times in one hit
     def test_frequency_repetition(self):
-
-        for dic in self.rows:
-            for key in dic:
-                self.assertLess(dic[key], 5)
+        hit = np.concatenate([self.hit, self.hit])
+        image = np.concatenate([self.index1, self.index2])
+        _, counts = np.unique(hit * len(self.images) + image, return_counts=True)
+        self.assertLess(counts.max(), 5)
 
     def test_unique_images(self):
-        self.assertEqual(len(self.unique_images), 1000)
+        self.assertEqual(len(self.images), 1000)
 
     def test_images_source(self):
-        for image_name in self.unique_images:
-            #print("img_name: ", image_name)
-            img_hash = image_name[len(url):]
-            #print("img_hash: ",img_hash)
-            img = self.pc.queryImages().filter_by(name=img_hash).one()
-            # remember, this is line below is based on the assumption that
-            # there is a one to one correspondence
-            # between protestNonProtestVotes and image
-            vote = self.pc.get(models.ProtestNonProtestVotes, imageID = img.imageHASH)
-            #print("img", img)
-            # img = self.pc.getImage(img_hash)
-            self.assertEqual(img.source, "Luca Rossi - ECB")
-            self.assertEqual(vote.is_protest, True)
+        # a joined query per 500 images, instead of two queries per image:
+        checks = validator.check_database(self.pc, self.images, source="Luca Rossi - ECB")
+        self.assertTrue(checks["in_database"]["ok"], msg=str(checks["in_database"]))
+        self.assertTrue(checks["source"]["ok"], msg=str(checks["source"]))
+        self.assertTrue(checks["protest"]["ok"], msg=str(checks["protest"]))
 
     def test_image_available(self):
         """ Test that each image URL is available from Amazon S3
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+" This script validates an MTurk input csv, as written by
+" `amazon_input_driver.py`, and writes a json report of the checks:
+"
+" - no pair is made with the same image
+" - no pair occurs twice
+" - every image has exactly `--pairs-per-image` pairs
+" - no image occurs more than `--max-per-hit` times in a single hit
+" - there are `--n-images` unique images
+" - all images are in the database, come from `--source` and were labeled
+"   as protest related
+"
+" The csv is parsed once into arrays of image codes and all checks are
+" vectorized, the database checks take a joined query per 500 images. It exits with
+" status 1 when a check fails.
+"
+" **Usage:**
+"
+" ```
+"   ./turk_input_validator.py mturk-input.csv --report validation.json
+"   ./turk_input_validator.py mturk-input.csv --n-images 0 --no-db
+" ```
+"""
+
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+from protestDB import models
+from protestDB.cursor import ProtestCursor
+from analysis.lib.mturk_batch import BASE_URL as url
+from analysis.lib.hit_packer import MAX_PER_HIT
+
+SOURCE = "Luca Rossi - ECB"
+
+
+def parse_input(csv_path, prefix=url):
+    """
+        Parses the MTurk input csv. Returns the image names, without
+        `prefix`, and the arrays index1 and index2 into them and hit, the
+        row of each pair. Pairs with a missing image are left out, their
+        number is returned last.
+    """
+    cells = pd.read_csv(csv_path, dtype=str).values
+    n_hits = len(cells)
+    hit = np.repeat(np.arange(n_hits, dtype=np.int64), cells.shape[1] // 2)
+    cells = cells[:, :cells.shape[1] // 2 * 2].reshape(-1, 2)
+    present = pd.notnull(cells).all(axis=1)
+    cells, hit = cells[present], hit[present]
+
+    codes, images = pd.factorize(cells.ravel())
+    images = pd.Series(images, dtype=object)
+    if prefix:
+        starts = images.str.startswith(prefix)
+        images[starts] = images[starts].str.slice(len(prefix))
+    codes = codes.reshape(-1, 2)
+    return (np.asarray(images, dtype=object), codes[:, 0].astype(np.int64),
+            codes[:, 1].astype(np.int64), hit, int((~present).sum()))
+
+
+def _check(ok, count, examples, n_examples, **extra):
+    """ One entry of the report """
+    check = {"ok": bool(ok), "count": int(count), "examples": examples[:n_examples]}
+    check.update(extra)
+    return check
+
+
+def check_structure(images, index1, index2, hit, pairs_per_image=10, max_per_hit=MAX_PER_HIT,
+                    n_images=1000, n_examples=10):
+    """
+        Returns the checks of the pairs, see the module docstring. A
+        `pairs_per_image` or `n_images` of 0 skips that check.
+    """
+    n_items = len(images)
+    checks = {}
+
+    same = np.flatnonzero(index1 == index2)
+    checks["same_image_pairs"] = _check(
+        not len(same), len(same),
+        [{"hit": int(hit[p]), "image": images[index1[p]]} for p in same[:n_examples]],
+        n_examples,
+    )
+
+    keys = np.minimum(index1, index2) * n_items + np.maximum(index1, index2)
+    values, counts = np.unique(keys, return_counts=True)
+    repeated = counts > 1
+    checks["duplicate_pairs"] = _check(
+        not repeated.any(), repeated.sum(),
+        [{"image1": images[k // n_items], "image2": images[k % n_items], "count": int(c)}
+         for k, c in zip(values[repeated][:n_examples].tolist(), counts[repeated][:n_examples].tolist())],
+        n_examples,
+    )
+
+    if pairs_per_image:
+        degree = np.bincount(np.concatenate([index1, index2]), minlength=n_items)
+        wrong = np.flatnonzero(degree != pairs_per_image)
+        checks["pairs_per_image"] = _check(
+            not len(wrong), len(wrong),
+            [{"image": images[i], "pairs": int(degree[i])} for i in wrong[:n_examples]],
+            n_examples,
+            expected = pairs_per_image,
+            min      = int(degree.min()) if n_items else 0,
+            max      = int(degree.max()) if n_items else 0,
+        )
+
+    per_hit = np.concatenate([hit, hit]) * n_items + np.concatenate([index1, index2])
+    values, counts = np.unique(per_hit, return_counts=True)
+    over = counts > max_per_hit
+    checks["per_hit_frequency"] = _check(
+        not over.any(), over.sum(),
+        [{"hit": int(k // n_items), "image": images[k % n_items], "count": int(c)}
+         for k, c in zip(values[over][:n_examples].tolist(), counts[over][:n_examples].tolist())],
+        n_examples,
+        max = max_per_hit,
+    )
+
+    if n_images:
+        checks["unique_images"] = _check(n_items == n_images, n_items, [], n_examples,
+                                         expected = n_images)
+    return checks
+
+
+def check_database(pc, images, source=SOURCE, n_examples=10, chunk_size=500):
+    """
+        Returns the checks of the images against the database, with a
+        query joining the images and their protest votes per `chunk_size`
+        images, see `ProtestCursor.getImageNames`.
+    """
+    I, V = models.Images, models.ProtestNonProtestVotes
+    names = list(images)
+    rows = []
+    for start in range(0, len(names), chunk_size):
+        rows.extend(pc.query(I.name, I.source, V.is_protest).outerjoin(
+            V, V.imageID == I.imageHASH
+        ).filter(
+            I.name.in_(names[start:start + chunk_size])
+        ).all())
+    rows = pd.DataFrame(rows, columns=["name", "source", "is_protest"])
+    # an image is protest related when it has votes, all of them protest:
+    per_image = rows.groupby("name").agg({
+        "source":     lambda s: s.iloc[0],
+        "is_protest": lambda v: bool(v.notnull().all() and v.astype(bool).all()),
+    }).reindex(images)
+
+    missing = per_image.index[per_image["source"].isnull()].tolist()
+    found = per_image[per_image["source"].notnull()]
+    other = found.index[found["source"] != source].tolist()
+    not_protest = found.index[~found["is_protest"].astype(bool)].tolist()
+    return {
+        "in_database": _check(not missing, len(missing), missing, n_examples),
+        "source": _check(
+            not other, len(other),
+            [{"image": n, "source": found.at[n, "source"]} for n in other[:n_examples]],
+            n_examples,
+            expected = source,
+        ),
+        "protest": _check(not not_protest, len(not_protest), not_protest, n_examples),
+    }
+
+
+def validate(csv_path, prefix=url, pairs_per_image=10, max_per_hit=MAX_PER_HIT, n_images=1000,
+             source=SOURCE, pc=None, n_examples=10):
+    """
+        Returns the report of `csv_path` as a dict, `pc` is the cursor of
+        the database checks, which are skipped if it is None.
+    """
+    images, index1, index2, hit, n_missing = parse_input(csv_path, prefix)
+    checks = {
+        "missing_images": _check(not n_missing, n_missing, [], n_examples),
+    }
+    checks.update(check_structure(images, index1, index2, hit, pairs_per_image, max_per_hit,
+                                  n_images, n_examples))
+    if pc is not None:
+        checks.update(check_database(pc, images, source, n_examples))
+    return {
+        "csv":    csv_path,
+        "hits":   int(len(np.unique(hit))),
+        "pairs":  int(len(index1)),
+        "images": int(len(images)),
+        "ok":     all(c["ok"] for c in checks.values()),
+        "checks": checks,
+    }
+
+
+def main(**kwargs):
+    report = validate(
+        kwargs['csv_path'],
+        prefix          = kwargs['prefix'],
+        pairs_per_image = kwargs['pairs_per_image'],
+        max_per_hit     = kwargs['max_per_hit'],
+        n_images        = kwargs['n_images'],
+        source          = kwargs['source'],
+        pc              = None if kwargs['no_db'] else ProtestCursor(),
+        n_examples      = kwargs['examples'],
+    )
+    as_json = json.dumps(report, indent=2, sort_keys=True)
+    if kwargs['report']:
+        with open(kwargs['report'], "w") as f:
+            f.write(as_json + "\n")
+        for name, check in sorted(report["checks"].items()):
+            print("%-20s %-5s %s" % (name, "ok" if check["ok"] else "FAIL", check["count"]))
+    else:
+        print(as_json)
+    return report["ok"]
+
+
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description= "Validates an MTurk input csv and writes a json report of the checks."
+    )
+    parser.add_argument(
+        "csv_path",
+        nargs   = "?",
+        default = "mturk-input.csv",
+        help    = " The MTurk input csv (default: 'mturk-input.csv')."
+    )
+    parser.add_argument(
+        "--report",
+        help    = " Write the json report to this file instead of printing it."
+    )
+    parser.add_argument(
+        "--pairs-per-image",
+        default = 10,
+        type    = int,
+        help    = " The number of pairs of every image, 0 to skip the check (default: 10)."
+    )
+    parser.add_argument(
+        "--max-per-hit",
+        default = MAX_PER_HIT,
+        type    = int,
+        help    = " The most times an image may occur in a single hit (default: %s)." % MAX_PER_HIT
+    )
+    parser.add_argument(
+        "--n-images",
+        default = 1000,
+        type    = int,
+        help    = " The number of unique images, 0 to skip the check (default: 1000)."
+    )
+    parser.add_argument(
+        "--source",
+        default = SOURCE,
+        help    = " The source of all images (default: '%s')." % SOURCE
+    )
+    parser.add_argument(
+        "--prefix",
+        default = url,
+        help    = " The url in front of the image names (default: '%s')." % url
+    )
+    parser.add_argument(
+        "--no-db",
+        action  = "store_true",
+        help    = " Skip the checks against the database."
+    )
+    parser.add_argument(
+        "--examples",
+        default = 10,
+        type    = int,
+        help    = " The number of failing images or pairs listed per check (default: 10)."
+    )
+
+    sys.exit(0 if main(**vars(parser.parse_args())) else 1)
@@ -1,21 +1,21 @@
 
 import argparse
-from protestDB import cursor
+from protestDB import cursor, models
 import pandas as pd
 from analysis.lib import csv_scores as cs
+from analysis.lib import bootstrap
+from analysis.lib.score_cache import CachedScores
+from analysis.lib.comparison_graph import IndexComparisons
+from analysis.lib.score_state import ScoreState
 import matplotlib.pyplot as plt
-import os
 
 PATH_TO_SAVE = "drivers_output/UCLA_database_scores.csv"
+CACHE_DIR = "drivers_output/score_cache"
 
 def get_name_hash_mapping(pc):
-	imgs = pc.getImages()
-	img_name_hash = {}
-	for im in imgs:
-		img_name_hash[im.name] = im.imageHASH
-	return img_name_hash
+	return dict(pc.query(models.Images.name, models.Images.imageHASH))
 
-def main(db, csv_out):
+def main(db, csv_out, state_path=None, n_bootstrap=0, cache_dir=CACHE_DIR):
 	pc = cursor.ProtestCursor()
 	img_name_hash = get_name_hash_mapping(pc) # establish a mapping between names and hashes
 	query = "select a.timestamp, b.name as image1, \
@@ -25,10 +25,47 @@ def main(db, csv_out):
 	where b.source = 'UCLA' and c.source = 'UCLA'\
 	order by a.timestamp desc"
 	df = pd.read_sql(query, pc.session.bind)
-	if not os.path.exists(csv_out):
+	if state_path:
+		# only the comparisons newer than the state are added to it:
+		state = ScoreState.Load(state_path)
+		if state.timestamp is not None:
+			df = df[df['timestamp'].astype(str) > state.timestamp]
+		print("Updating scores with %s new comparisons..." % len(df))
+		if len(df):
+			state.update(df)
+			state.save(state_path)
+		state.scores()[['violence', 'fname']].to_csv(csv_out)
+	else:
+		# computed only if the comparisons changed since the last run:
 		print("Generating scores...")
-		cs.GenerateChoixScores(df, csv_out)
-	scores = cs.MinMax(cs.ReadScoresFromCsv(csv_out), "violence")
+		CachedScores(df, cache_dir, source="UCLA").to_csv(csv_out)
+	raw = cs.ReadScoresFromCsv(csv_out)
+	scores = cs.MinMax(raw, "violence")
+	scores['ci_low'] = scores['ci_high'] = None
+
+	if n_bootstrap:
+		# resample the comparisons, with the state all of them are in its counts:
+		print("Bootstrapping %s replicates..." % n_bootstrap)
+		if state_path:
+			names, index1, index2 = state.names, state.index1, state.index2
+			win1, win2, tie = state.win1, state.win2, state.tie
+			solver_kwargs = state.solver_kwargs
+		else:
+			names, index1, index2 = IndexComparisons(df)
+			win1, win2, tie = df['win1'].values, df['win2'].values, df['tie'].values
+			solver_kwargs = {}
+		params = raw.set_index('fname')['violence'].reindex(names).fillna(0).values
+		samples = bootstrap.BootstrapComparisons(
+			len(names), index1, index2, win1, win2, tie, B=n_bootstrap, params=params,
+			**solver_kwargs
+		)
+		low, high = bootstrap.ConfidenceIntervals(samples)
+		ci = pd.DataFrame({
+			'ci_low':  bootstrap.ScaleLike(low, raw['violence']),
+			'ci_high': bootstrap.ScaleLike(high, raw['violence']),
+		}, index=names)
+		scores['ci_low'] = scores['fname'].map(ci['ci_low'])
+		scores['ci_high'] = scores['fname'].map(ci['ci_high'])
 
 	# check distribution
 	print("close plot to continue")
@@ -38,17 +75,15 @@ def main(db, csv_out):
 	plt.show()
 
 	if (db):
-		for index, row in scores.iterrows():
-			im_hash = img_name_hash[row['fname']]
-			violence = row['violence']
-			label = pc.insertLabel(
-	            im_hash,
-	            violence,
-	            source = "UCLA original",
-	            do_commit=False,
-        	)
-			print("Inserting:\n\t%s" % label)
-		pc.try_commit()
+		# replaces the previous UCLA labels in one transaction:
+		n_labels = pc.writeLabels(
+			"UCLA original",
+			scores['fname'].map(img_name_hash),
+			scores['violence'],
+			ci_low = scores['ci_low'],
+			ci_high = scores['ci_high'],
+		)
+		print("Inserted %s labels" % n_labels)
 
 
 
@@ -68,8 +103,28 @@ if __name__ == '__main__':
 		"--include_db",
 		action = "store_true"
 	)
+	parser.add_argument(
+		"--state",
+		help='a .npz file with the persisted score state, if set the scores are updated\
+		with the comparisons added since the last run, and written to the csv output',
+	)
+
+	parser.add_argument(
+		"--bootstrap",
+		metavar = "B",
+		type = int,
+		default = 0,
+		help='if set, the scores are re-computed on B bootstrap resamples of the comparisons\
+		and the 95%% confidence interval of each label is stored with it',
+	)
+
+	parser.add_argument(
+		"--cache_dir",
+		help='the folder of the cached scores, keyed by the content of the comparisons',
+		default = CACHE_DIR
+	)
 
 	args = parser.parse_args()
-	main(args.include_db, args.csv_output)
+	main(args.include_db, args.csv_output, args.state, args.bootstrap, args.cache_dir)
 
 